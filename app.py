@@ -3,6 +3,9 @@ load_dotenv() # Load environment variables from .env file
 
 import streamlit as st
 import os
+from utils.metrics import start_metrics_server
+from utils.media_store import get_media_store
+from utils.session_resources import start_session_janitor
 
 # --- Function to load CSS ---
 def load_css(file_path):
@@ -22,6 +25,14 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# Serve /metrics when METRICS_PORT is set (once per process)
+start_metrics_server()
+
+# Clean up temp files and media of ended sessions, and sweep leftovers from a previous run
+# (creating the media store clears media spilled by an earlier process)
+start_session_janitor()
+get_media_store()
+
 # --- Apply Custom CSS ---
 # Load the CSS from the specified path
 custom_css = load_css("docs/UI/css/main.css")
@@ -0,0 +1,18 @@
+-- Hourly token usage and cost rollups, written in batches by utils/usage.py
+CREATE TABLE IF NOT EXISTS usage_rollups (
+    period_start TIMESTAMP NOT NULL,  -- start of the UTC hour
+    user_id TEXT NOT NULL,
+    provider TEXT NOT NULL,
+    model TEXT NOT NULL,
+    conversation_id TEXT NOT NULL DEFAULT '',
+    requests INTEGER NOT NULL DEFAULT 0,
+    input_tokens BIGINT NOT NULL DEFAULT 0,
+    output_tokens BIGINT NOT NULL DEFAULT 0,
+    estimated_requests INTEGER NOT NULL DEFAULT 0,  -- calls whose tokens were estimated, not reported
+    cost_usd NUMERIC(14, 6) NOT NULL DEFAULT 0,
+    latency_seconds DOUBLE PRECISION NOT NULL DEFAULT 0,  -- summed; divide by requests for the mean
+    PRIMARY KEY (period_start, user_id, provider, model, conversation_id)
+);
+
+CREATE INDEX IF NOT EXISTS usage_rollups_user_period ON usage_rollups (user_id, period_start);
+CREATE INDEX IF NOT EXISTS usage_rollups_model_period ON usage_rollups (model, period_start);
@@ -1,9 +1,17 @@
 import streamlit as st
 import os
+import time
+import uuid
 # Import model utilities
-from utils.models import generate_chat_response, SUPPORTED_MODELS
+from utils.models import generate_chat_response, compare_chat_responses, SUPPORTED_MODELS
 # Import GCS history functions
 from utils.gcs_history import load_history, save_history, delete_history
+from utils.metrics import start_metrics_server
+from utils.tracing import span
+from utils.usage import usage_scope
+from utils.chat_view import render_chat_window, reset_chat_window
+from utils.generation_jobs import cancel_other_jobs, pop_job, start_job
+from utils.streaming import STREAM_RENDER_INTERVAL_SECONDS, render_markdown_stream
 
 # --- Function to load CSS ---
 def load_css(file_path):
@@ -15,6 +23,49 @@ def load_css(file_path):
         st.error(f"CSS file not found at {file_path}")
         return ""
 
+# --- Chat History ---
+def render_chat_message(message, prepared):
+    """Draw one history message, noting fallback answers and semantic cache hits."""
+    avatar = "👤" if message["role"] == "user" else "🤖"
+    with st.chat_message(message["role"], avatar=avatar):
+        st.markdown(prepared.text)
+        served_by = message.get("model")
+        if served_by and served_by != st.session_state.current_model:
+            st.caption(f"Answered by {served_by} (fallback)")
+        cached_from = message.get("cached_from")
+        if cached_from:
+            st.caption(f"From cache: answer to your earlier question, \"{cached_from['prompt']}\" "
+                       f"({cached_from['similarity']:.0%} match)")
+
+# --- Compare Mode Helpers ---
+def format_run_stats(run):
+    """One-line timing and token summary for a compare-mode answer."""
+    parts = []
+    if run.ttft_seconds is not None:
+        parts.append(f"first token {run.ttft_seconds:.1f}s")
+    if run.latency_seconds is not None:
+        parts.append(f"total {run.latency_seconds:.1f}s")
+    if run.output_tokens is not None:
+        tokens = f"{run.output_tokens} tokens out"
+        if run.input_tokens is not None:
+            tokens = f"{run.input_tokens} in / {tokens}"
+        parts.append(tokens)
+    return " · ".join(parts)
+
+def render_comparison(comparison):
+    """Show a finished comparison side by side."""
+    with st.chat_message("user", avatar="👤"):
+        st.markdown(comparison["prompt"])
+    runs = list(comparison["results"].values())
+    for column, run in zip(st.columns(len(runs)), runs):
+        with column:
+            st.markdown(f"**{run.model_key}**")
+            if run.error:
+                st.error(run.error)
+            else:
+                st.markdown(run.text)
+            st.caption(format_run_stats(run))
+
 # --- Page Configuration (First st command) ---
 st.set_page_config(
     page_title="Main Chat - Gemini's Garden",
@@ -28,6 +79,9 @@ custom_css = load_css("docs/UI/css/main.css")
 if custom_css:
     st.markdown(custom_css, unsafe_allow_html=True)
 
+# Serve /metrics when METRICS_PORT is set (once per process)
+start_metrics_server()
+
 # --- Session State Initialization --- 
 if "messages" not in st.session_state:
     st.session_state.messages = []
@@ -39,6 +93,12 @@ if "current_temperature" not in st.session_state:
     st.session_state.current_temperature = float(os.environ.get("DEFAULT_TEMPERATURE", 0.7))
 if "history_loaded_for_model" not in st.session_state: # Track if history was loaded for the current model
     st.session_state.history_loaded_for_model = None
+if "client_id" not in st.session_state: # Anonymous per-session id, used for per-user rate limiting
+    st.session_state.client_id = str(uuid.uuid4())
+if "main_chat_id" not in st.session_state: # Identifies the conversation on screen, for its generation jobs
+    st.session_state.main_chat_id = None
+if "main_chat_failed" not in st.session_state: # (job key, error) of the last turn that failed
+    st.session_state.main_chat_failed = None
 
 available_models = list(SUPPORTED_MODELS.keys())
 
@@ -67,6 +127,7 @@ with st.sidebar:
             st.session_state.current_model = selected_key_from_dropdown # Update the active model
             st.session_state.messages = [] # Clear messages when switching models
             st.session_state.history_loaded_for_model = None # Reset history loaded flag
+            reset_chat_window("main_chat")
             st.rerun() # Rerun immediately to load new history
         elif st.session_state.current_model is None: # Handle initial load
              st.session_state.current_model = selected_key_from_dropdown
@@ -82,6 +143,20 @@ with st.sidebar:
         "Temperature", 0.0, 1.0, st.session_state.current_temperature, 0.05, key="temperature_slider"
     )
 
+    # Compare Mode
+    st.divider()
+    st.subheader("Compare Models")
+    compare_mode = st.toggle("Compare mode", key="compare_mode",
+                             help="Send one prompt to several models at once and see the answers side by side.")
+    if compare_mode:
+        st.multiselect(
+            "Models to compare:",
+            available_models,
+            default=available_models[:2],
+            max_selections=4,
+            key="compare_models"
+        )
+
     # Clear Chat Button
     st.divider()
     if st.button("🗑️ Clear Current Chat History", key="clear_chat_button"):
@@ -91,6 +166,7 @@ with st.sidebar:
             # Clear local state
             st.session_state.messages = []
             st.session_state.history_loaded_for_model = None # Ensure it reloads empty next time
+            reset_chat_window("main_chat")
             st.rerun()
         else:
             st.warning("No model selected to clear history for.")
@@ -101,6 +177,10 @@ if st.session_state.current_model and st.session_state.history_loaded_for_model
     print(f"Loading history for: {st.session_state.current_model}") # Debug print
     st.session_state.messages = load_history(st.session_state.current_model)
     st.session_state.history_loaded_for_model = st.session_state.current_model # Mark history as loaded
+    # A new conversation is on screen; answers still running for the previous one are no longer wanted
+    st.session_state.main_chat_id = str(uuid.uuid4())
+    st.session_state.main_chat_failed = None
+    cancel_other_jobs("main_chat:")
     if not st.session_state.messages:
         print("No history found or loaded, starting fresh.") # Debug print
     # st.rerun() # Rerun after loading history to ensure display
@@ -109,17 +189,53 @@ if st.session_state.current_model and st.session_state.history_loaded_for_model
 # --- Main Chat Area --- 
 st.title("💬 Gemini's Garden - Chat")
 
+# --- Compare Mode --- 
+# One prompt goes to every selected model concurrently; the current chat is sent as context
+# but the answers are not added to it.
+if compare_mode:
+    compare_keys = st.session_state.get("compare_models") or []
+    compare_prompt = st.chat_input("Send one prompt to every selected model...", key="compare_input")
+    if compare_prompt and len(compare_keys) >= 2:
+        with st.chat_message("user", avatar="👤"):
+            st.markdown(compare_prompt)
+        placeholders = {}
+        for column, key in zip(st.columns(len(compare_keys)), compare_keys):
+            with column:
+                st.markdown(f"**{key}**")
+                placeholders[key] = st.empty()
+        texts = {key: "" for key in compare_keys}
+        drawn_at = {key: 0.0 for key in compare_keys}
+        results = {}
+        for key, text in compare_chat_responses(
+            compare_keys,
+            compare_prompt,
+            st.session_state.messages,
+            temperature=st.session_state.current_temperature,
+            user_id=st.session_state.get("user") or st.session_state.client_id,
+            results=results
+        ):
+            texts[key] += text
+            # Redraw each column at most once per render interval; the rerun below shows the final text
+            now = time.monotonic()
+            if now - drawn_at[key] >= STREAM_RENDER_INTERVAL_SECONDS:
+                placeholders[key].markdown(texts[key])
+                drawn_at[key] = now
+        st.session_state.last_comparison = {"prompt": compare_prompt, "results": results}
+        st.rerun()
+    elif compare_prompt:
+        st.warning("Select at least two models to compare.")
+    elif st.session_state.get("last_comparison"):
+        render_comparison(st.session_state.last_comparison)
+    st.stop()
+
 # Use columns to create a centered chat area
 col1, col2, col3 = st.columns([1, 6, 1])
 
 with col2:
     chat_display_container = st.container() # height styling might need CSS adjustments
     with chat_display_container:
-        # Display messages currently in session state
-        for message in st.session_state.messages:
-            avatar = "👤" if message["role"] == "user" else "🤖"
-            with st.chat_message(message["role"], avatar=avatar):
-                st.markdown(message["content"])
+        # Display the most recent messages; older ones load on demand
+        render_chat_window(st.session_state.messages, key="main_chat", render=render_chat_message)
 
 # Chat input
 user_input = st.chat_input(f"Chat with {st.session_state.current_model}...")
@@ -137,7 +253,18 @@ elif user_input and not st.session_state.current_model:
 
 # --- AI Response Generation --- 
 # Check if the last message is from the user AND if a model is selected
-if st.session_state.current_model and st.session_state.messages and st.session_state.messages[-1]["role"] == "user":
+# The answer is generated by a background job keyed by conversation and turn, so reruns (sidebar
+# clicks, even a temperature change) re-attach to it here instead of interrupting or repeating it
+job_key = f"main_chat:{st.session_state.main_chat_id}:{len(st.session_state.messages)}"
+failed = st.session_state.main_chat_failed
+if failed and failed[0] == job_key:
+    # A turn that failed is not sent again on every rerun; the user retries it explicitly
+    with col2:
+        st.error(f"An error occurred: {failed[1]}")
+        if st.button("Retry", key="main_chat_retry"):
+            st.session_state.main_chat_failed = None
+            st.rerun()
+elif st.session_state.current_model and st.session_state.messages and st.session_state.messages[-1]["role"] == "user":
     last_user_message = st.session_state.messages[-1]["content"]
 
     with col2:
@@ -145,28 +272,45 @@ if st.session_state.current_model and st.session_state.messages and st.session_s
              # Find the message placeholder within the container to stream to
              with st.chat_message("assistant", avatar="🤖"):
                 try:
-                    response_generator = generate_chat_response(
-                        selected_model_key=st.session_state.current_model,
-                        prompt=last_user_message,
-                        message_history=st.session_state.messages[:-1],
-                        image_data=None,
-                        audio_data=None,
-                        temperature=st.session_state.current_temperature,
-                        stream=True
-                    )
-                    full_response = st.write_stream(response_generator)
-
-                    # 4. Append the full AI response to state
-                    st.session_state.messages.append({"role": "assistant", "content": full_response})
-                    # 5. Save history again AFTER AI response is complete
-                    save_history(st.session_state.current_model, st.session_state.messages)
+                    with span("chat.turn", page="main_chat", model=st.session_state.current_model,
+                              history_messages=len(st.session_state.messages) - 1) as turn, \
+                            usage_scope(st.session_state.current_model):
+                        response_info = {}
+                        job = start_job(
+                            job_key,
+                            generate_chat_response,
+                            selected_model_key=st.session_state.current_model,
+                            prompt=last_user_message,
+                            message_history=st.session_state.messages[:-1],
+                            image_data=None,
+                            audio_data=None,
+                            temperature=st.session_state.current_temperature,
+                            stream=True,
+                            user_id=st.session_state.get("user") or st.session_state.client_id,
+                            response_info=response_info,
+                            info=response_info,
+                        )
+                        with span("ui.write_stream"):
+                            full_response = render_markdown_stream(st, job.follow())
+                        pop_job(job_key)
+                        response_info = job.info
+                        turn.set_attributes({"served_model": response_info.get("served_model"),
+                                             "cache": response_info.get("cache"),
+                                             "response_chars": len(full_response)})
+
+                        # 4. Append the full AI response to state
+                        st.session_state.messages.append({
+                            "role": "assistant",
+                            "content": full_response,
+                            "model": response_info.get("served_model"),
+                            "cached_from": response_info.get("semantic_match"),
+                        })
+                        # 5. Save history again AFTER AI response is complete
+                        save_history(st.session_state.current_model, st.session_state.messages)
                     # 6. Rerun *after* saving to finalize the display state (optional, st.write_stream might handle it)
                     st.rerun()
 
                 except Exception as e:
-                    error_message = f"An error occurred: {str(e)}"
-                    st.error(error_message)
-                    # Optionally add error to history and save?
-                    # st.session_state.messages.append({"role": "assistant", "content": error_message})
-                    # save_history(st.session_state.current_model, st.session_state.messages)
-                    # st.rerun()
+                    pop_job(job_key)
+                    st.session_state.main_chat_failed = (job_key, str(e))
+                    st.rerun()
@@ -12,13 +12,10 @@ including Gemini 2.0 Pro. It supports:
 
 import streamlit as st
 import os
-import base64
 import json
 import time
 import datetime
-from io import BytesIO
-from PIL import Image
-import tempfile
+import uuid
 
 # Import Gemini-specific utilities
 from utils.gemini_api import (
@@ -36,6 +33,15 @@ from utils.database import (
     get_most_recent_chat
 )
 
+# Tracing, metrics and usage accounting
+from utils.metrics import start_metrics_server
+from utils.tracing import span
+from utils.usage import usage_scope
+from utils.chat_view import render_chat_window, reset_chat_window
+from utils.generation_jobs import cancel_other_jobs, pop_job, start_job
+from utils.media_store import resolve_media, set_media
+from utils.streaming import render_markdown_stream
+
 # Auth utilities
 from utils.auth import check_login, get_current_user
 
@@ -65,6 +71,9 @@ custom_css = load_css("docs/UI/css/main.css")
 if custom_css:
     st.markdown(custom_css, unsafe_allow_html=True)
 
+# Serve /metrics when METRICS_PORT is set (once per process)
+start_metrics_server()
+
 # Check user login
 check_login()
 
@@ -81,6 +90,10 @@ if "gemini_streaming" not in st.session_state:
     st.session_state.gemini_streaming = True
 if "gemini_chat_id" not in st.session_state:
     st.session_state.gemini_chat_id = None
+if "gemini_conversation_key" not in st.session_state:  # Names the conversation on screen in generation job keys
+    st.session_state.gemini_conversation_key = str(uuid.uuid4())
+if "gemini_failed_turn" not in st.session_state:  # (job key, error) of the last turn that failed
+    st.session_state.gemini_failed_turn = None
 if "gemini_uploaded_image" not in st.session_state:
     st.session_state.gemini_uploaded_image = None
 if "gemini_webcam_image" not in st.session_state:
@@ -98,20 +111,22 @@ init_db()
 # Initialize Gemini API
 ai_initialized = initialize_gemini()
 
-def encode_image(uploaded_file):
-    """Encode an uploaded file to base64 string"""
-    if uploaded_file is not None:
-        bytes_data = uploaded_file.getvalue()
-        encoded = base64.b64encode(bytes_data).decode('utf-8')
-        return encoded
-    return None
+def _whole_response(**kwargs):
+    """Non-streaming mode as a one-chunk stream, so it can run as a generation job too"""
+    yield get_gemini_response(**kwargs)
 
 def clear_multimodal_inputs():
     """Clear all multimodal inputs"""
-    st.session_state.gemini_uploaded_image = None
-    st.session_state.gemini_webcam_image = None
-    st.session_state.gemini_audio_data = None
-    st.session_state.gemini_screen_share = None
+    set_media(st.session_state, "gemini_uploaded_image", None)
+    set_media(st.session_state, "gemini_webcam_image", None)
+    set_media(st.session_state, "gemini_audio_data", None)
+    set_media(st.session_state, "gemini_screen_share", None)
+
+def switch_conversation():
+    """Another conversation is on screen: give it its own job keys and stop answers still running for the last one"""
+    st.session_state.gemini_conversation_key = str(uuid.uuid4())
+    st.session_state.gemini_failed_turn = None
+    cancel_other_jobs("gemini_studio:")
 
 def load_or_initialize_conversation():
     """Load recent conversation or initialize a new one"""
@@ -119,6 +134,9 @@ def load_or_initialize_conversation():
     if not username:
         return
 
+    reset_chat_window("gemini_chat")
+    switch_conversation()
+
     # Load most recent conversation for this model
     chat_id, messages = get_most_recent_chat(
         username=username,
@@ -232,6 +250,8 @@ def main():
             st.session_state.gemini_messages = []
             st.session_state.gemini_chat_id = None
             clear_multimodal_inputs()
+            reset_chat_window("gemini_chat")
+            switch_conversation()
             st.sidebar.success("Started new conversation")
             st.rerun()
 
@@ -254,34 +274,8 @@ def main():
         # Display chat messages
         messages_container = st.container()
         with messages_container:
-            for message in st.session_state.gemini_messages:
-                is_user = message["role"] == "user"
-
-                # Create message bubbles
-                if is_user:
-                    st.chat_message("user").write(message["content"])
-                else:
-                    st.chat_message("assistant").write(message["content"])
-
-                # Handle multimodal content if present
-                if isinstance(message.get("content"), list):
-                    for part in message["content"]:
-                        if isinstance(part, dict):
-                            if part.get("type") == "image" and part.get("data"):
-                                try:
-                                    image_data = base64.b64decode(part["data"])
-                                    image = Image.open(BytesIO(image_data))
-                                    st.image(image, caption="Shared Image", use_column_width=True)
-                                except Exception as e:
-                                    st.error(f"Could not display image: {str(e)}")
-                            elif part.get("type") == "audio" and part.get("data"):
-                                try:
-                                    audio_data = base64.b64decode(part["data"])
-                                    with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as tmp:
-                                        tmp.write(audio_data)
-                                        st.audio(tmp.name)
-                                except Exception as e:
-                                    st.error(f"Could not play audio: {str(e)}")
+            # Only the most recent messages are drawn; older ones load on demand
+            render_chat_window(st.session_state.gemini_messages, key="gemini_chat")
 
         # Multimodal input options
         input_tabs = st.tabs(["Image Upload", "Webcam", "Audio Recording", "Screen Share"])
@@ -291,14 +285,14 @@ def main():
             uploaded_file = st.file_uploader("Upload an image", type=["jpg", "jpeg", "png"])
             if uploaded_file:
                 # Save the uploaded image to session state
-                st.session_state.gemini_uploaded_image = encode_image(uploaded_file)
+                set_media(st.session_state, "gemini_uploaded_image", uploaded_file.getvalue())
 
                 # Preview the image
                 st.image(uploaded_file, caption="Image ready for analysis", width=300)
 
                 # Show removal button
                 if st.button("Remove uploaded image"):
-                    st.session_state.gemini_uploaded_image = None
+                    set_media(st.session_state, "gemini_uploaded_image", None)
                     st.rerun()
 
         # Webcam tab
@@ -309,11 +303,11 @@ def main():
             webcam_image = st.camera_input("Take a photo")
             if webcam_image:
                 # Save webcam image to session state
-                st.session_state.gemini_webcam_image = encode_image(webcam_image)
+                set_media(st.session_state, "gemini_webcam_image", webcam_image.getvalue())
 
                 # Show removal button
                 if st.button("Remove webcam image"):
-                    st.session_state.gemini_webcam_image = None
+                    set_media(st.session_state, "gemini_webcam_image", None)
                     st.rerun()
 
         # Audio recording tab
@@ -322,7 +316,7 @@ def main():
             st.markdown("Record audio to include in the conversation")
 
             # Use WebRTC audio recorder
-            base64_audio = audio_recorder_ui(
+            audio_ref = audio_recorder_ui(
                 key="gemini_webrtc_recorder",
                 title="Record Audio",
                 description="Click start to begin recording. Click stop when done.",
@@ -331,8 +325,8 @@ def main():
                 show_playback=True
             )
 
-            if base64_audio:
-                st.session_state.gemini_audio_data = base64_audio
+            if audio_ref:
+                set_media(st.session_state, "gemini_audio_data", audio_ref)
                 st.session_state.gemini_audio_path = st.session_state.get("gemini_webrtc_recorder_file_path")
 
                 st.success("Audio recorded successfully!")
@@ -340,7 +334,7 @@ def main():
 
                 # Show removal button
                 if st.button("Remove recorded audio"):
-                    st.session_state.gemini_audio_data = None
+                    set_media(st.session_state, "gemini_audio_data", None)
                     st.session_state.gemini_audio_path = None
                     st.rerun()
 
@@ -352,14 +346,14 @@ def main():
             screen_file = st.file_uploader("Upload a screenshot", type=["jpg", "jpeg", "png"], key="screen_upload")
             if screen_file:
                 # Save screenshot to session state
-                st.session_state.gemini_screen_share = encode_image(screen_file)
+                set_media(st.session_state, "gemini_screen_share", screen_file.getvalue())
 
                 # Preview the screenshot
                 st.image(screen_file, caption="Screenshot ready for analysis", width=300)
 
                 # Show removal button
                 if st.button("Remove screenshot"):
-                    st.session_state.gemini_screen_share = None
+                    set_media(st.session_state, "gemini_screen_share", None)
                     st.rerun()
 
             # Note about screen sharing
@@ -395,112 +389,88 @@ def main():
         chat_container = st.container()
         with chat_container:
             if user_input := st.chat_input("Message the AI...", key="chat_input_main"):
-                # Prevent double submissions
-                if "processing_message" in st.session_state:
-                    st.info("Message already being processed...")
-                    return
-
-                st.session_state.processing_message = True
+                st.session_state.gemini_messages.append({
+                    "role": "user",
+                    "content": user_input
+                })
+                # Rerun to show the message; the answer is generated below
+                st.rerun()
 
+            # Answer the last user message. Generation runs as a background job keyed by conversation
+            # and turn, so a rerun (any widget click, even a settings change) re-attaches to it here
+            # instead of interrupting or repeating it.
+            messages = st.session_state.gemini_messages
+            job_key = f"gemini_studio:{st.session_state.gemini_conversation_key}:{len(messages)}"
+            failed = st.session_state.gemini_failed_turn
+            if failed and failed[0] == job_key:
+                # A turn that failed is not sent again on every rerun; the user retries it explicitly
+                st.error(f"Error generating response: {failed[1]}")
+                if st.button("Retry", key="gemini_retry"):
+                    st.session_state.gemini_failed_turn = None
+                    st.rerun()
+            elif messages and messages[-1]["role"] == "user":
+                # Attachments live in the media store; the model call needs their base64 content
+                image_data = resolve_media(st.session_state.gemini_uploaded_image or st.session_state.gemini_webcam_image
+                                           or st.session_state.gemini_screen_share)
+                audio_data = resolve_media(st.session_state.gemini_audio_data)
+                attachments = sum(1 for data in (image_data, audio_data) if data)
                 try:
-                    with st.spinner("Processing message..."):
-                        # Add user message to chat
-                        st.session_state.gemini_messages.append({
-                            "role": "user",
-                            "content": user_input
-                        })
-
-                        # Get AI response based on selected model
-                        with st.spinner(f"Thinking... using {st.session_state.gemini_current_model}"):
-                            try:
-                                # Get any multimodal content
-                                multimodal_content = []
-
-                                # Add image if present
-                                if st.session_state.gemini_uploaded_image:
-                                    multimodal_content.append({
-                                        "type": "image",
-                                        "data": st.session_state.gemini_uploaded_image
-                                    })
-                                elif st.session_state.gemini_webcam_image:
-                                    multimodal_content.append({
-                                        "type": "image",
-                                        "data": st.session_state.gemini_webcam_image
-                                    })
-                                elif st.session_state.gemini_screen_share:
-                                    multimodal_content.append({
-                                        "type": "image",
-                                        "data": st.session_state.gemini_screen_share
-                                    })
-
-                                # Add audio if present
-                                if st.session_state.gemini_audio_data:
-                                    multimodal_content.append({
-                                        "type": "audio",
-                                        "data": st.session_state.gemini_audio_data
-                                    })
-
-                                # Prepare the message content
-                                message_content = [user_input]
-                                message_content.extend(multimodal_content)
-
-                                # Get AI response
-                                if st.session_state.gemini_streaming:
-                                    # For streaming responses
-                                    response_placeholder = st.empty()
-                                    full_response = ""
-
-                                    for response_chunk in get_gemini_streaming_response(
-                                        prompt=user_input,
-                                        conversation_history=st.session_state.gemini_messages,
-                                        image_data=st.session_state.gemini_uploaded_image or st.session_state.gemini_webcam_image or st.session_state.gemini_screen_share,
-                                        audio_data=st.session_state.gemini_audio_data,
-                                        temperature=st.session_state.gemini_temperature,
-                                        model_name=st.session_state.gemini_current_model
-                                    ):
-                                        full_response += response_chunk
-                                        response_placeholder.markdown(full_response)
-
-                                    response = full_response
-                                else:
-                                    # For non-streaming responses
-                                    response = get_gemini_response(
-                                        prompt=user_input,
-                                        conversation_history=st.session_state.gemini_messages,
-                                        image_data=st.session_state.gemini_uploaded_image or st.session_state.gemini_webcam_image or st.session_state.gemini_screen_share,
-                                        audio_data=st.session_state.gemini_audio_data,
-                                        temperature=st.session_state.gemini_temperature,
-                                        model_name=st.session_state.gemini_current_model
-                                    )
-
-                                # Add AI response to chat
-                                st.session_state.gemini_messages.append({
-                                    "role": "assistant",
-                                    "content": response
-                                })
-
-                                # Clear multimodal inputs after successful processing
-                                clear_multimodal_inputs()
-
-                            except Exception as e:
-                                st.error(f"Error generating response: {str(e)}")
-                            finally:
-                                # Clear processing flag
-                                if "processing_message" in st.session_state:
-                                    del st.session_state.processing_message
-
-                        # Save conversation after adding message
-                        save_current_conversation()
-
-                        # Rerun to update UI
-                        st.rerun()
+                    with span("chat.turn", page="gemini_studio", model=st.session_state.gemini_current_model,
+                              streaming=st.session_state.gemini_streaming, attachments=attachments) as turn, \
+                            usage_scope(st.session_state.gemini_chat_id):
+                        if st.session_state.gemini_streaming:
+                            job = start_job(
+                                job_key,
+                                get_gemini_streaming_response,
+                                prompt=messages[-1]["content"],
+                                conversation_history=list(messages),
+                                image_data=image_data,
+                                audio_data=audio_data,
+                                temperature=st.session_state.gemini_temperature,
+                                model_name=st.session_state.gemini_current_model,
+                                user_id=st.session_state.get("user"),
+                            )
+                        else:
+                            job = start_job(
+                                job_key,
+                                _whole_response,
+                                prompt=messages[-1]["content"],
+                                message_history=messages[:-1],
+                                image_data=image_data,
+                                audio_data=audio_data,
+                                temperature=st.session_state.gemini_temperature,
+                                model_name=st.session_state.gemini_current_model,
+                                user_id=st.session_state.get("user"),
+                            )
+
+                        with st.chat_message("assistant"):
+                            if st.session_state.gemini_streaming:
+                                with span("ui.render_stream"):
+                                    response = render_markdown_stream(st, job.follow())
+                            else:
+                                with st.spinner(f"Thinking... using {st.session_state.gemini_current_model}"):
+                                    response = "".join(job.follow())
+                        turn.set_attribute("response_chars", len(response))
+                    pop_job(job_key)
                 except Exception as e:
-                    st.error(f"Error: {str(e)}")
-                finally:
-                    # Ensure processing flag is cleared even if an error occurs
-                    if "processing_message" in st.session_state:
-                        del st.session_state.processing_message
+                    pop_job(job_key)
+                    st.session_state.gemini_failed_turn = (job_key, str(e))
+                    st.rerun()
+
+                # Add AI response to chat
+                messages.append({
+                    "role": "assistant",
+                    "content": response
+                })
 
+                # Clear multimodal inputs after successful processing
+                clear_multimodal_inputs()
+
+                # Save conversation after adding message
+                save_current_conversation()
+
+                # Rerun to update UI
+                st.rerun()
 
 # Call main function
 if __name__ == "__main__":
@@ -0,0 +1,348 @@
+"""
+End-to-end benchmark of the chat pipeline against the offline mock provider.
+
+Each simulated user runs a number of chat turns through the real code paths:
+  - generate_chat_response (streamed, the Main Chat path)
+  - prepare_chat_history and get_gemini_streaming_response (the Gemini Studio path)
+  - save_history (against a local stand-in for the GCS bucket)
+  - save_conversation (the local JSON store)
+
+Providers are served by the mock adapter (PROVIDER_OVERRIDE=mock) or by recorded
+fixtures (--replay DIR), so no keys or network are needed. Every scenario in the
+users x history x attachment grid runs in a fresh interpreter so CPU time and peak
+RSS are its own. Results are printed (or written with --output) as JSON for trend
+tracking.
+
+Usage:
+    python scripts/benchmark_chat.py --quick                 # small grid, seconds; for every PR
+    python scripts/benchmark_chat.py --users 10 50 --history 10 200 --attachment-kb 0 512
+    python scripts/benchmark_chat.py --profile mock-tail --output bench.json
+"""
+import argparse
+import base64
+import datetime
+import io
+import itertools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+QUICK = {"users": [5], "history": [10], "attachment_kb": [0, 64], "turns": 2, "profile": "mock-instant"}
+FULL = {"users": [1, 10, 50], "history": [10, 200], "attachment_kb": [0, 512], "turns": 5, "profile": "mock-fast"}
+
+MODEL_KEY = "Gemini 1.5 Flash (Google)"
+GEMINI_MODEL = "gemini-1.5-flash"
+
+
+# --- Local storage stand-in for google-cloud-storage --- #
+
+class _LocalBlob:
+    def __init__(self, path: str):
+        self.path = path
+
+    def upload_from_string(self, data, content_type: Optional[str] = None) -> None:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "wb") as f:
+            f.write(data.encode("utf-8") if isinstance(data, str) else data)
+
+    def download_as_string(self) -> bytes:
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def delete(self) -> None:
+        os.remove(self.path)
+
+
+class _LocalBucket:
+    def __init__(self, root: str):
+        self.root = root
+
+    def blob(self, name: str) -> _LocalBlob:
+        return _LocalBlob(os.path.join(self.root, name))
+
+
+class LocalStorageClient:
+    """Just enough of ``google.cloud.storage.Client`` for utils.gcs_history, backed by a directory."""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def bucket(self, name: str) -> _LocalBucket:
+        return _LocalBucket(os.path.join(self.root, name))
+
+
+# --- Workload --- #
+
+def make_image(kb: int) -> Optional[str]:
+    """A base64 PNG of roughly ``kb`` kilobytes (random pixels do not compress)."""
+    if kb <= 0:
+        return None
+    from PIL import Image
+
+    side = max(1, int((kb * 1024 / 3) ** 0.5))
+    image = Image.frombytes("RGB", (side, side), os.urandom(side * side * 3))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+def make_history(length: int, message_chars: int, image_data: Optional[str]) -> List[Dict[str, Any]]:
+    """Alternating user/assistant messages; the first user message carries the attachment, if any."""
+    filler = ("lorem ipsum dolor sit amet " * (message_chars // 27 + 1))[:message_chars]
+    history = []
+    for i in range(length):
+        role = "user" if i % 2 == 0 else "assistant"
+        content: Any = f"{i}: {filler}"
+        if i == 0 and image_data:
+            content = [content, {"type": "image", "data": image_data}]
+        history.append({"role": role, "content": content})
+    return history
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def pct(p: float) -> float:
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+    return {
+        "count": len(ordered),
+        "mean_ms": round(statistics.mean(ordered) * 1000, 2),
+        "p50_ms": round(pct(50) * 1000, 2),
+        "p90_ms": round(pct(90) * 1000, 2),
+        "p99_ms": round(pct(99) * 1000, 2),
+        "max_ms": round(ordered[-1] * 1000, 2),
+    }
+
+
+def peak_rss_mb() -> Optional[float]:
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return round(rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024, 1)
+
+
+def run_scenario(params: Dict[str, Any], workdir: str) -> Dict[str, Any]:
+    """Run one scenario in this process. Environment must already be set up (see main)."""
+    import streamlit as st
+    from utils import gcs_history
+    from utils.database import save_conversation
+    from utils.gemini_api import get_gemini_streaming_response, prepare_chat_history
+    from utils.models import generate_chat_response
+
+    gcs_history._storage_client = LocalStorageClient(os.path.join(workdir, "gcs"))
+    os.makedirs(os.path.join(workdir, "data"), exist_ok=True)
+    os.chdir(workdir)  # save_conversation writes data/<user>_conversations.json
+    st.session_state.db_type = "json"
+
+    image_data = make_image(params["attachment_kb"])
+    base_history = make_history(params["history"], params["message_chars"], image_data)
+    timings: Dict[str, List[float]] = {name: [] for name in (
+        "generate_chat_response", "ttft", "prepare_chat_history",
+        "get_gemini_streaming_response", "save_history", "save_conversation", "turn")}
+    errors: List[str] = []
+    lock = threading.Lock()
+    chat_ids: Dict[str, Any] = {}
+
+    def record(name: str, seconds: float) -> None:
+        with lock:
+            timings[name].append(seconds)
+
+    def user(index: int) -> None:
+        username = f"bench_user_{index}"
+        messages = list(base_history)
+        for turn in range(params["turns"]):
+            turn_start = time.perf_counter()
+            prompt = f"User {index}, turn {turn}: summarise the conversation so far."
+            try:
+                start = time.perf_counter()
+                info: Dict[str, Any] = {}
+                reply = "".join(generate_chat_response(
+                    MODEL_KEY, prompt, messages, temperature=0.7, stream=True,
+                    user_id=username, response_info=info))
+                record("generate_chat_response", time.perf_counter() - start)
+                if info.get("ttft_seconds") is not None:
+                    record("ttft", info["ttft_seconds"])
+
+                start = time.perf_counter()
+                prepare_chat_history(messages)
+                record("prepare_chat_history", time.perf_counter() - start)
+
+                start = time.perf_counter()
+                conversation = messages + [{"role": "user", "content": prompt}]
+                "".join(get_gemini_streaming_response(
+                    prompt, conversation, image_data=image_data, model_name=GEMINI_MODEL))
+                record("get_gemini_streaming_response", time.perf_counter() - start)
+
+                messages = conversation + [{"role": "assistant", "content": reply}]
+
+                start = time.perf_counter()
+                gcs_history.save_history(f"{username}_{MODEL_KEY}", messages)
+                record("save_history", time.perf_counter() - start)
+
+                # Outside `streamlit run` session state is shared by every thread, so each
+                # user's conversation id is swapped in around its save
+                start = time.perf_counter()
+                with lock:
+                    st.session_state.chat_id = chat_ids.get(username)
+                    save_conversation(username, MODEL_KEY, messages)
+                    chat_ids[username] = st.session_state.chat_id
+                record("save_conversation", time.perf_counter() - start)
+            except Exception as e:
+                with lock:
+                    errors.append(f"{type(e).__name__}: {e}")
+            record("turn", time.perf_counter() - turn_start)
+
+    cpu_start = os.times()
+    wall_start = time.perf_counter()
+    threads = [threading.Thread(target=user, args=(i,), name=f"bench-user-{i}") for i in range(params["users"])]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - wall_start
+    cpu_end = os.times()
+
+    turns = len(timings["turn"])
+    return {
+        "params": params,
+        "wall_seconds": round(wall, 3),
+        "turns": turns,
+        "throughput_turns_per_second": round(turns / wall, 2) if wall else None,
+        "cpu_seconds": round((cpu_end.user - cpu_start.user) + (cpu_end.system - cpu_start.system), 3),
+        "peak_rss_mb": peak_rss_mb(),
+        "errors": len(errors),
+        "error_samples": errors[:5],
+        "latency": {name: percentiles(samples) for name, samples in timings.items()},
+    }
+
+
+def benchmark_env(profile: str, seed: int, replay_dir: Optional[str]) -> Dict[str, str]:
+    """Environment for a scenario: offline providers, no caching, and limits that never throttle."""
+    env = dict(os.environ)
+    env.pop("PROVIDER_RECORD_DIR", None)
+    if replay_dir:
+        env["PROVIDER_REPLAY_DIR"] = os.path.abspath(replay_dir)
+        env.pop("PROVIDER_OVERRIDE", None)
+    else:
+        env["PROVIDER_OVERRIDE"] = "mock"
+        env["MOCK_PROFILE"] = profile
+        env["MOCK_SEED"] = str(seed)
+    env.update({
+        "GCS_BUCKET_NAME": "benchmark",
+        "DATABASE_URL": "",
+        "RESPONSE_CACHE_ENABLED": "false",
+        "SEMANTIC_CACHE_ENABLED": "false",
+        "RATE_LIMIT_RPM": "1000000",
+        "RATE_LIMIT_USER_RPM": "1000000",
+        "RATE_LIMIT_MAX_CONCURRENT": "100000",
+        "RATE_LIMIT_MAX_QUEUE": "100000",
+        "PYTHONPATH": ROOT + os.pathsep + env.get("PYTHONPATH", ""),
+    })
+    return env
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quick", action="store_true", help="Small grid with the instant mock profile")
+    parser.add_argument("--users", type=int, nargs="+", help="Concurrent users per scenario")
+    parser.add_argument("--history", type=int, nargs="+", help="Messages of prior history per user")
+    parser.add_argument("--attachment-kb", type=int, nargs="+", help="Image attachment sizes (0 = none)")
+    parser.add_argument("--turns", type=int, help="Chat turns per user")
+    parser.add_argument("--message-chars", type=int, default=400, help="Characters per history message")
+    parser.add_argument("--profile", help="Mock provider profile (see utils/providers/mock_adapter.py)")
+    parser.add_argument("--replay", metavar="DIR", help="Serve providers from recorded fixtures instead of the mock")
+    parser.add_argument("--seed", type=int, default=1234, help="Mock provider seed")
+    parser.add_argument("--output", help="Write the JSON report to this file instead of stdout")
+    parser.add_argument("--run-one", help=argparse.SUPPRESS)  # internal: run a single scenario
+    args = parser.parse_args()
+
+    if args.run_one:
+        params, result_path = json.loads(args.run_one)
+        with tempfile.TemporaryDirectory(prefix="chat-bench-") as workdir:
+            result = run_scenario(params, workdir)
+        with open(result_path, "w", encoding="utf-8") as f:
+            json.dump(result, f)
+        return 0
+
+    defaults = QUICK if args.quick else FULL
+    profile = args.profile or defaults["profile"]
+    turns = args.turns or defaults["turns"]
+    grid = itertools.product(args.users or defaults["users"], args.history or defaults["history"],
+                             args.attachment_kb or defaults["attachment_kb"])
+
+    scenarios = []
+    failed = False
+    for users, history, attachment_kb in grid:
+        params = {"users": users, "history": history, "attachment_kb": attachment_kb, "turns": turns,
+                  "message_chars": args.message_chars}
+        print(f"Running users={users} history={history} attachment_kb={attachment_kb} turns={turns}...",
+              file=sys.stderr)
+        with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+            result_path = f.name
+        try:
+            completed = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--run-one", json.dumps([params, result_path])],
+                cwd=ROOT, env=benchmark_env(profile, args.seed, args.replay),
+                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+            )
+            if completed.returncode != 0:
+                last_line = completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else "unknown error"
+                print(f"  failed: {last_line}", file=sys.stderr)
+                failed = True
+                continue
+            with open(result_path, "r", encoding="utf-8") as f:
+                scenario = json.load(f)
+        finally:
+            os.remove(result_path)
+        failed = failed or scenario["errors"] > 0
+        scenarios.append(scenario)
+        print(f"  {scenario['throughput_turns_per_second']} turns/s, "
+              f"turn p99 {scenario['latency']['turn'].get('p99_ms')} ms, "
+              f"peak RSS {scenario['peak_rss_mb']} MB, errors {scenario['errors']}", file=sys.stderr)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "mode": "quick" if args.quick else "full",
+            "provider": f"replay:{args.replay}" if args.replay else f"mock:{profile}",
+            "seed": args.seed,
+        },
+        "scenarios": scenarios,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
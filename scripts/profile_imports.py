@@ -0,0 +1,142 @@
+"""
+Import-time profiler for the app's pages and utils modules.
+
+Each target is imported in a fresh interpreter with ``python -X importtime`` so the
+numbers reflect a cold start. Pages are not executed; instead the modules they import
+at the top level are imported, which is what a page pays before its first render.
+
+Usage:
+    python scripts/profile_imports.py                      # all pages
+    python scripts/profile_imports.py utils.models pages/00_Main_Chat.py
+    python scripts/profile_imports.py --repeat 5 --top 15 --json
+"""
+import argparse
+import ast
+import glob
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def page_imports(path: str) -> List[str]:
+    """Return the modules a page imports at module level."""
+    with open(path, "r", encoding="utf-8") as f:
+        tree = ast.parse(f.read(), filename=path)
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            modules.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and node.level == 0:
+            modules.append(node.module)
+    return list(dict.fromkeys(modules))
+
+
+def run_importtime(modules: List[str]) -> Dict[str, Dict[str, int]]:
+    """
+    Import ``modules`` in a fresh interpreter and parse the ``-X importtime`` report.
+
+    Returns:
+        Mapping of module name to {"self_us", "cumulative_us", "depth"}
+    """
+    code = "\n".join(f"import {name}" for name in modules)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        last_line = result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "unknown error"
+        raise RuntimeError(f"importing {', '.join(modules)} failed: {last_line}")
+
+    timings = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        timings[name.strip()] = {
+            "self_us": int(self_us),
+            "cumulative_us": int(cumulative_us),
+            "depth": depth,
+        }
+    return timings
+
+
+def profile_target(target: str, repeat: int, top: int) -> Dict:
+    """Profile one page or module ``repeat`` times and summarise the median run."""
+    if target.endswith(".py"):
+        modules = page_imports(os.path.join(ROOT, target))
+    else:
+        modules = [target]
+
+    runs = [run_importtime(modules) for _ in range(repeat)]
+    totals = [sum(t["cumulative_us"] for t in run.values() if t["depth"] == 0) for run in runs]
+    median_run = runs[totals.index(sorted(totals)[len(totals) // 2])]
+
+    # Attribute self time to top-level packages (e.g. all of "google.*" to "google")
+    by_package: Dict[str, int] = {}
+    for name, timing in median_run.items():
+        package = name.split(".")[0]
+        by_package[package] = by_package.get(package, 0) + timing["self_us"]
+
+    slowest = sorted(median_run.items(), key=lambda item: item[1]["cumulative_us"], reverse=True)[:top]
+    return {
+        "target": target,
+        "imports": modules,
+        "total_ms": round(statistics.median(totals) / 1000, 1),
+        "runs_ms": [round(total / 1000, 1) for total in totals],
+        "by_package_ms": {
+            package: round(us / 1000, 1)
+            for package, us in sorted(by_package.items(), key=lambda item: item[1], reverse=True)[:top]
+        },
+        "slowest_modules_ms": {name: round(t["cumulative_us"] / 1000, 1) for name, t in slowest},
+    }
+
+
+def print_report(report: Dict) -> None:
+    print(f"\n== {report['target']}: {report['total_ms']} ms (runs: {report['runs_ms']})")
+    print("  by package (self time):")
+    for package, ms in report["by_package_ms"].items():
+        print(f"    {ms:>9.1f} ms  {package}")
+    print("  slowest modules (cumulative):")
+    for name, ms in report["slowest_modules_ms"].items():
+        print(f"    {ms:>9.1f} ms  {name}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("targets", nargs="*", help="Page files (pages/*.py) or dotted module names")
+    parser.add_argument("--repeat", type=int, default=3, help="Cold-start runs per target (median is reported)")
+    parser.add_argument("--top", type=int, default=10, help="Rows to show per section")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    targets = args.targets or sorted(
+        os.path.relpath(path, ROOT) for path in glob.glob(os.path.join(ROOT, "pages", "*.py"))
+    )
+
+    reports = []
+    failed = False
+    for target in targets:
+        try:
+            reports.append(profile_target(target, args.repeat, args.top))
+        except RuntimeError as e:
+            print(f"Skipping {target}: {e}", file=sys.stderr)
+            failed = True
+
+    if args.json:
+        print(json.dumps(reports, indent=2))
+    else:
+        for report in reports:
+            print_report(report)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
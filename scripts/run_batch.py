@@ -0,0 +1,66 @@
+"""
+Run a JSON-lines file of chat requests offline (see utils/batch.py for the format).
+
+Results are appended to the output file one JSON line per request as they finish,
+and the output is also the checkpoint: rerunning the same command after a crash or
+Ctrl-C skips the requests already written. Progress (done/total, requests per
+second, errors, ETA) is printed to stderr while the batch runs.
+
+Usage:
+    python scripts/run_batch.py prompts.jsonl results.jsonl
+    python scripts/run_batch.py prompts.jsonl results.jsonl --model "Gemini 2.0 Flash (Google)" --concurrency 16
+    python scripts/run_batch.py prompts.jsonl results.jsonl --retry-errors    # rerun only the failures
+"""
+import argparse
+import json
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from utils.batch import BATCH_CONCURRENCY, BATCH_MODEL, BATCH_USER, BatchStats, run_batch  # noqa: E402
+from utils.rate_limit import DEFAULT_RPM, set_user_rate  # noqa: E402
+
+
+def print_progress(stats: BatchStats) -> None:
+    remaining = stats.remaining_seconds()
+    eta = f"{remaining:.0f}s" if remaining is not None else "?"
+    print(f"  {stats.skipped + stats.done}/{stats.total} done, {stats.throughput():.2f} req/s, "
+          f"{stats.succeeded} ok, {stats.failed} errors, ETA {eta}", file=sys.stderr)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="JSON-lines file of requests")
+    parser.add_argument("output", help="JSON-lines file to append results to (and resume from)")
+    parser.add_argument("--model", default=BATCH_MODEL, help="Model key for requests that do not name one")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY, help="Requests in flight at once")
+    parser.add_argument("--retry-errors", action="store_true", help="Rerun requests whose earlier result was an error")
+    parser.add_argument("--no-cache", action="store_true", help="Bypass the response cache")
+    parser.add_argument("--rpm", type=float, default=DEFAULT_RPM,
+                        help="Requests per minute allowed for the batch user (default: RATE_LIMIT_RPM)")
+    parser.add_argument("--progress-seconds", type=float, default=5.0, help="Seconds between progress lines")
+    args = parser.parse_args()
+
+    # The per-user limit is sized for people at a keyboard; the provider limits still apply
+    set_user_rate(BATCH_USER, args.rpm)
+    try:
+        stats = run_batch(
+            args.input,
+            args.output,
+            concurrency=args.concurrency,
+            default_model=args.model,
+            retry_errors=args.retry_errors,
+            cache=False if args.no_cache else None,
+            progress=print_progress,
+            progress_interval=args.progress_seconds,
+        )
+    except KeyboardInterrupt:
+        return 130
+    print(json.dumps(stats.summary(), indent=2))
+    return 1 if stats.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,12 +1,14 @@
 """
 Audio recording and processing utilities
 """
-import os
 import base64
-import tempfile
-import pyaudio
 import wave
 from typing import Tuple, Optional
+from utils.lazy import lazy_import
+from utils.session_resources import new_temp_file, release_temp_file
+
+# PyAudio is only imported when recording actually starts
+pyaudio = lazy_import("pyaudio")
 
 def record_audio(duration: int = 5, sample_rate: int = 16000) -> Tuple[bytes, str]:
     """
@@ -27,10 +29,8 @@ def record_audio(duration: int = 5, sample_rate: int = 16000) -> Tuple[bytes, st
     sample_format = pyaudio.paInt16  # 16 bits per sample
     channels = 1  # Mono
     
-    # Create a temporary file
-    temp_file = tempfile.NamedTemporaryFile(suffix=".wav", delete=False)
-    temp_file_path = temp_file.name
-    temp_file.close()
+    # Create a temporary file (deleted with the session if nobody cleans it up)
+    temp_file_path = new_temp_file(".wav")
     
     p = None
     
@@ -91,11 +91,7 @@ def record_audio(duration: int = 5, sample_rate: int = 16000) -> Tuple[bytes, st
         
     except Exception as e:
         # Clean up the temp file on error
-        if os.path.exists(temp_file_path):
-            try:
-                os.remove(temp_file_path)
-            except:
-                pass
+        release_temp_file(temp_file_path)
         raise Exception(f"Error recording audio: {str(e)}")
         
     finally:
@@ -123,9 +119,4 @@ def cleanup_audio_file(file_path: str) -> None:
     Args:
         file_path: Path to the audio file to delete
     """
-    if file_path and os.path.exists(file_path):
-        try:
-            os.remove(file_path)
-            print(f"Removed temporary audio file: {file_path}")
-        except Exception as e:
-            print(f"Error removing temporary audio file: {str(e)}")
\ No newline at end of file
+    release_temp_file(file_path)
\ No newline at end of file
@@ -0,0 +1,261 @@
+"""
+Batch mode: run a JSON-lines file of chat requests offline.
+
+Each input line is one request:
+
+    {"id": "q1", "model": "Gemini 1.5 Flash (Google)", "prompt": "...",
+     "history": [...], "system_prompt": "...", "temperature": 0.2}
+
+Only ``prompt`` is required; ``id`` defaults to ``line-N`` and ``model`` to
+BATCH_MODEL. Requests go through the same router as the chat pages (response
+cache, fallback, rate limits, usage metering), BATCH_CONCURRENCY at a time,
+under the BATCH_USER identity. Every finished request is appended to the
+output file as one JSON line and flushed straight away, so the output doubles as
+the checkpoint: running the same batch again skips ids already written (and,
+with ``retry_errors``, retries the ones that failed).
+"""
+import json
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set
+
+from utils.models import run_chat_request
+from utils.tracing import run_in_context, span
+from utils.usage import usage_scope
+
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", 8))
+BATCH_USER = os.environ.get("BATCH_USER", "batch")
+BATCH_MODEL = os.environ.get("BATCH_MODEL", "Gemini 1.5 Flash (Google)")
+
+
+@dataclass
+class BatchStats:
+    """Running totals for a batch, passed to the progress callback and returned at the end."""
+    total: int = 0
+    done: int = 0
+    skipped: int = 0
+    succeeded: int = 0
+    failed: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    started: float = field(default_factory=time.monotonic)
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def throughput(self) -> float:
+        """Requests finished per second in this run (skipped ones excluded)."""
+        elapsed = self.elapsed()
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    def remaining_seconds(self) -> Optional[float]:
+        rate = self.throughput()
+        remaining = self.total - self.skipped - self.done
+        return remaining / rate if rate > 0 else None
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "total": self.total,
+            "done": self.done,
+            "skipped": self.skipped,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "elapsed_seconds": round(self.elapsed(), 2),
+            "requests_per_second": round(self.throughput(), 3),
+        }
+
+
+# --- Input and checkpoint --- #
+
+def read_requests(path: str, default_model: str = BATCH_MODEL) -> Iterator[Dict[str, Any]]:
+    """
+    Read batch requests from a JSON-lines file.
+
+    Args:
+        path: Input file, one JSON object per line (blank lines are ignored).
+        default_model: Model key for requests that do not name one.
+
+    Yields:
+        Normalised request dicts. A line that cannot be used is yielded with an
+        ``error`` key so it is reported in the output rather than dropped.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        for number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            request_id = f"line-{number}"
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield {"id": request_id, "model": default_model, "error": f"Invalid JSON: {e}"}
+                continue
+            if not isinstance(record, dict):
+                yield {"id": request_id, "model": default_model, "error": "Request is not a JSON object"}
+                continue
+            request = {
+                "id": str(record.get("id", request_id)),
+                "model": record.get("model") or default_model,
+                "prompt": record.get("prompt"),
+                "history": record.get("history", record.get("message_history")) or [],
+                "system_prompt": record.get("system_prompt"),
+                "image_data": record.get("image_data"),
+            }
+            try:
+                request["temperature"] = float(record.get("temperature", 0.7))
+            except (TypeError, ValueError):
+                request["error"] = f"Invalid temperature: {record.get('temperature')!r}"
+            if not isinstance(request["prompt"], str) or not request["prompt"]:
+                request["error"] = "Request has no prompt"
+            yield request
+
+
+def completed_ids(output_path: str, retry_errors: bool = False) -> Set[str]:
+    """
+    Ids already written to an output file, i.e. the batch checkpoint.
+
+    Args:
+        output_path: The batch output file (missing = nothing done yet).
+        retry_errors: Leave out ids whose result was an error so they run again.
+    """
+    done: Set[str] = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue  # a line cut short by a crash; that request runs again
+            if retry_errors and result.get("error"):
+                done.discard(result.get("id"))
+            else:
+                done.add(result.get("id"))
+    return done
+
+
+# --- Running --- #
+
+def _run_one(request: Dict[str, Any], cache: Optional[bool]) -> Dict[str, Any]:
+    result = {"id": request["id"], "model": request["model"]}
+    if request.get("error"):
+        result["error"] = request["error"]
+        return result
+    info: Dict[str, Any] = {}
+    with usage_scope(f"batch:{request['id']}"):
+        run = run_chat_request(
+            request["model"],
+            request["prompt"],
+            request["history"],
+            image_data=request["image_data"],
+            temperature=request["temperature"],
+            system_prompt=request["system_prompt"],
+            user_id=BATCH_USER,
+            cache=cache,
+            response_info=info,
+        )
+    result.update({
+        "served_model": run.served_model,
+        "text": run.text,
+        "error": run.error,
+        "input_tokens": run.input_tokens,
+        "output_tokens": run.output_tokens,
+        "latency_seconds": round(run.latency_seconds or 0.0, 4),
+        "ttft_seconds": round(run.ttft_seconds, 4) if run.ttft_seconds is not None else None,
+        "cache": info.get("cache"),
+    })
+    return result
+
+
+def run_batch(
+    input_path: str,
+    output_path: str,
+    concurrency: int = BATCH_CONCURRENCY,
+    default_model: str = BATCH_MODEL,
+    retry_errors: bool = False,
+    cache: Optional[bool] = None,
+    progress: Optional[Callable[[BatchStats], None]] = None,
+    progress_interval: float = 5.0,
+    stop_event: Optional[threading.Event] = None,
+) -> BatchStats:
+    """
+    Run every request in ``input_path`` not already in ``output_path``.
+
+    Args:
+        input_path: JSON-lines request file (see the module docstring).
+        output_path: JSON-lines result file; appended to, and read back to resume.
+        concurrency: Requests in flight at once.
+        default_model: Model key for requests that do not name one.
+        retry_errors: Run again the requests whose earlier result was an error.
+        cache: Override the response cache for the batch (None = router default).
+        progress: Called with the running stats every ``progress_interval`` seconds and at the end.
+        progress_interval: Seconds between progress callbacks.
+        stop_event: Set it to stop submitting work; requests in flight still finish and are written.
+
+    Returns:
+        The final BatchStats.
+    """
+    stats = BatchStats()
+    done_ids = completed_ids(output_path, retry_errors)
+    pending: List[Dict[str, Any]] = []
+    for request in read_requests(input_path, default_model):
+        stats.total += 1
+        if request["id"] in done_ids:
+            stats.skipped += 1
+        else:
+            pending.append(request)
+    print(f"Batch {input_path}: {stats.total} requests, {stats.skipped} already done, "
+          f"{len(pending)} to run with concurrency {concurrency}")
+
+    directory = os.path.dirname(output_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    last_report = time.monotonic()
+
+    with span("batch.run", requests=len(pending), concurrency=concurrency) as batch_span, \
+            open(output_path, "a", encoding="utf-8") as out, \
+            ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch") as executor:
+        queued = iter(pending)
+        in_flight = set()
+        try:
+            while True:
+                # Keep at most 2x concurrency submitted so a huge input is not all queued at once
+                while len(in_flight) < concurrency * 2 and not (stop_event and stop_event.is_set()):
+                    request = next(queued, None)
+                    if request is None:
+                        break
+                    in_flight.add(executor.submit(run_in_context(_run_one), request, cache))
+                if not in_flight:
+                    break
+                finished, in_flight = wait(in_flight, timeout=progress_interval, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    result = future.result()
+                    out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                    out.flush()
+                    stats.done += 1
+                    if result.get("error"):
+                        stats.failed += 1
+                    else:
+                        stats.succeeded += 1
+                    stats.input_tokens += result.get("input_tokens") or 0
+                    stats.output_tokens += result.get("output_tokens") or 0
+                if progress and time.monotonic() - last_report >= progress_interval:
+                    last_report = time.monotonic()
+                    progress(stats)
+        except KeyboardInterrupt:
+            # Whatever was written is the checkpoint; drop the queued work and let the rerun pick it up
+            for future in in_flight:
+                future.cancel()
+            print(f"Batch interrupted after {stats.done} requests; rerun to resume")
+            raise
+        finally:
+            batch_span.set_attributes({"succeeded": stats.succeeded, "failed": stats.failed})
+
+    if progress:
+        progress(stats)
+    return stats
@@ -0,0 +1,177 @@
+"""
+Windowed rendering of chat histories.
+
+Pages used to draw every message of the conversation on every rerun, so the cost of
+any click grew with the length of the chat. ``render_chat_window`` draws only the
+last CHAT_WINDOW_MESSAGES messages, with a button to load earlier ones in steps of
+the same size, and keeps each message's prepared content (markdown text, decoded
+image and audio bytes) in a process-wide LRU bounded by CHAT_RENDER_CACHE_SIZE
+messages and CHAT_RENDER_CACHE_MB, so a message that has not changed is not decoded
+again on the next rerun. A message without an id is keyed by a hash of its content,
+computed once per message object and remembered in the session (messages are not
+changed in place once they are in the history).
+"""
+import base64
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+import streamlit as st
+
+CHAT_WINDOW_MESSAGES = int(os.environ.get("CHAT_WINDOW_MESSAGES", 50))
+CHAT_RENDER_CACHE_SIZE = int(os.environ.get("CHAT_RENDER_CACHE_SIZE", 2000))
+CHAT_RENDER_CACHE_MB = float(os.environ.get("CHAT_RENDER_CACHE_MB", 64))
+
+
+@dataclass
+class PreparedMessage:
+    """What is needed to draw one message, computed once per distinct message."""
+    role: str
+    text: str
+    images: List[bytes] = field(default_factory=list)
+    audio: List[bytes] = field(default_factory=list)
+    errors: List[str] = field(default_factory=list)
+
+    @property
+    def size(self) -> int:
+        """Approximate bytes held (text plus decoded media)."""
+        return len(self.text) + sum(len(data) for data in self.images) + sum(len(data) for data in self.audio)
+
+
+_prepared: "OrderedDict[str, PreparedMessage]" = OrderedDict()
+_prepared_bytes = 0
+_prepared_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+
+def message_key(message: Dict[str, Any]) -> str:
+    """Stable key for a message: its id when it has one, otherwise a hash of its role and content."""
+    if message.get("id"):
+        return str(message["id"])
+    payload = json.dumps([message.get("role"), message.get("content")], sort_keys=True, default=str)
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _prepare(message: Dict[str, Any]) -> PreparedMessage:
+    content = message.get("content")
+    prepared = PreparedMessage(role=message.get("role", "assistant"), text="")
+    if not isinstance(content, list):
+        prepared.text = "" if content is None else str(content)
+        return prepared
+    texts = []
+    for part in content:
+        if isinstance(part, str):
+            texts.append(part)
+        elif isinstance(part, dict):
+            kind = part.get("type")
+            if kind == "text":
+                texts.append(part.get("text", ""))
+            elif kind in ("image", "audio") and part.get("data"):
+                try:
+                    data = base64.b64decode(part["data"])
+                except Exception as e:
+                    prepared.errors.append(f"Could not decode {kind}: {str(e)}")
+                    continue
+                (prepared.images if kind == "image" else prepared.audio).append(data)
+    prepared.text = "\n\n".join(text for text in texts if text)
+    return prepared
+
+
+def prepare_message(message: Dict[str, Any], key: Optional[str] = None) -> PreparedMessage:
+    """The prepared content of a message, from the cache when the message was seen before."""
+    global _prepared_bytes
+    key = key or message_key(message)
+    with _prepared_lock:
+        prepared = _prepared.get(key)
+        if prepared is not None:
+            _prepared.move_to_end(key)
+            _stats["hits"] += 1
+            return prepared
+        _stats["misses"] += 1
+    prepared = _prepare(message)
+    if prepared.size > CHAT_RENDER_CACHE_MB * 1024 * 1024:
+        return prepared  # too big to keep; it would push everything else out
+    with _prepared_lock:
+        previous = _prepared.pop(key, None)
+        if previous is not None:
+            _prepared_bytes -= previous.size
+        _prepared[key] = prepared
+        _prepared_bytes += prepared.size
+        while len(_prepared) > CHAT_RENDER_CACHE_SIZE or _prepared_bytes > CHAT_RENDER_CACHE_MB * 1024 * 1024:
+            _, evicted = _prepared.popitem(last=False)
+            _prepared_bytes -= evicted.size
+            _stats["evictions"] += 1
+    return prepared
+
+
+def render_message(prepared: PreparedMessage, avatar: Optional[str] = None) -> None:
+    """Default renderer: a chat bubble with the text, then any images and audio."""
+    with st.chat_message(prepared.role, avatar=avatar):
+        if prepared.text:
+            st.markdown(prepared.text)
+        for image in prepared.images:
+            st.image(image, caption="Shared Image", use_column_width=True)
+        for audio in prepared.audio:
+            st.audio(audio)
+        for error in prepared.errors:
+            st.error(error)
+
+
+# --- Window --- #
+
+def _show_earlier(state_key: str, step: int) -> None:
+    st.session_state[state_key] = st.session_state.get(state_key, step) + step
+
+
+def reset_chat_window(key: str) -> None:
+    """Go back to showing only the most recent messages (e.g. when the conversation changes)."""
+    st.session_state.pop(f"{key}_window", None)
+
+
+def render_chat_window(
+    messages: List[Dict[str, Any]],
+    key: str,
+    render: Optional[Callable[[Dict[str, Any], PreparedMessage], None]] = None,
+    window: int = CHAT_WINDOW_MESSAGES,
+) -> None:
+    """
+    Draw the most recent messages of a conversation, with a control to load earlier ones.
+
+    Args:
+        messages: The whole conversation.
+        key: Unique per chat view on the page; the window size is kept in session state under it.
+        render: Draws one message given the message and its prepared content
+            (default: render_message).
+        window: Messages shown at first, and added by each "load earlier" click.
+    """
+    state_key = f"{key}_window"
+    shown = st.session_state.get(state_key, window)
+    start = max(0, len(messages) - shown)
+    if start:
+        st.button(f"Load earlier messages ({start} hidden)", key=f"{key}_load_earlier",
+                  on_click=_show_earlier, args=(state_key, window), use_container_width=True)
+    # Content hashes of the visible messages, by message object, so a rerun does not
+    # serialise every message again (the message is kept alongside to check identity)
+    known = st.session_state.get(f"{key}_message_keys", {})
+    visible = {}
+    for message in messages[start:]:
+        entry = known.get(id(message))
+        if entry is None or entry[0] is not message:
+            entry = (message, message_key(message))
+        visible[id(message)] = entry
+        prepared = prepare_message(message, entry[1])
+        if render is None:
+            render_message(prepared)
+        else:
+            render(message, prepared)
+    st.session_state[f"{key}_message_keys"] = visible
+
+
+def get_chat_view_stats() -> Dict[str, int]:
+    """Prepared-message cache size, hits, misses and evictions."""
+    with _prepared_lock:
+        return {"entries": len(_prepared), "bytes": _prepared_bytes, **_stats}
@@ -3,37 +3,75 @@ import os
 import datetime
 import json
 from typing import List, Dict, Any, Optional, Tuple
-import psycopg2
 import uuid
-from flask_sqlalchemy import SQLAlchemy
+from utils.lazy import lazy_import
+from utils.metrics import counter, histogram
+from utils.tracing import current_span, traced
 
-db = SQLAlchemy()
+# psycopg2 and flask_sqlalchemy are only needed once a page actually talks to the database
+psycopg2 = lazy_import("psycopg2")
 
-class User(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(80), unique=True, nullable=False)
-    password_hash = db.Column(db.String(128), nullable=False)
-    email = db.Column(db.String(255), nullable=True)  # Added email column
-    is_admin = db.Column(db.Boolean, default=False)
+_orm = None
 
-class ModelPersonality(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    model_name = db.Column(db.String(50), nullable=False)
-    personality_name = db.Column(db.String(50), nullable=False)
-    temperature = db.Column(db.Float, default=0.7)
-    max_tokens = db.Column(db.Integer, default=1024)
-    system_prompt = db.Column(db.Text)
-    created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
-    last_used = db.Column(db.DateTime)
+STORAGE_SECONDS = histogram("gg_storage_seconds", "Duration of conversation storage operations.", ("store", "operation"))
+STORAGE_FALLBACKS = counter("gg_storage_fallbacks_total", "PostgreSQL operations that failed over to JSON files.",
+                            ("operation",))
+DB_CONNECTIONS = counter("gg_db_connections_opened_total", "PostgreSQL connections opened (there is no pool).")
+DB_CONNECT_SECONDS = histogram("gg_db_connect_seconds", "Time to open a PostgreSQL connection.")
 
-    __table_args__ = (db.UniqueConstraint('user_id', 'model_name', 'personality_name', name='_user_model_personality_uc'),)
+def get_orm() -> Dict[str, Any]:
+    """
+    Build the SQLAlchemy models on first use.
+
+    Returns:
+        Dictionary with the ``db`` handle and the ``User`` and ``ModelPersonality`` models
+    """
+    global _orm
+    if _orm is None:
+        from flask_sqlalchemy import SQLAlchemy
+
+        db = SQLAlchemy()
+
+        class User(db.Model):
+            id = db.Column(db.Integer, primary_key=True)
+            username = db.Column(db.String(80), unique=True, nullable=False)
+            password_hash = db.Column(db.String(128), nullable=False)
+            email = db.Column(db.String(255), nullable=True)  # Added email column
+            is_admin = db.Column(db.Boolean, default=False)
+
+        class ModelPersonality(db.Model):
+            id = db.Column(db.Integer, primary_key=True)
+            user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+            model_name = db.Column(db.String(50), nullable=False)
+            personality_name = db.Column(db.String(50), nullable=False)
+            temperature = db.Column(db.Float, default=0.7)
+            max_tokens = db.Column(db.Integer, default=1024)
+            system_prompt = db.Column(db.Text)
+            created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
+            last_used = db.Column(db.DateTime)
+
+            __table_args__ = (db.UniqueConstraint('user_id', 'model_name', 'personality_name', name='_user_model_personality_uc'),)
+
+        _orm = {"db": db, "User": User, "ModelPersonality": ModelPersonality}
+    return _orm
+
+def __getattr__(name):
+    # Keep `from utils.database import db, User, ModelPersonality` working
+    if name in ("db", "User", "ModelPersonality"):
+        return get_orm()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # Helper function to get the database URL from environment variables
 def get_db_url() -> Optional[str]:
     """Get the PostgreSQL connection string from environment variables."""
     return os.environ.get("POSTGRESQL_URL") or os.environ.get("DATABASE_URL")
 
+def _connect(db_url: str):
+    with DB_CONNECT_SECONDS.time():
+        conn = psycopg2.connect(db_url)
+    DB_CONNECTIONS.inc()
+    return conn
+
 def get_db_connection():
     """Establish and return a database connection."""
     db_url = get_db_url()
@@ -41,7 +79,7 @@ def get_db_connection():
         raise ValueError("Database URL is not set in environment variables.")
 
     try:
-        conn = psycopg2.connect(db_url)
+        conn = _connect(db_url)
         return conn
     except Exception as e:
         raise ConnectionError(f"Failed to connect to the database: {e}")
@@ -62,7 +100,7 @@ def init_db() -> None:
     if db_url and "db_initialized" not in st.session_state:
         try:
             # Try to connect to PostgreSQL
-            conn = psycopg2.connect(db_url)
+            conn = _connect(db_url)
             cursor = conn.cursor()
             
             # Check if the table exists first to avoid sequence conflicts
@@ -120,6 +158,8 @@ def init_db() -> None:
         # Create data directory if it doesn't exist
         os.makedirs("data", exist_ok=True)
 
+@traced("db.save_conversation")
+@STORAGE_SECONDS.labels("db", "save_conversation").time()
 def save_conversation(username: str, model: str, messages: List[Dict[str, str]]) -> None:
     """
     Save the current conversation to the database.
@@ -133,12 +173,15 @@ def save_conversation(username: str, model: str, messages: List[Dict[str, str]])
     """
     # Current timestamp
     now = datetime.datetime.now()
+    current_span().set_attributes({"backend": st.session_state.db_type, "model": model, "messages": len(messages)})
     
     if st.session_state.db_type == "postgresql":
         try:
+            payload = json.dumps(messages)
+            current_span().set_attribute("bytes", len(payload))
             # Connect to PostgreSQL using helper function
             db_url = get_db_url()
-            conn = psycopg2.connect(db_url)
+            conn = _connect(db_url)
             cursor = conn.cursor()
             
             # Check if we're updating an existing conversation or creating a new one
@@ -150,7 +193,7 @@ def save_conversation(username: str, model: str, messages: List[Dict[str, str]])
                     SET messages = %s, last_updated = %s
                     WHERE id = %s AND user_id = %s
                     """,
-                    (json.dumps(messages), now, st.session_state.chat_id, username)
+                    (payload, now, st.session_state.chat_id, username)
                 )
             else:
                 # Insert new conversation
@@ -161,7 +204,7 @@ def save_conversation(username: str, model: str, messages: List[Dict[str, str]])
                     VALUES (%s, %s, %s, %s, %s) 
                     RETURNING id
                     """,
-                    (username, model, now, now, json.dumps(messages))
+                    (username, model, now, now, payload)
                 )
                 
                 # Get the new conversation ID and store it in session state
@@ -172,6 +215,8 @@ def save_conversation(username: str, model: str, messages: List[Dict[str, str]])
             conn.close()
         except Exception as e:
             # If PostgreSQL fails, fall back to JSON
+            current_span().set_attribute("db_error", str(e))
+            STORAGE_FALLBACKS.labels("save_conversation").inc()
             _save_to_json(username, model, messages)
     else:
         # Save to JSON file
@@ -229,10 +274,13 @@ def _save_to_json(username: str, model: str, messages: List[Dict[str, str]]) ->
         # Write back to file
         with open(filename, "w") as f:
             json.dump(conversations, f, indent=2)
+        current_span().set_attributes({"backend": "json", "bytes": os.path.getsize(filename)})
     except Exception as e:
         # Silent fail - logging would be better in production
         pass
 
+@traced("db.load_conversations")
+@STORAGE_SECONDS.labels("db", "load_conversations").time()
 def load_conversations(username: str) -> List[Dict[str, Any]]:
     """
     Load all conversations for a specific user.
@@ -243,11 +291,12 @@ def load_conversations(username: str) -> List[Dict[str, Any]]:
     Returns:
         A list of conversation objects
     """
+    current_span().set_attribute("backend", st.session_state.db_type)
     if st.session_state.db_type == "postgresql":
         try:
             # Connect to PostgreSQL using helper function
             db_url = get_db_url()
-            conn = psycopg2.connect(db_url)
+            conn = _connect(db_url)
             cursor = conn.cursor()
             
             # Query for user's conversations
@@ -274,9 +323,12 @@ def load_conversations(username: str) -> List[Dict[str, Any]]:
                 })
             
             conn.close()
+            current_span().set_attribute("conversations", len(conversations))
             return conversations
         except Exception as e:
             # If PostgreSQL fails, fall back to JSON
+            current_span().set_attribute("db_error", str(e))
+            STORAGE_FALLBACKS.labels("load_conversations").inc()
             return _load_from_json(username)
     else:
         # Load from JSON file
@@ -306,6 +358,8 @@ def _load_from_json(username: str) -> List[Dict[str, Any]]:
             )
             
             # Return the 10 most recent conversations
+            current_span().set_attributes({"backend": "json", "bytes": os.path.getsize(filename),
+                                           "conversations": min(len(conversations), 10)})
             return conversations[:10]
         else:
             return []
@@ -313,6 +367,8 @@ def _load_from_json(username: str) -> List[Dict[str, Any]]:
         # If reading fails, return empty list
         return []
 
+@traced("db.get_most_recent_chat")
+@STORAGE_SECONDS.labels("db", "get_most_recent_chat").time()
 def get_most_recent_chat(username: str, model: str) -> Tuple[Optional[str], Optional[List[Dict[str, str]]]]:
     """
     Get the most recent chat for a specific user and model.
@@ -328,7 +384,7 @@ def get_most_recent_chat(username: str, model: str) -> Tuple[Optional[str], Opti
         try:
             # Connect to PostgreSQL using helper function
             db_url = get_db_url()
-            conn = psycopg2.connect(db_url)
+            conn = _connect(db_url)
             cursor = conn.cursor()
             
             # Query for the most recent chat with this model
@@ -353,6 +409,7 @@ def get_most_recent_chat(username: str, model: str) -> Tuple[Optional[str], Opti
                 return None, None
         except Exception as e:
             # If PostgreSQL fails, fall back to JSON
+            STORAGE_FALLBACKS.labels("get_most_recent_chat").inc()
             return _get_most_recent_chat_json(username, model)
     else:
         # Use JSON file
@@ -0,0 +1,80 @@
+"""
+Fallback chains for the model router.
+
+When the selected model fails before producing any output, or has not produced a
+first token within the time-to-first-token deadline, the router moves on to the
+next model in the chain. Chains use SUPPORTED_MODELS display names and can be
+overridden with the MODEL_FALLBACKS environment variable (a JSON object of
+model -> list of models).
+"""
+import json
+import os
+import threading
+from typing import Dict, List, Optional
+
+from utils.providers import is_configured
+
+# Time-to-first-token deadline before the router gives up on a model and falls back
+TTFT_DEADLINE_SECONDS = float(os.environ.get("FALLBACK_TTFT_SECONDS", 15))
+
+DEFAULT_FALLBACKS: Dict[str, List[str]] = {
+    "Gemini 1.5 Pro (Google)": ["Gemini 1.5 Flash (Google)", "GPT-4o (OpenAI)"],
+    "Gemini 2.0 Flash (Google)": ["Gemini 1.5 Flash (Google)", "GPT-4o (OpenAI)"],
+    "Gemini 1.5 Flash (Google)": ["Gemini 2.0 Flash (Google)"],
+    "Claude 3.5 Sonnet (Anthropic)": ["GPT-4o (OpenAI)", "Gemini 1.5 Pro (Google)"],
+    "GPT-4o (OpenAI)": ["GPT-4 Turbo (OpenAI)", "Claude 3.5 Sonnet (Anthropic)"],
+    "GPT-4 Turbo (OpenAI)": ["GPT-4o (OpenAI)"],
+    "Gemini 2.5 Pro Preview (Vertex AI)": ["Gemini 1.5 Pro (Google)"],
+}
+
+
+def _load_fallbacks() -> Dict[str, List[str]]:
+    override = os.environ.get("MODEL_FALLBACKS")
+    if not override:
+        return DEFAULT_FALLBACKS
+    try:
+        return json.loads(override)
+    except ValueError as e:
+        print(f"Ignoring invalid MODEL_FALLBACKS ({e}); using defaults")
+        return DEFAULT_FALLBACKS
+
+
+FALLBACKS = _load_fallbacks()
+
+
+def fallback_chain(model_key: str, catalog: Dict[str, Dict]) -> List[str]:
+    """Models to try after ``model_key``, skipping unknown models and unconfigured providers."""
+    chain = []
+    for candidate in FALLBACKS.get(model_key, []):
+        info = catalog.get(candidate)
+        if candidate != model_key and info and is_configured(info["api"]) and candidate not in chain:
+            chain.append(candidate)
+    return chain
+
+
+# --- Stats --- #
+
+_stats: Dict[str, Dict[str, float]] = {}
+_lock = threading.Lock()
+
+
+def record_fallback(from_model: str, to_model: str, reason: str, latency_saved: Optional[float] = None) -> None:
+    """
+    Count a fallback. ``reason`` is "error" or "slow".
+
+    ``latency_saved`` is how much sooner the fallback's first token arrived than the
+    abandoned model's did (or, if it never did, a lower bound).
+    """
+    key = f"{from_model} -> {to_model}"
+    with _lock:
+        entry = _stats.setdefault(key, {"count": 0, "error": 0, "slow": 0, "latency_saved_seconds": 0.0})
+        entry["count"] += 1
+        entry[reason] += 1
+        if latency_saved is not None and latency_saved > 0:
+            entry["latency_saved_seconds"] += latency_saved
+
+
+def get_fallback_stats() -> Dict[str, Dict[str, float]]:
+    """How often each fallback fired, why, and the total first-token latency it saved."""
+    with _lock:
+        return {key: dict(entry) for key, entry in _stats.items()}
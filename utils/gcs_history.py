@@ -4,9 +4,14 @@ Handles saving and loading chat history to/from Google Cloud Storage.
 import os
 import json
 import streamlit as st
-from google.cloud import storage
-from google.api_core import exceptions
 from dotenv import load_dotenv
+from utils.lazy import lazy_import
+from utils.metrics import counter, histogram
+from utils.tracing import current_span, traced
+
+# google-cloud-storage is only imported once a bucket is configured and used
+storage = lazy_import("google.cloud.storage")
+exceptions = lazy_import("google.api_core.exceptions")
 
 # Load environment variables from .env file
 load_dotenv()
@@ -36,6 +41,10 @@ def get_gcs_client():
     # Return the client if initialization was successful, otherwise None
     return _storage_client if _storage_client else None
 
+STORAGE_SECONDS = histogram("gg_storage_seconds", "Duration of conversation storage operations.", ("store", "operation"))
+STORAGE_BYTES = counter("gg_storage_bytes_total", "History bytes moved to and from GCS.", ("direction",))
+STORAGE_ERRORS = counter("gg_storage_errors_total", "Failed GCS history operations.", ("operation",))
+
 # --- History Management Functions --- 
 def get_history_blob_name(history_id: str) -> str:
     """Creates the full GCS blob path for a given history ID."""
@@ -44,8 +53,11 @@ def get_history_blob_name(history_id: str) -> str:
     # Add a .json extension
     return f"{HISTORY_DIR}{safe_id}.json"
 
+@traced("history.save")
+@STORAGE_SECONDS.labels("gcs", "save_history").time()
 def save_history(history_id: str, messages: list):
     """Saves the chat message list to a GCS blob."""
+    current_span().set_attributes({"history_id": history_id, "messages": len(messages)})
     if not GCS_BUCKET_NAME:
         # Don't show error if bucket isn't configured, just skip saving
         # st.warning("GCS_BUCKET_NAME environment variable not set. Cannot save history.")
@@ -66,6 +78,8 @@ def save_history(history_id: str, messages: list):
 
         # Convert message list to JSON string
         history_json = json.dumps(messages, indent=2)
+        current_span().set_attribute("bytes", len(history_json))
+        STORAGE_BYTES.labels("upload").inc(len(history_json))
 
         # Upload the JSON string
         blob.upload_from_string(history_json, content_type='application/json')
@@ -74,10 +88,15 @@ def save_history(history_id: str, messages: list):
     except exceptions.NotFound:
         st.error(f"GCS Bucket '{GCS_BUCKET_NAME}' not found. Please create it and ensure permissions.")
     except Exception as e:
+        current_span().record_exception(e)
+        STORAGE_ERRORS.labels("save_history").inc()
         st.error(f"Failed to save history '{history_id}' to GCS: {e}")
 
+@traced("history.load")
+@STORAGE_SECONDS.labels("gcs", "load_history").time()
 def load_history(history_id: str) -> list:
     """Loads chat message list from a GCS blob. Returns empty list if not found."""
+    current_span().set_attribute("history_id", history_id)
     if not GCS_BUCKET_NAME:
         return [] 
 
@@ -95,6 +114,8 @@ def load_history(history_id: str) -> list:
 
         # Parse JSON string to list
         messages = json.loads(history_json)
+        current_span().set_attributes({"bytes": len(history_json), "messages": len(messages)})
+        STORAGE_BYTES.labels("download").inc(len(history_json))
         # st.toast(f"History '{history_id}' loaded.", icon="📂") # Optional feedback
         return messages
 
@@ -102,11 +123,16 @@ def load_history(history_id: str) -> list:
         # If the blob doesn't exist, it's just a new chat, return empty list
         return []
     except Exception as e:
+        current_span().record_exception(e)
+        STORAGE_ERRORS.labels("load_history").inc()
         st.error(f"Failed to load history '{history_id}' from GCS: {e}")
         return [] # Return empty list on other errors
 
+@traced("history.delete")
+@STORAGE_SECONDS.labels("gcs", "delete_history").time()
 def delete_history(history_id: str):
     """Deletes a chat history file from GCS."""
+    current_span().set_attribute("history_id", history_id)
     if not GCS_BUCKET_NAME:
         return
 
@@ -123,5 +149,6 @@ def delete_history(history_id: str):
     except exceptions.NotFound:
         pass # File already gone
     except Exception as e:
+        STORAGE_ERRORS.labels("delete_history").inc()
         st.error(f"Failed to delete history '{history_id}' from GCS: {e}")
 
@@ -5,11 +5,19 @@ Supports multimodal inputs (text, images, audio) and streaming responses.
 import os
 import base64
 from typing import List, Dict, Any, Generator, Optional
-import google.generativeai as genai
-from PIL import Image
 from io import BytesIO
 import streamlit as st
-from .database import db, ModelPersonality
+from .lazy import lazy_import
+from .providers import ChatRequest, get_provider, is_configured
+from .rate_limit import permit
+from .resilience import stream_with_retry
+from .tracing import current_span, span, trace_iter, traced
+from .usage import check_quota, metered
+from .work_pool import provider_slot
+
+# Heavy SDKs are imported the first time they are used
+genai = lazy_import("google.generativeai")
+Image = lazy_import("PIL.Image")
 
 # Constants
 DEFAULT_MODEL = "gemini-1.5-pro"
@@ -17,19 +25,15 @@ DEFAULT_TEMPERATURE = 0.7
 
 def initialize_gemini():
     """
-    Initialize the Gemini API with the provided API key.
+    Check that the Gemini API key is available.
+
+    The SDK itself is configured by the Gemini provider adapter on first request,
+    so opening the page does not import google.generativeai.
     """
-    api_key = os.environ.get("GEMINI_API_KEY")
-    if not api_key:
+    if not is_configured("gemini"):  # also true when served offline (PROVIDER_OVERRIDE / PROVIDER_REPLAY_DIR)
         st.error("Gemini API key not found. Please add it to your environment variables.")
         return False
-    
-    try:
-        genai.configure(api_key=api_key)
-        return True
-    except Exception as e:
-        st.error(f"Failed to initialize Gemini API: {str(e)}")
-        return False
+    return True
 
 def get_gemini_models() -> List[Dict[str, Any]]:
     """
@@ -39,6 +43,7 @@ def get_gemini_models() -> List[Dict[str, Any]]:
         List of model information dictionaries
     """
     try:
+        genai.configure(api_key=os.environ.get("GEMINI_API_KEY"))
         models = genai.list_models()
         gemini_models = [m for m in models if "gemini" in m.name.lower()]
         return gemini_models
@@ -97,6 +102,7 @@ def prepare_content_parts(
     
     return content_parts
 
+@traced("gemini.prepare_chat_history")
 def prepare_chat_history(conversation_history: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     """
     Convert app conversation history to Gemini format.
@@ -107,6 +113,7 @@ def prepare_chat_history(conversation_history: List[Dict[str, Any]]) -> List[Dic
     Returns:
         List of formatted message dictionaries for Gemini
     """
+    current_span().set_attribute("messages", len(conversation_history))
     chat_history = []
     
     for msg in conversation_history:
@@ -140,7 +147,7 @@ def prepare_chat_history(conversation_history: List[Dict[str, Any]]) -> List[Dic
     
     return chat_history
 
-def get_gemini_response(prompt: str, message_history: List[Dict[str, str]], image_data=None, audio_data=None, temperature=0.7, model_name="gemini-1.5-pro") -> str:
+def get_gemini_response(prompt: str, message_history: List[Dict[str, str]], image_data=None, audio_data=None, temperature=0.7, model_name="gemini-1.5-pro", user_id: Optional[str] = None) -> str:
     """
     Get a response from the Gemini AI model.
     
@@ -151,50 +158,44 @@ def get_gemini_response(prompt: str, message_history: List[Dict[str, str]], imag
         audio_data: Optional base64 encoded audio data
         temperature: Temperature for response generation (creativity)
         model_name: The specific Gemini model to use (e.g., "gemini-1.5-pro", "gemini-2.5-pro-preview")
+        user_id: The app user, for rate limits, usage and quotas (default: the session's user).
+            Pass it when calling from a background thread, which has no session state.
         
     Returns:
         The AI response text
     """
+    if user_id is None:
+        user_id = st.session_state.get("user")
     try:
-        import google.generativeai as genai
-        import base64
-        from PIL import Image
-        import io
-
-        # Get API key from environment variables
-        api_key = os.environ.get("GEMINI_API_KEY")
-        if not api_key:
-            return "Error: Gemini API key not found. Please set the GEMINI_API_KEY environment variable."
-
-        # Configure the Gemini API
-        genai.configure(api_key=api_key)
-
-        # Convert message history to the format expected by Gemini
-        formatted_history = []
-        for message in message_history:
-            role = "user" if message["role"] == "user" else "model"
-            formatted_history.append({"role": role, "parts": [message["content"]]})
-
-        # Create a Gemini model instance with generation config
-        model = genai.GenerativeModel(
-            model_name,
-            generation_config={"temperature": temperature}
+        request = ChatRequest(
+            model_name=model_name,
+            prompt=prompt,
+            history=message_history,
+            image_data=image_data,
+            audio_data=audio_data,
+            temperature=temperature,
+            user_id=user_id
         )
-
-        # Prepare multimodal content
-        contents = [{"text": prompt}]
-        if image_data:
-            contents.append({"inline_data": {"mime_type": "image/jpeg", "data": image_data}})
-        if audio_data:
-            contents.append({"inline_data": {"mime_type": "audio/wav", "data": audio_data}})
-
-        # Generate response with multimodal input
-        response = model.generate_content(contents)
-        return response.text
+        denied = check_quota(user_id, model_name)
+        if denied:
+            return f"Error with Gemini API: {denied}"
+        adapter = get_provider("gemini")
+        with span("gemini.generate", model=model_name, history_messages=len(message_history)) as s, \
+                permit("gemini", model_name, user_id), provider_slot():
+            chunks = metered("gemini", request, stream_with_retry("gemini", lambda: adapter.stream(request)))
+            text = "".join(chunk.text for chunk in chunks)
+            s.set_attribute("output_chars", len(text))
+            return text
 
     except Exception as e:
         return f"Error with Gemini API: {str(e)}"
 
+def _count_chunk(stream_span, chunk) -> None:
+    stream_span.set_attribute("output_chars", stream_span.attributes.get("output_chars", 0) + len(chunk.text))
+    if chunk.usage:
+        stream_span.set_attribute("input_tokens", chunk.usage.get("input_tokens"))
+        stream_span.set_attribute("output_tokens", chunk.usage.get("output_tokens"))
+
 def get_gemini_streaming_response(
     prompt: str, 
     conversation_history: List[Dict[str, Any]], 
@@ -202,7 +203,8 @@ def get_gemini_streaming_response(
     audio_data: Optional[str] = None, 
     screen_data: Optional[str] = None,
     temperature: float = DEFAULT_TEMPERATURE, 
-    model_name: str = DEFAULT_MODEL
+    model_name: str = DEFAULT_MODEL,
+    user_id: Optional[str] = None
 ) -> Generator[str, None, None]:
     """
     Get a streaming response from Gemini with multimodal inputs.
@@ -215,40 +217,54 @@ def get_gemini_streaming_response(
         screen_data: Base64-encoded screenshot data
         temperature: Temperature for response generation
         model_name: Gemini model version to use
+        user_id: The app user, for rate limits, usage and quotas (default: the session's user).
+            Pass it when calling from a background thread, which has no session state.
         
     Returns:
         Generator yielding response chunks
     """
+    if user_id is None:
+        user_id = st.session_state.get("user")
     try:
-        # Select the appropriate model
-        model = genai.GenerativeModel(model_name)
-        
-        # Prepare the content parts
-        content_parts = prepare_content_parts(prompt, image_data, audio_data, screen_data)
-        
-        # Prepare conversation history
-        chat_history = prepare_chat_history(conversation_history[:-1])  # Exclude the last message (current prompt)
-        
-        # Start a chat session
-        chat = model.start_chat(history=chat_history)
-        
-        # Generate streaming response
-        response_stream = chat.send_message(
-            content_parts, 
-            generation_config={"temperature": temperature},
-            stream=True
+        request = ChatRequest(
+            model_name=model_name,
+            prompt=prompt,
+            history=conversation_history[:-1],  # Exclude the last message (current prompt)
+            image_data=image_data,
+            audio_data=audio_data,
+            screen_data=screen_data,
+            temperature=temperature,
+            user_id=user_id
         )
-        
-        # Yield chunks as they come in
-        for chunk in response_stream:
-            if chunk.text:
-                yield chunk.text
+
+        denied = check_quota(user_id, model_name)
+        if denied:
+            yield f"Error with Gemini streaming: {denied}"
+            return
+
+        # Yield chunks as they come in (retried only until the first chunk arrives)
+        adapter = get_provider("gemini")
+        with permit("gemini", model_name, user_id), provider_slot():
+            chunks = trace_iter(
+                "gemini.stream",
+                metered("gemini", request, stream_with_retry("gemini", lambda: adapter.stream(request))),
+                {"model": model_name, "history_messages": len(request.history),
+                 "attachments": bool(image_data or audio_data or screen_data)},
+                on_item=_count_chunk,
+            )
+            for chunk in chunks:
+                if chunk.text:
+                    yield chunk.text
         
     except Exception as e:
         yield f"Error with Gemini streaming: {str(e)}"
 
 def get_model_personality(user_id, model_name, personality_name="default"):
     """Fetch stored personality settings for a specific model."""
+    from .database import get_orm
+    orm = get_orm()
+    db, ModelPersonality = orm["db"], orm["ModelPersonality"]
+
     personality = ModelPersonality.query.filter_by(
         user_id=user_id,
         model_name=model_name,
@@ -0,0 +1,229 @@
+"""
+Response generation that outlives Streamlit reruns.
+
+A page that generates inside its script run loses the answer whenever the script
+is rerun (a sidebar click, ``st.rerun()``), or blocks the rerun until the answer
+is done. Here the generation runs as a job on the shared work pool and its chunks
+are buffered in a per-session job store. A rerun simply re-attaches:
+
+    job = start_job(f"main_chat:{chat_id}:{turn}", generate_chat_response, prompt=..., response_info=info, info=info)
+    full_response = st.write_stream(job.follow())   # replays the buffer, then follows live
+    pop_job(job.key)
+
+``start_job`` returns the job already running under the same key instead of
+starting a second one, so a rerun never duplicates a generation, and a reader
+going away never cancels it. Keys name the conversation and turn, not the model,
+so changing a setting mid-answer re-attaches too. Jobs end when their stream does,
+when they are popped or cancelled (``cancel_other_jobs`` drops those of a
+conversation the user has left), or when the session disconnects (see
+utils/session_resources.py).
+Finished jobs nobody collected are dropped after GENERATION_JOB_TTL seconds.
+"""
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from utils.session_resources import current_session_id, on_session_end
+from utils.work_pool import INTERACTIVE, get_work_pool
+
+GENERATION_JOB_TTL_SECONDS = float(os.environ.get("GENERATION_JOB_TTL", 600))
+
+LOCAL_SESSION = "local"  # jobs started outside a Streamlit script run
+
+
+class GenerationJob:
+    """One generation running in the background, with every chunk it has produced so far."""
+
+    def __init__(self, key: str, session_id: str, info: Dict[str, Any]):
+        self.key = key
+        self.session_id = session_id
+        self.info = info  # the response_info dict the generator fills in (served model, cache, ...)
+        self.chunks: List[Any] = []
+        self.error: Optional[BaseException] = None
+        self.done = False
+        self.created_at = time.monotonic()
+        self.finished_at: Optional[float] = None
+        self.task = None
+        self._cancelled = threading.Event()
+        self._cond = threading.Condition()
+
+    def _run(self, open_stream: Callable[..., Iterator[Any]], args: Tuple, kwargs: Dict[str, Any]) -> None:
+        iterator = None
+        try:
+            iterator = open_stream(*args, **kwargs)
+            for chunk in iterator:
+                if self.cancelled:
+                    break
+                with self._cond:
+                    self.chunks.append(chunk)
+                    self._cond.notify_all()
+        except BaseException as e:
+            self.error = e
+        finally:
+            if iterator is not None and hasattr(iterator, "close"):
+                try:
+                    iterator.close()
+                except Exception:
+                    pass
+            self._finish()
+
+    def _finish(self) -> None:
+        with self._cond:
+            if not self.done:
+                self.done = True
+                self.finished_at = time.monotonic()
+            self._cond.notify_all()
+
+    @property
+    def text(self) -> str:
+        """Everything generated so far."""
+        with self._cond:
+            return "".join(str(chunk) for chunk in self.chunks)
+
+    @property
+    def cancelled(self) -> bool:
+        """Cancelled here, or by the work pool (its reaper cancels the tasks of disconnected sessions)."""
+        return self._cancelled.is_set() or (self.task is not None and self.task.cancelled.is_set())
+
+    def follow(self, start: int = 0) -> Iterator[Any]:
+        """
+        Yield the chunks from ``start``: the buffered ones at once, then new ones as they
+        arrive. Re-raises the job's error at the end. Stopping early leaves the job running.
+        """
+        index = start
+        while True:
+            with self._cond:
+                while index >= len(self.chunks) and not self.done:
+                    self._cond.wait()
+                batch = self.chunks[index:]
+                index += len(batch)
+                finished = self.done and not batch
+            if finished:
+                break
+            yield from batch
+        if self.error is not None and not self.cancelled:
+            raise self.error
+
+    def cancel(self) -> None:
+        """Stop the generation at its next chunk (or before it starts, if still queued)."""
+        self._cancelled.set()
+        if self.task is not None:
+            self.task.cancel()
+
+
+# --- Job store --- #
+
+_jobs: Dict[Tuple[str, str], GenerationJob] = {}
+_jobs_lock = threading.Lock()
+_stats = {"started": 0, "reattached": 0, "expired": 0}
+
+
+def _session(session_id: Optional[str]) -> str:
+    return session_id or current_session_id() or LOCAL_SESSION
+
+
+def _expire_finished() -> None:
+    """Drop finished jobs nobody collected. Caller holds _jobs_lock."""
+    now = time.monotonic()
+    for job_key, job in list(_jobs.items()):
+        if job.done and now - job.finished_at > GENERATION_JOB_TTL_SECONDS:
+            del _jobs[job_key]
+            _stats["expired"] += 1
+
+
+def start_job(key: str, open_stream: Callable[..., Iterator[Any]], *args: Any,
+              info: Optional[Dict[str, Any]] = None, session_id: Optional[str] = None,
+              lane: str = INTERACTIVE, **kwargs: Any) -> GenerationJob:
+    """
+    Start ``open_stream(*args, **kwargs)`` as a background job, or return the job
+    already under ``key`` for this session.
+
+    Args:
+        key: Identifies the generation within the session, e.g. the page and conversation.
+        open_stream: Returns the chunk iterator; called on a work pool worker.
+        info: The dict the generator fills in (pass the same dict as its response_info);
+            exposed as ``job.info``.
+        session_id: Owning session (default: the calling Streamlit session).
+        lane: Work pool lane to run on.
+
+    Raises:
+        WorkPoolFull: If the work pool cannot take the job.
+    """
+    session_id = _session(session_id)
+    with _jobs_lock:
+        _expire_finished()
+        job = _jobs.get((session_id, key))
+        if job is not None:
+            _stats["reattached"] += 1
+            return job
+        job = _jobs[(session_id, key)] = GenerationJob(key, session_id, info if info is not None else {})
+        _stats["started"] += 1
+    try:
+        job.task = get_work_pool().submit(job._run, open_stream, args, kwargs, lane=lane, session_id=session_id,
+                                          name=key)
+    except Exception:
+        with _jobs_lock:
+            _jobs.pop((session_id, key), None)
+        raise
+    # A job cancelled while still queued never runs, so mark it finished here
+    job.task.future.add_done_callback(lambda f: job._finish() if f.cancelled() else None)
+    return job
+
+
+def get_job(key: str, session_id: Optional[str] = None) -> Optional[GenerationJob]:
+    """The session's job under ``key``, running or finished but not yet popped."""
+    with _jobs_lock:
+        return _jobs.get((_session(session_id), key))
+
+
+def pop_job(key: str, session_id: Optional[str] = None) -> Optional[GenerationJob]:
+    """Remove the session's job under ``key`` (cancelling it if it is still running)."""
+    with _jobs_lock:
+        job = _jobs.pop((_session(session_id), key), None)
+    if job is not None and not job.done:
+        job.cancel()
+    return job
+
+
+def cancel_other_jobs(prefix: str, keep: Optional[str] = None, session_id: Optional[str] = None) -> int:
+    """
+    Cancel and drop the session's jobs whose key starts with ``prefix``, except ``keep``
+    (e.g. the answers still running for a conversation the user has switched away from).
+    Returns how many there were.
+    """
+    session_id = _session(session_id)
+    with _jobs_lock:
+        jobs = [_jobs.pop(job_key) for job_key in list(_jobs)
+                if job_key[0] == session_id and job_key[1].startswith(prefix) and job_key[1] != keep]
+    for job in jobs:
+        job.cancel()
+    return len(jobs)
+
+
+def cancel_session_jobs(session_id: str) -> int:
+    """Cancel and drop every job of a session. Returns how many there were."""
+    with _jobs_lock:
+        jobs = [_jobs.pop(job_key) for job_key in list(_jobs) if job_key[0] == session_id]
+    for job in jobs:
+        job.cancel()
+    return len(jobs)
+
+
+def _job_sessions() -> List[str]:
+    with _jobs_lock:
+        return list({session_id for session_id, _ in _jobs})
+
+
+on_session_end(cancel_session_jobs, _job_sessions)
+
+
+def get_generation_job_stats() -> Dict[str, Any]:
+    """Jobs currently held, running, and started / re-attached / expired so far."""
+    with _jobs_lock:
+        jobs = list(_jobs.values())
+        stats = dict(_stats)
+    stats["held"] = len(jobs)
+    stats["running"] = sum(1 for job in jobs if not job.done)
+    stats["sessions"] = len({job.session_id for job in jobs})
+    return stats
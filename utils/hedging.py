@@ -0,0 +1,157 @@
+"""
+Hedged requests for the model router.
+
+With hedging on, a call that has not produced its first token after the model's
+recent p95 time-to-first-token gets a duplicate request (to the same model, or an
+equivalent one from HEDGE_MODELS). Whichever stream starts first is used and the
+other is cancelled.
+
+Hedges cost money, so they are capped twice: at most HEDGE_MAX_RATE of recent
+requests may be hedged, and the estimated tokens spent on losing streams may not
+exceed HEDGE_MAX_WASTED_TOKENS per hour.
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List, Tuple
+
+from utils.providers import is_configured
+
+HEDGE_ENABLED = os.environ.get("HEDGE_ENABLED", "false").lower() in ("1", "true", "yes")
+HEDGE_PERCENTILE = float(os.environ.get("HEDGE_PERCENTILE", 95))
+HEDGE_DEFAULT_DELAY = float(os.environ.get("HEDGE_DEFAULT_DELAY", 4.0))  # until enough samples exist
+HEDGE_MIN_DELAY = float(os.environ.get("HEDGE_MIN_DELAY", 0.5))
+HEDGE_MIN_SAMPLES = int(os.environ.get("HEDGE_MIN_SAMPLES", 20))
+HEDGE_MAX_RATE = float(os.environ.get("HEDGE_MAX_RATE", 0.05))
+HEDGE_MAX_WASTED_TOKENS = int(os.environ.get("HEDGE_MAX_WASTED_TOKENS", 200000))
+
+_SAMPLE_WINDOW = 200  # TTFT samples kept per model
+_RATE_WINDOW = 200  # recent requests considered for the hedge rate
+_RATE_MIN_REQUESTS = 20  # until this many requests are seen, the rate is taken over this many
+_BUDGET_WINDOW_SECONDS = 3600.0
+
+
+def _load_equivalents() -> Dict[str, str]:
+    override = os.environ.get("HEDGE_MODELS")
+    if not override:
+        return {}
+    try:
+        return json.loads(override)
+    except ValueError as e:
+        print(f"Ignoring invalid HEDGE_MODELS ({e}); hedging to the same model")
+        return {}
+
+
+HEDGE_MODELS = _load_equivalents()
+
+
+def hedge_target(model_key: str, catalog: Dict[str, Dict]) -> str:
+    """The model to send the duplicate request to: its configured equivalent, or itself."""
+    candidate = HEDGE_MODELS.get(model_key)
+    info = catalog.get(candidate) if candidate else None
+    if info and is_configured(info["api"]):
+        return candidate
+    return model_key
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+class Hedger:
+    """TTFT samples per model, plus the rate and wasted-token caps and their counters."""
+
+    def __init__(self):
+        self._samples: Dict[str, Deque[float]] = {}
+        self._recent: Deque[List[bool]] = deque(maxlen=_RATE_WINDOW)  # [hedged?] slot of each recent request
+        self._wasted: Deque[Tuple[float, int]] = deque()  # (time, tokens) within the budget window
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.skipped_rate = 0
+        self.skipped_budget = 0
+        self.wasted_tokens = 0
+
+    def record_ttft(self, model_key: str, ttft: float) -> None:
+        with self._lock:
+            self._samples.setdefault(model_key, deque(maxlen=_SAMPLE_WINDOW)).append(ttft)
+
+    def delay(self, model_key: str) -> float:
+        """Seconds to wait for a first token before hedging: the model's TTFT percentile."""
+        with self._lock:
+            samples = list(self._samples.get(model_key, ()))
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY
+        return max(HEDGE_MIN_DELAY, _percentile(samples, HEDGE_PERCENTILE))
+
+    def note_request(self) -> List[bool]:
+        """Count a request that is eligible for hedging. Returns its slot, to pass to try_hedge."""
+        slot = [False]
+        with self._lock:
+            self.requests += 1
+            self._recent.append(slot)
+        return slot
+
+    def _wasted_in_window(self, now: float) -> int:
+        while self._wasted and now - self._wasted[0][0] > _BUDGET_WINDOW_SECONDS:
+            self._wasted.popleft()
+        return sum(tokens for _, tokens in self._wasted)
+
+    def try_hedge(self, slot: List[bool]) -> bool:
+        """Claim a hedge for the request holding ``slot`` if the rate and budget caps allow it."""
+        with self._lock:
+            # At most HEDGE_MAX_RATE of the recent requests may be hedged (a few requests after
+            # startup count as _RATE_MIN_REQUESTS, so they cannot all be hedged)
+            window = max(len(self._recent), _RATE_MIN_REQUESTS)
+            if sum(hedged for hedged, in self._recent) + 1 > HEDGE_MAX_RATE * window:
+                self.skipped_rate += 1
+                return False
+            if self._wasted_in_window(time.monotonic()) >= HEDGE_MAX_WASTED_TOKENS:
+                self.skipped_budget += 1
+                return False
+            self.hedged += 1
+            slot[0] = True
+            return True
+
+    def record_outcome(self, hedge_won: bool, wasted_tokens: int) -> None:
+        """Record which stream won and the estimated tokens the cancelled one consumed."""
+        with self._lock:
+            if hedge_won:
+                self.hedge_wins += 1
+            self.wasted_tokens += wasted_tokens
+            self._wasted.append((time.monotonic(), wasted_tokens))
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            now = time.monotonic()
+            return {
+                "enabled": HEDGE_ENABLED,
+                "requests": self.requests,
+                "hedged": self.hedged,
+                "hedge_rate": self.hedged / self.requests if self.requests else 0.0,
+                "hedge_wins": self.hedge_wins,
+                "skipped_rate_cap": self.skipped_rate,
+                "skipped_budget_cap": self.skipped_budget,
+                "wasted_tokens": self.wasted_tokens,
+                "wasted_tokens_last_hour": self._wasted_in_window(now),
+                "models": list(self._samples),
+            }
+
+
+_hedger = Hedger()
+
+
+def get_hedger() -> Hedger:
+    return _hedger
+
+
+def get_hedge_stats() -> Dict[str, object]:
+    """Hedge counts, win rate and wasted-token cost, plus the current hedge delay per model."""
+    stats = _hedger.stats()
+    stats["delays"] = {model: _hedger.delay(model) for model in stats.pop("models")}
+    return stats
@@ -0,0 +1,65 @@
+"""
+Deferred imports for heavy optional dependencies.
+
+``lazy_import("PIL.Image")`` returns a stand-in module object; the real module is
+imported the first time an attribute is read from it. Pages that never touch the
+dependency never pay for importing it.
+"""
+import importlib
+import importlib.util
+import threading
+import time
+import types
+from typing import Dict
+
+# module name -> seconds spent importing it through a lazy proxy
+_load_times: Dict[str, float] = {}
+_lock = threading.Lock()
+
+
+class LazyModule(types.ModuleType):
+    """Module proxy that imports the real module on first attribute access."""
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self.__dict__["_lazy_module"] = None
+
+    def _load(self) -> types.ModuleType:
+        module = self.__dict__["_lazy_module"]
+        if module is None:
+            with _lock:
+                module = self.__dict__["_lazy_module"]
+                if module is None:
+                    start = time.perf_counter()
+                    module = importlib.import_module(self.__name__)
+                    _load_times[self.__name__] = time.perf_counter() - start
+                    self.__dict__["_lazy_module"] = module
+        return module
+
+    def __getattr__(self, attr: str):
+        return getattr(self._load(), attr)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        state = "loaded" if self.__dict__["_lazy_module"] is not None else "not loaded"
+        return f"<lazy module '{self.__name__}' ({state})>"
+
+
+def lazy_import(name: str) -> LazyModule:
+    """Return a proxy for ``name`` that imports it on first use."""
+    return LazyModule(name)
+
+
+def is_available(name: str) -> bool:
+    """Check whether a module can be imported, without importing it."""
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+def lazy_load_times() -> Dict[str, float]:
+    """Seconds spent in each lazily imported module so far (for profiling)."""
+    return dict(_load_times)
@@ -0,0 +1,271 @@
+"""
+Shared store for session media (uploaded images, webcam shots, recordings).
+
+Pages used to keep every attachment in session state as a base64 string, so each
+session held a third-larger copy of each file, often several times over. Session
+state now holds a short reference (``media:<hash>``) into this store instead:
+
+    set_media(st.session_state, "gemini_uploaded_image", uploaded_file.getvalue())
+    image_b64 = resolve_media(st.session_state.gemini_uploaded_image)   # when calling a model
+
+Content is stored once per distinct file (by hash), however many sessions hold it.
+Recently used bytes stay in memory up to MEDIA_STORE_MEMORY_MB; the rest spill to
+MEDIA_STORE_DIR and are read back on demand. Each session's references are counted,
+and content is deleted once no session holds it: when a session replaces or clears
+an attachment, and for every attachment of a session that has disconnected
+(see utils/session_resources.py). Each process spills into its own subdirectory of
+MEDIA_STORE_DIR; nothing refers to those files once the process has exited, so a new
+store deletes the subdirectories of exited processes and leaves live ones alone.
+"""
+import base64
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, MutableMapping, Optional, Union
+
+from utils.session_resources import current_session_id, on_session_end, process_dir, sweep_dead_process_dirs
+
+MEDIA_STORE_DIR = os.environ.get("MEDIA_STORE_DIR", "data/media")
+MEDIA_STORE_MEMORY_MB = float(os.environ.get("MEDIA_STORE_MEMORY_MB", 64))
+MEDIA_STORE_DISK_MB = float(os.environ.get("MEDIA_STORE_DISK_MB", 2048))
+
+REF_PREFIX = "media:"
+LOCAL_SESSION = "local"
+
+
+class MediaStoreFull(Exception):
+    """Raised when a new file would not fit in MEDIA_STORE_MEMORY_MB + MEDIA_STORE_DISK_MB."""
+
+
+def is_media_ref(value: Any) -> bool:
+    return isinstance(value, str) and value.startswith(REF_PREFIX)
+
+
+class MediaStore:
+    """Content-addressed, reference-counted media with a bounded memory tier over a disk tier."""
+
+    def __init__(self, directory: str = MEDIA_STORE_DIR, memory_bytes: float = MEDIA_STORE_MEMORY_MB * 1024 * 1024,
+                 disk_bytes: float = MEDIA_STORE_DISK_MB * 1024 * 1024):
+        self.directory = process_dir(directory)
+        self.max_memory_bytes = memory_bytes
+        self.max_disk_bytes = disk_bytes
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_bytes = 0
+        self._on_disk: Dict[str, int] = {}  # digest -> size of its spilled file
+        self._disk_bytes = 0
+        self._sizes: Dict[str, int] = {}
+        self._stored_bytes = 0
+        self._refs: Dict[str, int] = {}
+        self._held: Dict[str, List[str]] = {}  # session -> digests it holds (one entry per reference)
+        self._lock = threading.Lock()
+        self.stats = {"puts": 0, "dedup_puts": 0, "memory_hits": 0, "disk_reads": 0, "spills": 0, "deletes": 0,
+                      "orphans_removed": 0}
+        # Leftovers that could not be removed still take up disk, so they count against the budget
+        removed, _, orphan_bytes = sweep_dead_process_dirs(directory)
+        if removed:
+            print(f"Media store: removed {removed} orphaned file(s) from {directory}")
+        self.stats["orphans_removed"] = removed
+        self._disk_bytes += orphan_bytes
+        self._stored_bytes += orphan_bytes
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.directory, digest[:2], digest)
+
+    # --- Tiers (caller holds the lock) --- #
+
+    def _remember(self, digest: str, data: bytes) -> None:
+        self._memory[digest] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.max_memory_bytes and len(self._memory) > 1:
+            old_digest, old_data = self._memory.popitem(last=False)
+            self._memory_bytes -= len(old_data)
+            if old_digest not in self._on_disk:
+                self._spill(old_digest, old_data)
+
+    def _spill(self, digest: str, data: bytes) -> None:
+        path = self._path(digest)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            # Keep it in memory rather than lose an attachment someone still holds
+            print(f"Could not spill media to disk: {e}")
+            self._memory[digest] = data
+            self._memory_bytes += len(data)
+            return
+        self._on_disk[digest] = len(data)
+        self._disk_bytes += len(data)
+        self.stats["spills"] += 1
+
+    def _delete(self, digest: str) -> None:
+        data = self._memory.pop(digest, None)
+        if data is not None:
+            self._memory_bytes -= len(data)
+        size = self._on_disk.pop(digest, None)
+        if size is not None:
+            self._disk_bytes -= size
+            try:
+                os.remove(self._path(digest))
+            except OSError:
+                pass
+        self._stored_bytes -= self._sizes.pop(digest, 0)
+        self._refs.pop(digest, None)
+        self.stats["deletes"] += 1
+
+    # --- Public API --- #
+
+    def put(self, data: Union[bytes, str], session_id: str = LOCAL_SESSION) -> str:
+        """
+        Store ``data`` (bytes, or a base64 string) for a session and return its reference.
+
+        Raises:
+            MediaStoreFull: If the file would not fit in the disk budget.
+        """
+        if isinstance(data, str):
+            data = base64.b64decode(data)
+        digest = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            if digest in self._sizes:
+                self.stats["dedup_puts"] += 1
+            else:
+                if self._stored_bytes + len(data) > self.max_memory_bytes + self.max_disk_bytes:
+                    raise MediaStoreFull("The media store is full; please try again later.")
+                self._sizes[digest] = len(data)
+                self._stored_bytes += len(data)
+                self._remember(digest, data)
+            self.stats["puts"] += 1
+            self._refs[digest] = self._refs.get(digest, 0) + 1
+            self._held.setdefault(session_id, []).append(digest)
+        return REF_PREFIX + digest
+
+    def get(self, ref: str) -> Optional[bytes]:
+        """The bytes behind a reference, or None if it has been released."""
+        digest = ref[len(REF_PREFIX):]
+        with self._lock:
+            data = self._memory.get(digest)
+            if data is not None:
+                self._memory.move_to_end(digest)
+                self.stats["memory_hits"] += 1
+                return data
+            if digest not in self._on_disk:
+                return None
+            try:
+                with open(self._path(digest), "rb") as f:
+                    data = f.read()
+            except OSError as e:
+                print(f"Could not read spilled media: {e}")
+                return None
+            self.stats["disk_reads"] += 1
+            self._remember(digest, data)
+            return data
+
+    def release(self, ref: str, session_id: str = LOCAL_SESSION) -> None:
+        """Drop one of a session's references; the content goes once nobody holds it."""
+        digest = ref[len(REF_PREFIX):]
+        with self._lock:
+            held = self._held.get(session_id)
+            if not held or digest not in held:
+                return
+            held.remove(digest)
+            if not held:
+                del self._held[session_id]
+            self._release_digest(digest)
+
+    def _release_digest(self, digest: str) -> None:
+        self._refs[digest] = self._refs.get(digest, 1) - 1
+        if self._refs[digest] <= 0:
+            self._delete(digest)
+
+    def release_session(self, session_id: str) -> int:
+        """Drop every reference a session holds. Returns how many there were."""
+        with self._lock:
+            held = self._held.pop(session_id, [])
+            for digest in held:
+                self._release_digest(digest)
+        return len(held)
+
+    def sessions(self) -> List[str]:
+        with self._lock:
+            return list(self._held)
+
+    def session_bytes(self, session_id: str) -> int:
+        """Bytes referenced by one session (shared content counts in full for each holder)."""
+        with self._lock:
+            return sum(self._sizes.get(digest, 0) for digest in set(self._held.get(session_id, [])))
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.stats, items=len(self._sizes), sessions=len(self._held),
+                        memory_bytes=self._memory_bytes, disk_bytes=self._disk_bytes,
+                        stored_bytes=self._stored_bytes)
+
+
+_store: Optional[MediaStore] = None
+_store_lock = threading.Lock()
+
+
+def get_media_store() -> MediaStore:
+    """Get or create the process-wide media store (released per session by the session janitor)."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = MediaStore()
+                on_session_end(_store.release_session, _store.sessions)
+    return _store
+
+
+def _session(session_id: Optional[str]) -> str:
+    return session_id or current_session_id() or LOCAL_SESSION
+
+
+def set_media(state: MutableMapping, key: str, data: Optional[Union[bytes, str]],
+              session_id: Optional[str] = None) -> Optional[str]:
+    """
+    Point ``state[key]`` at ``data`` in the media store, releasing whatever it held before.
+
+    Safe to call on every rerun with the same data: an unchanged file keeps its reference.
+
+    Args:
+        state: Usually st.session_state.
+        key: The state key holding the attachment.
+        data: Raw bytes, base64, or another media reference; None (or a reference that has
+            since been released) clears the attachment.
+        session_id: Owning session (default: the calling Streamlit session).
+
+    Returns:
+        The new reference (or None).
+    """
+    store = get_media_store()
+    session_id = _session(session_id)
+    previous = state.get(key)
+    if is_media_ref(data):
+        data = store.get(data)  # another key's attachment: share its content (None if it was released)
+    elif isinstance(data, str):
+        data = base64.b64decode(data)
+    if data is not None:
+        if is_media_ref(previous) and previous == REF_PREFIX + hashlib.sha256(data).hexdigest() \
+                and store.get(previous) is not None:
+            return previous
+    ref = store.put(data, session_id) if data is not None else None
+    if is_media_ref(previous):
+        store.release(previous, session_id)
+    state[key] = ref
+    return ref
+
+
+def resolve_media(value: Optional[str]) -> Optional[str]:
+    """Base64 content for a media reference (other values, e.g. legacy base64 strings, pass through)."""
+    if not is_media_ref(value):
+        return value
+    data = get_media_store().get(value)
+    return base64.b64encode(data).decode("utf-8") if data is not None else None
+
+
+def get_media_store_stats() -> Dict[str, Any]:
+    """Items, sessions, memory and disk usage, and hit counts for the media store."""
+    return get_media_store().get_stats()
@@ -0,0 +1,411 @@
+"""
+Prometheus-style metrics.
+
+Counters, gauges and histograms are registered once at import time by the modules
+that record them (provider router, storage, TTS cache) and updated on the hot path
+with a dict lookup and a short lock. Statistics the app already keeps (response and
+semantic cache, rate limiter, circuit breakers, fallbacks, hedging, single-flight)
+are read only when /metrics is scraped, so they cost nothing between scrapes.
+
+Set METRICS_PORT to serve the text exposition format from a daemon thread next to
+Streamlit; every replica serves its own endpoint. The prometheus_client package is
+not needed.
+"""
+import bisect
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 0))  # 0 disables the endpoint
+METRICS_ADDRESS = os.environ.get("METRICS_ADDRESS", "0.0.0.0")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# A collector returns (name, type, help, [(labels, value), ...]) families at scrape time
+Sample = Tuple[Dict[str, str], float]
+Family = Tuple[str, str, str, List[Sample]]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+# --- Metric Types --- #
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._default = self.labels()
+
+    def labels(self, *values: str):
+        """The child for one combination of label values (created on first use)."""
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _samples(self) -> Iterator[Tuple[str, Dict[str, str], float]]:
+        for key, child in list(self._children.items()):
+            labels = dict(zip(self.labelnames, key))
+            for suffix, extra, value in child.samples():
+                yield self.name + suffix, {**labels, **extra}, value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        for name, labels, value in self._samples():
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+
+class _Value:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = float(value)
+
+    def samples(self):
+        yield "", {}, self.value
+
+
+class Counter(_Metric):
+    """A monotonically increasing count. Record with ``counter.labels(...).inc()``."""
+    type_name = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._default.inc(amount)
+
+
+class Gauge(_Metric):
+    """A value that goes up and down, such as requests in progress."""
+    type_name = "gauge"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._default.inc(amount)
+
+    def dec(self, amount: float = 1.0) -> None:
+        self._default.dec(amount)
+
+    def set(self, value: float) -> None:
+        self._default.set(value)
+
+
+class _HistogramValue:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last slot is +Inf
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        """Observe the duration of the enclosed block, in seconds."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+    def samples(self):
+        with self._lock:
+            counts = list(self.counts)
+            total = self.sum
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            yield "_bucket", {"le": _format_value(bound)}, cumulative
+        yield "_sum", {}, total
+        yield "_count", {}, cumulative
+
+
+class Histogram(_Metric):
+    """Distribution of observed values (usually seconds) in cumulative buckets."""
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self._default.observe(value)
+
+    def time(self):
+        return self._default.time()
+
+
+# --- Registry --- #
+
+class Registry:
+    """Holds every metric and scrape-time collector and renders them for Prometheus."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], List[Family]]] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        """Add a metric, returning the existing one if the name is already registered (e.g. on reload)."""
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def register_collector(self, collector: Callable[[], List[Family]]) -> None:
+        with self._lock:
+            if collector not in self._collectors:
+                self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        for collector in list(self._collectors):
+            try:
+                families = collector()
+            except Exception as e:
+                print(f"Metrics collector {getattr(collector, '__name__', collector)} failed: {e}")
+                continue
+            for name, type_name, documentation, samples in families:
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {type_name}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def gauge(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+    return REGISTRY.register(Gauge(name, documentation, labelnames))
+
+
+def histogram(name: str, documentation: str, labelnames: Sequence[str] = (),
+              buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+# --- Scrape-time Collectors --- #
+
+def _loaded(module: str) -> bool:
+    """Only report on features that have been used in this process; scraping should not import them."""
+    return module in sys.modules
+
+
+def _collect_app_stats() -> List[Family]:
+    families: List[Family] = []
+
+    if _loaded("utils.response_cache"):
+        from utils.response_cache import get_response_cache_stats
+        stats = get_response_cache_stats()
+        families.append(("gg_response_cache_lookups_total", "counter", "Response cache lookups by result.", [
+            ({"result": "memory_hit"}, stats["memory_hits"]),
+            ({"result": "disk_hit"}, stats["disk_hits"]),
+            ({"result": "miss"}, stats["misses"]),
+            ({"result": "bypass"}, stats["bypassed"]),
+        ]))
+        families.append(("gg_response_cache_entries", "gauge", "Entries in the in-memory response cache tier.",
+                         [({}, stats["memory_items"])]))
+        families.append(("gg_response_cache_disk_bytes", "gauge", "Size of the on-disk response cache tier.",
+                         [({}, stats["disk_bytes"])]))
+
+    if _loaded("utils.semantic_cache"):
+        from utils.semantic_cache import get_semantic_cache_stats
+        stats = get_semantic_cache_stats()
+        families.append(("gg_semantic_cache_lookups_total", "counter", "Semantic cache lookups.",
+                         [({}, stats["lookups"])]))
+        families.append(("gg_semantic_cache_hits_total", "counter", "Semantic cache hits.",
+                         [({}, stats["hits"])]))
+        families.append(("gg_semantic_cache_false_hits_total", "counter", "Audited semantic hits judged wrong.",
+                         [({}, stats["false_hits"])]))
+
+    if _loaded("utils.singleflight"):
+        from utils.singleflight import get_singleflight_stats
+        stats = get_singleflight_stats()
+        families.append(("gg_singleflight_flights_total", "counter", "Upstream calls made for coalescable requests.",
+                         [({}, stats["flights"])]))
+        families.append(("gg_singleflight_coalesced_total", "counter", "Requests that joined an in-flight call.",
+                         [({}, stats["coalesced"])]))
+        families.append(("gg_singleflight_in_flight", "gauge", "Coalescable calls currently in flight.",
+                         [({}, stats["in_flight"])]))
+
+    if _loaded("utils.rate_limit"):
+        from utils.rate_limit import get_rate_limit_stats
+        stats = get_rate_limit_stats()
+        in_flight, queued, rejected = [], [], []
+        for key, values in stats.items():
+            labels = {"governor": key}
+            in_flight.append((labels, values["in_flight"]))
+            queued.append((labels, values["queue_length"]))
+            rejected.append((labels, values["rejected"]))
+        families.append(("gg_provider_in_flight", "gauge", "Provider calls holding a rate-limit permit.", in_flight))
+        families.append(("gg_provider_queue_length", "gauge", "Callers waiting for a rate-limit permit.", queued))
+        families.append(("gg_provider_rejected_total", "counter", "Callers rejected by the rate limiter.", rejected))
+
+    if _loaded("utils.resilience"):
+        from utils.resilience import get_resilience_stats
+        stats = get_resilience_stats()
+        states = ("closed", "half_open", "open")
+        circuits = stats.pop("circuits", {})
+        families.append(("gg_circuit_state", "gauge", "1 for the current state of each provider circuit breaker.", [
+            ({"provider": provider, "state": state}, 1 if current == state else 0)
+            for provider, current in circuits.items() for state in states
+        ]))
+        families.append(("gg_provider_resilience_events_total", "counter", "Retries, failures and circuit rejections.", [
+            ({"provider": provider, "event": event}, count)
+            for event, per_provider in stats.items() for provider, count in per_provider.items()
+        ]))
+
+    if _loaded("utils.fallback"):
+        from utils.fallback import get_fallback_stats
+        families.append(("gg_fallbacks_total", "counter", "Requests served by a fallback model.", [
+            ({"route": route}, entry.get("count", 0)) for route, entry in get_fallback_stats().items()
+        ]))
+
+    if _loaded("utils.hedging"):
+        from utils.hedging import get_hedge_stats
+        stats = get_hedge_stats()
+        families.append(("gg_hedged_requests_total", "counter", "Requests that sent a hedge call.",
+                         [({}, stats["hedged"])]))
+        families.append(("gg_hedge_wins_total", "counter", "Hedge calls that answered first.",
+                         [({}, stats["hedge_wins"])]))
+        families.append(("gg_hedge_wasted_tokens_total", "counter", "Output tokens spent on losing hedge calls.",
+                         [({}, stats["wasted_tokens"])]))
+
+    if _loaded("utils.media_store"):
+        from utils.media_store import get_media_store_stats
+        stats = get_media_store_stats()
+        families.append(("gg_media_store_bytes", "gauge", "Session media held, by storage tier.", [
+            ({"tier": "memory"}, stats["memory_bytes"]),
+            ({"tier": "disk"}, stats["disk_bytes"]),
+        ]))
+        families.append(("gg_media_store_items", "gauge", "Distinct media files held.", [({}, stats["items"])]))
+        families.append(("gg_media_store_sessions", "gauge", "Sessions holding media.", [({}, stats["sessions"])]))
+
+    if _loaded("utils.session_resources"):
+        from utils.session_resources import get_session_resource_stats
+        stats = get_session_resource_stats()
+        families.append(("gg_session_temp_files", "gauge", "Temp files tracked for sessions.", [({}, stats["files"])]))
+        families.append(("gg_session_temp_bytes", "gauge", "Bytes in tracked session temp files.",
+                         [({}, stats["bytes"])]))
+        families.append(("gg_session_cleanup_total", "counter", "Temp files cleaned up, by reason.", [
+            ({"reason": reason}, stats[reason]) for reason in ("released", "expired", "swept", "trimmed")
+        ]))
+        families.append(("gg_sessions_ended_total", "counter", "Ended sessions cleaned up by the janitor.",
+                         [({}, stats["sessions_ended"])]))
+    return families
+
+
+REGISTRY.register_collector(_collect_app_stats)
+
+
+# --- HTTP Endpoint --- #
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # scrapes every few seconds would flood the Streamlit log
+
+
+_server: Optional[ThreadingHTTPServer] = None
+_server_failed = False
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port: int = METRICS_PORT, address: str = METRICS_ADDRESS) -> Optional[int]:
+    """
+    Serve /metrics from a daemon thread, once per process. Safe to call on every
+    Streamlit rerun. Does nothing when ``port`` is 0.
+
+    Returns:
+        The port being served, or None if the endpoint is disabled or could not start.
+    """
+    global _server, _server_failed
+    if not port or _server_failed:
+        return None
+    if _server is not None:
+        return _server.server_address[1]
+    with _server_lock:
+        if _server is None:
+            try:
+                server = ThreadingHTTPServer((address, port), _MetricsHandler)
+            except OSError as e:
+                print(f"Metrics endpoint could not listen on {address}:{port}: {e}")
+                _server_failed = True
+                return None
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, daemon=True, name="metrics-http").start()
+            _server = server
+            print(f"Serving Prometheus metrics on http://{address}:{port}/metrics")
+    return _server.server_address[1]
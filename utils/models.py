@@ -1,40 +1,109 @@
-import os
-import sys
-import requests
-import json
-from typing import List, Dict, Any, Optional, Generator
-import base64
-from PIL import Image
-import io
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from typing import List, Dict, Any, Optional, Generator, Iterator, Tuple, Union
+
+from utils.fallback import TTFT_DEADLINE_SECONDS, fallback_chain, record_fallback
+from utils.hedging import HEDGE_ENABLED, get_hedger, hedge_target
+from utils.metrics import counter, histogram
+from utils.providers import ChatChunk, ChatRequest, ProviderError, get_capabilities, get_provider, message_text, model_catalog
+from utils.rate_limit import permit
+from utils.resilience import stream_with_retry
+from utils.response_cache import cache_key, get_response_cache, replay, should_cache
+from utils.semantic_cache import SEMANTIC_CACHE_ENABLED, cache_scope, get_semantic_cache, is_cacheable
+from utils.singleflight import SINGLEFLIGHT_ENABLED, join_flight
+from utils.streaming import BackgroundStream, first_of
+from utils.tracing import current_span, trace_iter
+from utils.usage import check_quota, metered, record_coalesced
+from utils.work_pool import BACKGROUND, INTERACTIVE, WorkPoolFull, get_work_pool, provider_slot
 
 # --- Model Definitions ---
 
-SUPPORTED_MODELS = {
-    # Gemini Models (using google.generativeai)
-    "Gemini 1.5 Pro (Google)": {"api": "gemini", "model_name": "gemini-1.5-pro"},
-    "Gemini 1.5 Flash (Google)": {"api": "gemini", "model_name": "gemini-1.5-flash"},
-    # Add other Gemini models from the original GEMINI_MODELS dict as needed
-    # "Gemini 2.5 Pro Preview (Google)": {"api": "gemini", "model_name": "gemini-2.5-pro-preview-03-25"}, # Example if needed
-    "Gemini 2.0 Flash (Google)": {"api": "gemini", "model_name": "gemini-2.0-flash"},
-
-    # Anthropic Models
-    "Claude 3.5 Sonnet (Anthropic)": {"api": "anthropic", "model_name": "claude-3-5-sonnet-20241022"},
-    # Add other Claude models if you have access or they are released
-    # "Claude 3 Opus (Anthropic)": {"api": "anthropic", "model_name": "claude-3-opus-20240229"}, # Example
-
-    # OpenAI Models
-    "GPT-4o (OpenAI)": {"api": "openai", "model_name": "gpt-4o"},
-    "GPT-4 Turbo (OpenAI)": {"api": "openai", "model_name": "gpt-4-turbo"},
-    "GPT-3.5 Turbo (OpenAI)": {"api": "openai", "model_name": "gpt-3.5-turbo"},
-
-    # Perplexity Models
-    "Perplexity Online 70B (Perplexity)": {"api": "perplexity", "model_name": "pplx-70b-online"},
-    "Perplexity Chat 70B (Perplexity)": {"api": "perplexity", "model_name": "pplx-70b-chat"},
-    # Add other Perplexity models if needed
-}
+# The catalog is declared by the provider registry in utils/providers, next to each
+# provider's adapter and capabilities. Listing a model never imports its SDK.
+SUPPORTED_MODELS = model_catalog()
+
+# --- Metrics --- #
+
+CHAT_REQUESTS = counter("gg_chat_requests_total", "Chat requests by requested model, serving model, cache outcome and result.",
+                        ("model", "served_model", "cache", "outcome"))
+PROVIDER_REQUESTS = counter("gg_provider_requests_total", "Provider calls by result.", ("provider", "model", "outcome"))
+PROVIDER_TTFT = histogram("gg_provider_ttft_seconds", "Time from permit to first chunk of a provider call.",
+                          ("provider", "model"))
+PROVIDER_DURATION = histogram("gg_provider_request_seconds", "Duration of provider calls, including retries.",
+                              ("provider", "model"))
+PROVIDER_TOKENS = counter("gg_provider_tokens_total", "Tokens reported by providers.", ("provider", "model", "kind"))
+RATE_LIMIT_WAIT = histogram("gg_rate_limit_wait_seconds", "Time spent waiting for a provider call permit.",
+                            ("provider",))
+
+
+def get_available_models() -> Dict[str, Dict[str, Any]]:
+    """Return only the models whose provider has credentials configured."""
+    return model_catalog(configured_only=True)
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token estimate (~4 characters per token) used for context budgeting."""
+    return len(text) // 4 + 1
+
+
+def _fit_history(history: List[Dict[str, Any]], prompt: str, max_context: int) -> List[Dict[str, Any]]:
+    """Drop the oldest messages until the history and prompt fit in the model's context window."""
+    budget = max_context - estimate_tokens(prompt)
+    kept = []
+    for message in reversed(history):
+        cost = estimate_tokens(message_text(message))
+        if cost > budget:
+            break
+        kept.append(message)
+        budget -= cost
+    kept.reverse()
+    return kept
+
+
+def build_request(
+    model_info: Dict[str, Any],
+    prompt: str,
+    message_history: List[Dict[str, Any]],
+    image_data: Optional[str] = None,
+    audio_data: Optional[str] = None,
+    temperature: float = 0.7,
+    system_prompt: Optional[str] = None,
+    screen_data: Optional[str] = None,
+    user_id: Optional[str] = None,
+) -> ChatRequest:
+    """
+    Build a provider-agnostic request, applying the provider's declared capabilities.
+
+    Raises:
+        ProviderError: If attachments are given to a provider that cannot accept them.
+    """
+    api_type = model_info["api"]
+    capabilities = get_capabilities(api_type)
+
+    if (image_data or audio_data or screen_data) and not capabilities.multimodal:
+        raise ProviderError(f"{api_type} models do not accept image or audio input.", provider=api_type)
+
+    if system_prompt and not capabilities.system_prompt:
+        prompt = f"{system_prompt}\n\n{prompt}"
+        system_prompt = None
+
+    max_context = model_info.get("max_context", capabilities.max_context_tokens)
+    return ChatRequest(
+        model_name=model_info["model_name"],
+        prompt=prompt,
+        history=_fit_history(message_history, prompt, max_context),
+        image_data=image_data,
+        audio_data=audio_data,
+        screen_data=screen_data,
+        temperature=temperature,
+        system_prompt=system_prompt,
+        user_id=user_id,
+    )
+
 
 # --- Central API Router --- #
-# Note: This router currently returns the full response. We'll adapt it for streaming.
 def generate_chat_response(
     selected_model_key: str,
     prompt: str,
@@ -42,11 +111,23 @@ def generate_chat_response(
     image_data: Optional[str] = None,
     audio_data: Optional[str] = None,
     temperature: float = 0.7,
-    stream: bool = False # Add stream parameter
-) -> Generator[str, None, None] | str:
+    stream: bool = False,
+    system_prompt: Optional[str] = None,
+    user_id: Optional[str] = None,
+    response_info: Optional[Dict[str, Any]] = None,
+    cache: Optional[bool] = None
+) -> Union[Generator[str, None, None], str]:
     """
     Generates a chat response (optionally streaming) using the specified model.
 
+    If the model fails before producing output, or misses the time-to-first-token
+    deadline, the router falls back along the model's chain (see utils/fallback.py).
+    With HEDGE_ENABLED, a slow first call to the selected model is raced against a
+    duplicate (see utils/hedging.py). Deterministic requests are answered from the
+    response cache when possible (see utils/response_cache.py), and with
+    SEMANTIC_CACHE_ENABLED near-duplicate prompts from utils/semantic_cache.py.
+    Provider calls are metered and quota-checked per user (see utils/usage.py).
+
     Args:
         selected_model_key: The key corresponding to the model in SUPPORTED_MODELS.
         prompt: The user's input prompt.
@@ -55,86 +136,646 @@ def generate_chat_response(
         audio_data: Optional base64 encoded audio data.
         temperature: Temperature for response generation.
         stream: If True, yields chunks of the response.
+        system_prompt: Optional system instruction for the model.
+        user_id: The app user making the request, for per-user rate limiting, usage and quotas.
+        response_info: Optional dict the router fills in with details of how the request
+            was served ("served_model", "ttft_seconds", "fallback_from", "hedge", "usage",
+            "cache", "semantic_match", "coalesced"). When streaming it is complete once the
+            generator is exhausted.
+        cache: True to use the response cache at any temperature, False to bypass it,
+            None (default) to cache only temperature-0 requests.
 
     Returns:
         A generator yielding response chunks if stream=True, otherwise the full response text.
-        Returns an error message string on failure.
+        Returns (or yields) an error message string on failure.
     """
     if selected_model_key not in SUPPORTED_MODELS:
-        error_msg = f"Error: Model '{selected_model_key}' not found in supported models."
-        if stream:
-            yield error_msg
+        return _error_result(f"Error: Model '{selected_model_key}' not found in supported models.", stream)
+
+    denied = check_quota(user_id, selected_model_key)
+    if denied:
+        return _error_result(f"Error: {denied}", stream)
+
+    info = response_info if response_info is not None else {}
+    info["requested_model"] = selected_model_key
+    call = {
+        "prompt": prompt,
+        "message_history": message_history,
+        "image_data": image_data,
+        "audio_data": audio_data,
+        "temperature": temperature,
+        "system_prompt": system_prompt,
+        "user_id": user_id,
+    }
+    chunks = trace_iter(
+        "router.generate",
+        _counted(selected_model_key, _cached_chunks(selected_model_key, call, info, cache), info),
+        {"model": selected_model_key, "temperature": temperature, "stream": stream,
+         "history_messages": len(message_history), "attachments": bool(image_data or audio_data)},
+        on_item=_count_chunk,
+        on_end=lambda span: span.set_attributes(_info_attributes(info)),
+    )
+
+    if stream:
+        return _stream_text(selected_model_key, chunks)
+    return _complete_text(selected_model_key, chunks)
+
+
+def _error_result(error_msg: str, stream: bool) -> Union[Generator[str, None, None], str]:
+    """Return an error message in the shape the caller asked for."""
+    if stream:
+        return (chunk for chunk in [error_msg])
+    return error_msg
+
+
+def _count_chunk(span, chunk: ChatChunk) -> None:
+    """trace_iter hook: tally streamed characters and record token usage on the span."""
+    span.set_attribute("output_chars", span.attributes.get("output_chars", 0) + len(chunk.text))
+    if chunk.usage:
+        span.set_attribute("input_tokens", chunk.usage.get("input_tokens"))
+        span.set_attribute("output_tokens", chunk.usage.get("output_tokens"))
+    if chunk.finish_reason:
+        span.set_attribute("finish_reason", chunk.finish_reason)
+
+
+def _info_attributes(info: Dict[str, Any]) -> Dict[str, Any]:
+    """Span attributes describing how the router served a request."""
+    hedge = info.get("hedge") or {}
+    return {
+        "served_model": info.get("served_model"),
+        "cache": info.get("cache"),
+        "fallback_from": info.get("fallback_from"),
+        "coalesced": info.get("coalesced"),
+        "hedge_won": hedge.get("won"),
+        "ttft_seconds": info.get("ttft_seconds"),
+    }
+
+
+def _provider_chunks(api_type: str, request: ChatRequest, charge_user: bool = True) -> Iterator[ChatChunk]:
+    """
+    Stream chunks from a provider under a rate-limit permit and a work pool call slot,
+    through its retry policy and circuit breaker. Both are taken for each attempt and
+    held until its stream is finished or closed, but not across the backoff between
+    attempts. Only the first attempt, and only with ``charge_user``, spends the user's
+    rate limit; retries, hedges and fallbacks are the router's own calls.
+    """
+    return trace_iter(
+        "provider.stream",
+        _permitted_chunks(api_type, request, charge_user),
+        {"provider": api_type, "model": request.model_name, "history_messages": len(request.history),
+         "prompt_chars": len(request.prompt)},
+        on_item=_count_chunk,
+    )
+
+
+def _permitted_chunks(api_type: str, request: ChatRequest, charge_user: bool) -> Iterator[ChatChunk]:
+    adapter = get_provider(api_type)
+    started = attempt_started = None  # when the first / latest attempt got its permit
+
+    def attempt() -> Iterator[ChatChunk]:
+        nonlocal started, attempt_started
+        with permit(api_type, request.model_name, request.user_id,
+                    charge_user=charge_user and started is None) as waited, provider_slot():
+            current_span().set_attribute("rate_limit_wait_ms", round(waited * 1000, 1))
+            RATE_LIMIT_WAIT.labels(api_type).observe(waited)
+            attempt_started = time.monotonic()
+            started = started or attempt_started
+            yield from adapter.stream(request)
+
+    first = True
+    outcome = "error"
+    try:
+        for chunk in metered(api_type, request, stream_with_retry(api_type, attempt)):
+            if first:
+                PROVIDER_TTFT.labels(api_type, request.model_name).observe(time.monotonic() - attempt_started)
+                first = False
+            if chunk.usage:
+                PROVIDER_TOKENS.labels(api_type, request.model_name, "input").inc(chunk.usage.get("input_tokens") or 0)
+                PROVIDER_TOKENS.labels(api_type, request.model_name, "output").inc(chunk.usage.get("output_tokens") or 0)
+            yield chunk
+        outcome = "ok"
+    except GeneratorExit:
+        outcome = "cancelled"
+        raise
+    finally:
+        if started is not None:  # a request the rate limiter turned away never reached the provider
+            PROVIDER_REQUESTS.labels(api_type, request.model_name, outcome).inc()
+            PROVIDER_DURATION.labels(api_type, request.model_name).observe(time.monotonic() - started)
+
+
+def _counted(selected_model_key: str, chunks: Iterator[ChatChunk], info: Dict[str, Any]) -> Iterator[ChatChunk]:
+    """Count the request in CHAT_REQUESTS once it has finished, failed or been abandoned."""
+    outcome = "error"
+    try:
+        yield from chunks
+        outcome = "ok"
+    except GeneratorExit:
+        outcome = "cancelled"
+        raise
+    finally:
+        CHAT_REQUESTS.labels(selected_model_key, info.get("served_model") or "none",
+                             info.get("cache") or "none", outcome).inc()
+
+
+def _cached_chunks(selected_model_key: str, call: Dict[str, Any], info: Dict[str, Any],
+                   opt_in: Optional[bool]) -> Iterator[ChatChunk]:
+    """
+    Replay a cached response when there is one; otherwise route the request and cache
+    the answer once it has streamed to completion from the requested model.
+
+    Identical deterministic requests already in flight share one upstream call
+    (see utils/singleflight.py). Opting out (``opt_in=False``) also skips the semantic
+    cache: the answer always comes from a model for this exact prompt.
+    """
+    response_cache = get_response_cache()
+    use_cache = should_cache(call["temperature"], opt_in)
+    semantic = opt_in is not False
+    coalesce = SINGLEFLIGHT_ENABLED and (call["temperature"] <= 0 or bool(opt_in))
+    if not use_cache:
+        response_cache.record_bypass()
+        info["cache"] = "bypass"
+        if not coalesce:
+            if semantic:
+                yield from _semantic_chunks(selected_model_key, call, info)
+            else:
+                yield from _route_chunks(selected_model_key, call, info)
+            return
+
+    key = cache_key(SUPPORTED_MODELS[selected_model_key], call)
+    if use_cache:
+        entry = response_cache.get(key)
+        if entry is not None:
+            info["cache"] = "hit"
+            info["served_model"] = selected_model_key
+            info["ttft_seconds"] = 0.0
+            yield from replay(entry)
             return
+        info["cache"] = "miss"
+
+    store_key = key if use_cache else None
+    if coalesce:
+        def open_stream(flight_info: Dict[str, Any]) -> Iterator[ChatChunk]:
+            flight_info["cache"] = info["cache"]
+            return _fill_cache(selected_model_key, call, flight_info, store_key, semantic)
+
+        started = time.monotonic()
+        try:
+            # A request that opted out must not share a flight that may be served by the semantic cache
+            yield from join_flight(key if semantic else f"{key}:exact", open_stream, info)
+        finally:
+            if info.get("coalesced"):
+                # The leader's call is metered under the leader; the follower still made a request
+                model_info = SUPPORTED_MODELS[info.get("served_model") or selected_model_key]
+                record_coalesced(call["user_id"], model_info["api"], model_info["model_name"],
+                                 time.monotonic() - started)
+    else:
+        yield from _fill_cache(selected_model_key, call, info, store_key, semantic)
+
+
+def _fill_cache(selected_model_key: str, call: Dict[str, Any], info: Dict[str, Any],
+                key: Optional[str], semantic: bool = True) -> Iterator[ChatChunk]:
+    """
+    Route the request (through the semantic cache unless ``semantic`` is False), storing
+    the complete answer under ``key`` (if given) in the response cache.
+    """
+    texts = []
+    usage = None
+    finish_reason = None
+    if semantic:
+        chunks = _semantic_chunks(selected_model_key, call, info)
+    else:
+        chunks = _route_chunks(selected_model_key, call, info)
+    for chunk in chunks:
+        if chunk.text:
+            texts.append(chunk.text)
+        usage = chunk.usage or usage
+        finish_reason = chunk.finish_reason or finish_reason
+        yield chunk
+    # Only complete answers from the requested model are worth replaying; a fallback
+    # answer would keep being served after the model recovers.
+    if (key and texts and info.get("cache") == "miss" and info.get("served_model") == selected_model_key
+            and finish_reason not in ("length", "max_tokens", "error")):
+        get_response_cache().put(key, {
+            "text": "".join(texts),
+            "chunks": texts,
+            "usage": usage,
+            "finish_reason": finish_reason,
+        })
+
+
+def _semantic_chunks(selected_model_key: str, call: Dict[str, Any], info: Dict[str, Any]) -> Iterator[ChatChunk]:
+    """
+    Serve a stand-alone prompt from the semantic cache when a near-duplicate has been
+    answered before; otherwise route it and index the answer.
+    """
+    if not (SEMANTIC_CACHE_ENABLED and is_cacheable(call)):
+        yield from _route_chunks(selected_model_key, call, info)
+        return
+
+    semantic_cache = get_semantic_cache()
+    scope = cache_scope(selected_model_key, call["system_prompt"], call["user_id"])
+    match = semantic_cache.lookup(scope, call["prompt"])
+    if match is not None:
+        entry, score = match
+        info["cache"] = "semantic"
+        info["served_model"] = selected_model_key
+        info["ttft_seconds"] = 0.0
+        info["semantic_match"] = {"prompt": entry["prompt"], "similarity": round(score, 3)}
+        if semantic_cache.should_audit():
+            try:
+                get_work_pool().submit(_audit_semantic_hit, selected_model_key, call, entry, lane=BACKGROUND,
+                                       name="semantic-audit")
+            except WorkPoolFull:
+                pass  # audits are sampled anyway; skip this one rather than add to a backlog
+        yield ChatChunk(text=entry["response"])
+        yield ChatChunk(finish_reason="stop")
+        return
+
+    texts = []
+    for chunk in _route_chunks(selected_model_key, call, info):
+        if chunk.text:
+            texts.append(chunk.text)
+        yield chunk
+    if texts and info.get("served_model") == selected_model_key:
+        semantic_cache.add(scope, call["prompt"], "".join(texts), selected_model_key)
+
+
+def _audit_semantic_hit(selected_model_key: str, call: Dict[str, Any], entry: Dict[str, Any]) -> None:
+    """Ask the model anyway and check whether the cached answer it was spared was a false hit."""
+    try:
+        fresh = "".join(chunk.text for chunk in _route_chunks(selected_model_key, call, {}, fallback=False,
+                                                              charge_user=False))
+    except Exception as e:
+        print(f"Semantic cache audit for {selected_model_key} failed: {e}")
+        return
+    get_semantic_cache().record_audit(call["prompt"], entry, fresh)
+
+
+def _route_chunks(selected_model_key: str, call: Dict[str, Any], info: Dict[str, Any],
+                  fallback: bool = True, charge_user: bool = True) -> Iterator[ChatChunk]:
+    """
+    Stream from the selected model, falling back along its chain when a model errors
+    before its first chunk or misses the time-to-first-token deadline. Only the call to
+    the selected model (with ``charge_user``) counts against the user's rate limit.
+
+    Every model except the last in the chain is started on a BackgroundStream so the
+    deadline can be enforced; the last one is streamed directly.
+    """
+    candidates = [selected_model_key]
+    if fallback:
+        candidates += fallback_chain(selected_model_key, SUPPORTED_MODELS)
+    started = time.monotonic()
+    skipped = []  # (model_key, reason, abandoned BackgroundStream or None)
+    last_error: Optional[Exception] = None
+
+    for position, model_key in enumerate(candidates):
+        model_info = SUPPORTED_MODELS[model_key]
+        try:
+            request = build_request(model_info, **call)
+        except ProviderError as e:
+            # e.g. a text-only fallback for a request with an image attached
+            last_error = last_error or e
+            continue
+
+        last = position == len(candidates) - 1
+        charge = charge_user and position == 0
+        if HEDGE_ENABLED and position == 0:
+            pending = BackgroundStream(
+                lambda key=model_key, request=request: _hedged_chunks(key, request, call, info, charge),
+                name=model_key)
+            chunks = iter(pending)
         else:
-            return error_msg
+            chunks = _provider_chunks(model_info["api"], request, charge)
+            if not last:
+                pending = BackgroundStream(lambda chunks=chunks: chunks, name=model_key)
+        if not last:
+            if not pending.wait_first(TTFT_DEADLINE_SECONDS):
+                print(f"{model_key} missed the {TTFT_DEADLINE_SECONDS:g}s first-token deadline; falling back")
+                skipped.append((model_key, "slow", pending))
+                continue
+            if pending.failed_before_first_item:
+                print(f"{model_key} failed ({pending.error}); falling back")
+                last_error = pending.error
+                skipped.append((model_key, "error", None))
+                continue
+            chunks = iter(pending)
+
+        yield from _serve(model_key, chunks, started, info, skipped)
+        return
+
+    for _, _, abandoned in skipped:
+        if abandoned is not None:
+            abandoned.cancel()
+    raise last_error or ProviderError(f"No model in the fallback chain for {selected_model_key} could answer.")
+
+
+def _request_tokens(request: ChatRequest) -> int:
+    """Estimated input tokens of a request, for costing hedges."""
+    return estimate_tokens(request.prompt) + sum(estimate_tokens(message_text(m)) for m in request.history)
+
+
+def _tracked_stream(model_key: str, request: ChatRequest, tally: Dict[str, int],
+                    charge_user: bool = True) -> BackgroundStream:
+    """Start a provider stream in the background, counting its output tokens and recording its TTFT."""
+    api_type = SUPPORTED_MODELS[model_key]["api"]
+
+    def open_stream():
+        for chunk in _provider_chunks(api_type, request, charge_user):
+            if chunk.text:
+                tally["tokens"] += estimate_tokens(chunk.text)
+            yield chunk
+
+    def record_ttft(stream: BackgroundStream) -> None:
+        if stream.ttft is not None:
+            get_hedger().record_ttft(model_key, stream.ttft)
+
+    stream = BackgroundStream(open_stream, name=model_key)
+    stream.add_done_callback(record_ttft)
+    return stream
+
+
+def _hedged_chunks(model_key: str, request: ChatRequest, call: Dict[str, Any], info: Dict[str, Any],
+                   charge_user: bool = True) -> Iterator[ChatChunk]:
+    """
+    Stream from ``model_key``; if it has no first token after the hedge delay, and the
+    hedge caps allow, race it against a duplicate request (not charged to the user's
+    rate limit) and cancel the loser.
+    """
+    hedger = get_hedger()
+    slot = hedger.note_request()
+    tallies = [{"tokens": 0}]
+    streams = [_tracked_stream(model_key, request, tallies[0], charge_user)]
+    winner = None
+    hedge_request = request
+    try:
+        if first_of(streams, hedger.delay(model_key)) is None and hedger.try_hedge(slot):
+            target = hedge_target(model_key, SUPPORTED_MODELS)
+            try:
+                hedge_request = request if target == model_key else build_request(SUPPORTED_MODELS[target], **call)
+            except ProviderError:
+                hedge_request, target = request, model_key
+            print(f"Hedging {model_key} with a duplicate request to {target}")
+            tallies.append({"tokens": 0})
+            streams.append(_tracked_stream(target, hedge_request, tallies[1], charge_user=False))
+            winner = first_of(streams)
+            hedge_won = winner is streams[1]
+            info["hedge"] = {"model": target, "won": hedge_won}
+            loser, tally = (streams[0], tallies[0]) if hedge_won else (streams[1], tallies[1])
+            loser.cancel()
+            # The loser is billed for its input plus whatever it generated before it was stopped
+            input_tokens = _request_tokens(request if loser is streams[0] else hedge_request)
+            loser.add_done_callback(lambda stream: hedger.record_outcome(
+                hedge_won, 0 if stream.failed_before_first_item else input_tokens + tally["tokens"]))
+        winner = winner or streams[0]
+        yield from winner
+    finally:
+        for stream in streams:
+            stream.cancel()
+
+
+def _serve(model_key: str, chunks: Iterator[ChatChunk], started: float, info: Dict[str, Any],
+           skipped: List) -> Iterator[ChatChunk]:
+    """Yield the chunks of the model that is answering, recording TTFT and any fallbacks taken."""
+    first_at = None
+    try:
+        for chunk in chunks:
+            if first_at is None:
+                first_at = time.monotonic()
+                hedge = info.get("hedge") if model_key == info.get("requested_model") else None
+                info["served_model"] = hedge["model"] if hedge and hedge["won"] else model_key
+                info["ttft_seconds"] = first_at - started
+                if skipped:
+                    info["fallback_from"] = [key for key, _, _ in skipped]
+            if chunk.usage:
+                info["usage"] = chunk.usage
+            yield chunk
+    finally:
+        for from_model, reason, abandoned in skipped:
+            if abandoned is not None:
+                # Stop the abandoned model at its first token; that tells us how much sooner
+                # the fallback answered.
+                abandoned.cancel()
+                if first_at is not None:
+                    abandoned.add_done_callback(
+                        lambda stream, from_model=from_model: record_fallback(
+                            from_model, model_key, "slow",
+                            stream.first_item_at - first_at if stream.first_item_at else None,
+                        )
+                    )
+            elif first_at is not None:
+                record_fallback(from_model, model_key, reason)
+
+
+def _stream_text(selected_model_key: str, chunks: Iterator[ChatChunk]) -> Generator[str, None, None]:
+    """Yield text deltas, turning failures into a trailing error message."""
+    try:
+        for chunk in chunks:
+            if chunk.text:
+                yield chunk.text
+    except Exception as e:
+        yield f"Error generating response with {selected_model_key}: {str(e)}"
 
-    model_info = SUPPORTED_MODELS[selected_model_key]
-    api_type = model_info["api"]
-    model_name = model_info["model_name"]
 
+def _complete_text(selected_model_key: str, chunks: Iterator[ChatChunk]) -> str:
+    """Return the full response text, or an error message on failure."""
     try:
-        if api_type == "gemini":
-            # Call the Gemini function, passing the stream flag
-            return get_gemini_response(
-                prompt=prompt,
-                message_history=message_history,
-                image_data=image_data,
-                audio_data=audio_data,
-                temperature=temperature,
-                model_name=model_name,
-                stream=stream # Pass the stream flag
-            )
-        # --- Add streaming logic for other APIs later if needed --- 
-        elif api_type == "anthropic":
-            if stream:
-                 # Placeholder: Anthropic streaming needs separate implementation
-                 yield "Streaming not yet implemented for Anthropic."
-                 return
-            return get_anthropic_response(
-                prompt=prompt,
-                message_history=message_history,
-                model_name=model_name
-            )
-        elif api_type == "openai":
-            if stream:
-                # Placeholder: OpenAI streaming needs separate implementation
-                yield "Streaming not yet implemented for OpenAI."
-                return
-            return get_openai_response(
-                prompt=prompt,
-                message_history=message_history,
-                model_name=model_name
-            )
-        elif api_type == "perplexity":
-            if stream:
-                 # Placeholder: Perplexity streaming needs separate implementation
-                 yield "Streaming not yet implemented for Perplexity."
-                 return
-            return get_perplexity_response(
-                prompt=prompt,
-                message_history=message_history,
-                temperature=temperature,
-                model_name=model_name
-            )
-        else:
-            error_msg = f"Error: API type '{api_type}' is not recognized."
-            if stream:
-                yield error_msg
-                return
-            else:
-                return error_msg
+        return "".join(chunk.text for chunk in chunks)
+    except Exception as e:
+        return f"Error generating response with {selected_model_key}: {str(e)}"
+
+
+# --- Compare Mode --- #
+
+@dataclass
+class ModelRun:
+    """One model's answer (in a compare run or from run_chat_request), with its timings and token counts."""
+    model_key: str
+    text: str = ""
+    served_model: Optional[str] = None
+    ttft_seconds: Optional[float] = None
+    latency_seconds: Optional[float] = None
+    input_tokens: Optional[int] = None
+    output_tokens: Optional[int] = None
+    error: Optional[str] = None
+
 
+def compare_chat_responses(
+    model_keys: List[str],
+    prompt: str,
+    message_history: List[Dict[str, str]],
+    temperature: float = 0.7,
+    system_prompt: Optional[str] = None,
+    user_id: Optional[str] = None,
+    results: Optional[Dict[str, ModelRun]] = None
+) -> Iterator[Tuple[str, str]]:
+    """
+    Send one prompt to several models at once and stream their answers as they arrive.
+
+    Each model runs as its own interactive task on the shared work pool, so the total
+    wall time is that of the slowest model. Fallback is disabled: every answer comes from the model it is shown under.
+
+    Args:
+        model_keys: Keys of SUPPORTED_MODELS to compare.
+        prompt: The user's input prompt.
+        message_history: Previous message history, sent to every model.
+        temperature: Temperature for response generation.
+        system_prompt: Optional system instruction for the models.
+        user_id: The app user making the request, for per-user rate limiting, usage and quotas.
+        results: Optional dict filled in with a ModelRun per model key. Complete once
+            the generator is exhausted.
+
+    Yields:
+        (model_key, text) pairs in arrival order. A failed model yields an error message.
+    """
+    results = results if results is not None else {}
+    call = {
+        "prompt": prompt,
+        "message_history": message_history,
+        "image_data": None,
+        "audio_data": None,
+        "temperature": temperature,
+        "system_prompt": system_prompt,
+        "user_id": user_id,
+    }
+    events: "queue.Queue" = queue.Queue()
+    stop = threading.Event()
+    started = time.monotonic()
+    tasks = []
+    for model_key in model_keys:
+        run = results[model_key] = ModelRun(model_key)
+        try:
+            task = get_work_pool().submit(_compare_worker, run, call, started, events, stop, lane=INTERACTIVE,
+                                          name=f"compare-{model_key}")
+        except WorkPoolFull as e:
+            run.error = str(e)
+            events.put((model_key, f"Error generating response with {model_key}: {str(e)}"))
+            events.put((model_key, None))
+            continue
+        # A task cancelled while still queued never runs, so report it finished here
+        task.future.add_done_callback(lambda f, key=model_key: events.put((key, None)) if f.cancelled() else None)
+        tasks.append(task)
+
+    pending = len(model_keys)
+    try:
+        while pending:
+            model_key, text = events.get()
+            if text is None:
+                pending -= 1
+                continue
+            yield model_key, text
+    finally:
+        # Stop the remaining models if the caller went away early
+        stop.set()
+        for task in tasks:
+            task.cancel()
+
+
+def _compare_worker(run: ModelRun, call: Dict[str, Any], started: float, events: "queue.Queue",
+                    stop: threading.Event) -> None:
+    """Stream one model's answer for compare_chat_responses into the shared event queue."""
+    info: Dict[str, Any] = {"requested_model": run.model_key}
+    chunks = None
+    try:
+        if run.model_key not in SUPPORTED_MODELS:
+            raise ProviderError(f"Model '{run.model_key}' not found in supported models.")
+        denied = check_quota(call["user_id"], run.model_key)
+        if denied:
+            raise ProviderError(denied)
+        chunks = _route_chunks(run.model_key, call, info, fallback=False)
+        for chunk in chunks:
+            if stop.is_set():
+                break
+            if chunk.text:
+                if run.ttft_seconds is None:
+                    run.ttft_seconds = time.monotonic() - started
+                run.text += chunk.text
+                events.put((run.model_key, chunk.text))
     except Exception as e:
-        error_msg = f"Error generating response with {selected_model_key}: {str(e)}"
-        if stream:
-             yield error_msg
-             return
-        else:
-            return error_msg
+        run.error = str(e)
+        events.put((run.model_key, f"Error generating response with {run.model_key}: {str(e)}"))
+    finally:
+        if chunks is not None:
+            chunks.close()
+        _finish_run(run, info, started)
+        events.put((run.model_key, None))
+
+
+def _finish_run(run: ModelRun, info: Dict[str, Any], started: float) -> None:
+    run.latency_seconds = time.monotonic() - started
+    run.served_model = info.get("served_model")
+    usage = info.get("usage") or {}
+    run.input_tokens = usage.get("input_tokens")
+    run.output_tokens = usage.get("output_tokens", estimate_tokens(run.text) if run.text else 0)
+
+
+def run_chat_request(
+    selected_model_key: str,
+    prompt: str,
+    message_history: List[Dict[str, Any]],
+    image_data: Optional[str] = None,
+    temperature: float = 0.7,
+    system_prompt: Optional[str] = None,
+    user_id: Optional[str] = None,
+    cache: Optional[bool] = None,
+    response_info: Optional[Dict[str, Any]] = None,
+) -> ModelRun:
+    """
+    Run one request to completion through the full router (cache, fallback, quotas,
+    metering) for non-interactive callers such as batch jobs. Failures are returned in
+    ``run.error`` rather than as response text. Arguments are as for generate_chat_response.
+    """
+    run = ModelRun(selected_model_key)
+    info = response_info if response_info is not None else {}
+    info["requested_model"] = selected_model_key
+    started = time.monotonic()
+    texts = []
+    try:
+        if selected_model_key not in SUPPORTED_MODELS:
+            raise ProviderError(f"Model '{selected_model_key}' not found in supported models.")
+        denied = check_quota(user_id, selected_model_key)
+        if denied:
+            raise ProviderError(denied)
+        call = {
+            "prompt": prompt,
+            "message_history": message_history,
+            "image_data": image_data,
+            "audio_data": None,
+            "temperature": temperature,
+            "system_prompt": system_prompt,
+            "user_id": user_id,
+        }
+        for chunk in _counted(selected_model_key, _cached_chunks(selected_model_key, call, info, cache), info):
+            if chunk.text:
+                if run.ttft_seconds is None:
+                    run.ttft_seconds = time.monotonic() - started
+                texts.append(chunk.text)
+    except Exception as e:
+        run.error = str(e)
+    run.text = "".join(texts)
+    _finish_run(run, info, started)
+    return run
+
 
 # --- Individual API Functions --- #
+# Kept for callers that address a provider directly; they go through the same adapters.
+
+def _provider_response(api_type: str, label: str, request: ChatRequest, stream: bool = False):
+    """Call one provider directly, returning (or yielding) error text instead of raising."""
+    if stream:
+        def stream_generator():
+            try:
+                for chunk in _provider_chunks(api_type, request):
+                    if chunk.text:
+                        yield chunk.text
+            except Exception as e:
+                yield f"Error with {label} API ({request.model_name}): {str(e)}"
+        return stream_generator()
+    try:
+        return "".join(chunk.text for chunk in _provider_chunks(api_type, request))
+    except Exception as e:
+        return f"Error with {label} API ({request.model_name}): {str(e)}"
+
 
-# Gemini API (Modified to handle streaming)
 def get_gemini_response(
     prompt: str,
     message_history: List[Dict[str, str]],
@@ -142,187 +783,30 @@ def get_gemini_response(
     audio_data: Optional[str] = None,
     temperature: float = 0.7,
     model_name: str = "gemini-1.5-pro",
-    stream: bool = False # Add stream parameter
-) -> Generator[str, None, None] | str:
+    stream: bool = False
+) -> Union[Generator[str, None, None], str]:
     """
     Get a response from the Gemini AI model (optionally streaming).
     Handles text, image, audio.
     """
-    try:
-        import google.generativeai as genai
-
-        api_key = os.environ.get("GEMINI_API_KEY")
-        if not api_key:
-            raise ValueError("Gemini API key not found. Set GEMINI_API_KEY environment variable.")
-
-        genai.configure(api_key=api_key)
-
-        # Format history
-        formatted_history = []
-        for message in message_history:
-             role = "user" if message["role"] == "user" else "model"
-             # Basic text history for now
-             if isinstance(message["content"], str):
-                 formatted_history.append({"role": role, "parts": [message["content"]]})
-             # TODO: Add multimodal history formatting if needed
-
-        model = genai.GenerativeModel(
-            model_name,
-            generation_config=genai.types.GenerationConfig(temperature=temperature)
-        )
-
-        # Prepare content parts for the current prompt
-        content_parts = []
-        if image_data:
-            try:
-                image_bytes = base64.b64decode(image_data)
-                img = Image.open(io.BytesIO(image_bytes))
-                content_parts.append(img)
-            except Exception as e:
-                raise ValueError(f"Error processing image data: {str(e)}")
-        if audio_data:
-             try:
-                 audio_bytes = base64.b64decode(audio_data)
-                 # Adjust mime_type based on actual audio format
-                 content_parts.append({"mime_type": "audio/wav", "data": audio_bytes})
-             except Exception as e:
-                 raise ValueError(f"Error processing audio data: {str(e)}")
-
-        content_parts.append(prompt)
-
-        # --- Streaming Logic --- 
-        if stream:
-            # Use generate_content with stream=True
-            # Note: History handling with multimodal + streaming can be complex.
-            # For simplicity, let's pass history for text-only, but not with images/audio yet.
-            if image_data or audio_data:
-                 # Multimodal streaming often doesn't use chat history directly
-                 response_stream = model.generate_content(content_parts, stream=True)
-            else:
-                 # Text-only streaming can use chat history
-                 chat = model.start_chat(history=formatted_history)
-                 response_stream = chat.send_message(prompt, stream=True)
-
-            # Define a generator function to yield text chunks
-            def stream_generator():
-                try:
-                    for chunk in response_stream:
-                        if chunk.text:
-                            yield chunk.text
-                except Exception as e:
-                    yield f"Error during Gemini stream: {str(e)}"
-            return stream_generator()
-
-        # --- Non-Streaming Logic --- 
-        else:
-            if image_data or audio_data:
-                 # Single turn generation for multimodal
-                 response = model.generate_content(content_parts)
-            else:
-                 # Use chat session for text-only
-                 chat = model.start_chat(history=formatted_history)
-                 response = chat.send_message(prompt)
-            return response.text
-
-    except Exception as e:
-        error_message = f"Error with Gemini API ({model_name}): {str(e)}"
-        # If streaming was requested, yield the error; otherwise, return it.
-        if stream:
-            def error_stream(): yield error_message
-            return error_stream()
-        else:
-            return error_message
+    request = ChatRequest(model_name=model_name, prompt=prompt, history=message_history,
+                          image_data=image_data, audio_data=audio_data, temperature=temperature)
+    return _provider_response("gemini", "Gemini", request, stream)
 
 
-# OpenAI API (Streaming NOT implemented yet)
 def get_openai_response(prompt: str, message_history: List[Dict[str, str]], model_name="gpt-4o") -> str:
     """ Get a response from the OpenAI GPT model. """
-    try:
-        from openai import OpenAI
-        api_key = os.environ.get("OPENAI_API_KEY")
-        if not api_key:
-            return "Error: OpenAI API key not found. Set OPENAI_API_KEY environment variable."
-        client = OpenAI(api_key=api_key)
-        formatted_messages = [{"role": m["role"], "content": m["content"]} for m in message_history]
-        formatted_messages.append({"role": "user", "content": prompt})
-
-        response = client.chat.completions.create(
-            model=model_name,
-            messages=formatted_messages,
-            max_tokens=1500
-        )
-        return response.choices[0].message.content
-    except Exception as e:
-        return f"Error with OpenAI API ({model_name}): {str(e)}"
+    request = ChatRequest(model_name=model_name, prompt=prompt, history=message_history)
+    return _provider_response("openai", "OpenAI", request)
 
 
-# Anthropic API (Streaming NOT implemented yet)
 def get_anthropic_response(prompt: str, message_history: List[Dict[str, str]], model_name="claude-3-5-sonnet-20241022") -> str:
     """ Get a response from the Anthropic Claude model. """
-    try:
-        from anthropic import Anthropic
-        api_key = os.environ.get("ANTHROPIC_API_KEY")
-        if not api_key:
-            return "Error: Anthropic API key not found. Set ANTHROPIC_API_KEY environment variable."
-        client = Anthropic(api_key=api_key)
-        formatted_messages = []
-        for message in message_history:
-             role = "user" if message["role"] == "user" else "assistant"
-             content = message.get("content", "")
-             if isinstance(content, str):
-                 formatted_messages.append({"role": role, "content": content})
-
-        formatted_messages.append({"role": "user", "content": prompt})
-
-        response = client.messages.create(
-            model=model_name,
-            messages=formatted_messages,
-            max_tokens=1500
-        )
-        return response.content[0].text
-    except Exception as e:
-        return f"Error with Anthropic API ({model_name}): {str(e)}"
+    request = ChatRequest(model_name=model_name, prompt=prompt, history=message_history)
+    return _provider_response("anthropic", "Anthropic", request)
 
 
-# Perplexity API (Streaming NOT implemented yet)
 def get_perplexity_response(prompt: str, message_history: List[Dict[str, str]], temperature=0.7, model_name="pplx-70b-online") -> str:
     """ Get a response from the Perplexity API. """
-    try:
-        api_key = os.environ.get("PERPLEXITY_API_KEY")
-        if not api_key:
-            return "Error: Perplexity API key not found. Set PERPLEXITY_API_KEY environment variable."
-
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
-
-        formatted_messages = [{"role": "system", "content": "You are a helpful AI assistant."}]
-        for message in message_history:
-            role = "user" if message["role"] == "user" else "assistant"
-            content = message.get("content", "")
-            if isinstance(content, str):
-                formatted_messages.append({"role": role, "content": content})
-
-        formatted_messages.append({"role": "user", "content": prompt})
-
-        data = {
-            "model": model_name,
-            "messages": formatted_messages,
-            "temperature": temperature,
-        }
-
-        response = requests.post(
-            "https://api.perplexity.ai/chat/completions",
-            headers=headers,
-            json=data
-        )
-        response.raise_for_status()
-        return response.json()["choices"][0]["message"]["content"]
-
-    except requests.exceptions.RequestException as e:
-         error_details = e.response.text if e.response else "No response details"
-         return f"Error with Perplexity API request ({model_name}): {str(e)} - {error_details}"
-    except Exception as e:
-        return f"Error with Perplexity API ({model_name}): {str(e)}"
-
+    request = ChatRequest(model_name=model_name, prompt=prompt, history=message_history, temperature=temperature)
+    return _provider_response("perplexity", "Perplexity", request)
@@ -0,0 +1,211 @@
+"""
+Provider registry for the chat model router.
+
+Every provider is registered with a ProviderSpec that names its adapter class by
+import path, declares its capabilities and lists its models. Nothing is imported
+until a model from that provider is actually used, so the SDKs for providers that
+are not configured are never loaded.
+
+For offline runs, PROVIDER_OVERRIDE=mock serves every provider from the mock adapter,
+and PROVIDER_RECORD_DIR / PROVIDER_REPLAY_DIR record real streams to fixtures and
+replay them (see recording.py).
+"""
+import importlib
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from .base import (
+    ChatChunk,
+    ChatRequest,
+    ChatResponse,
+    ProviderAdapter,
+    ProviderCapabilities,
+    ProviderError,
+    error_from_exception,
+    message_text,
+)
+
+
+@dataclass
+class ProviderSpec:
+    """Registration record for a provider."""
+    name: str
+    adapter_path: str  # "package.module:ClassName"
+    capabilities: ProviderCapabilities
+    models: Dict[str, Dict[str, Any]] = field(default_factory=dict)  # display name -> model info
+    env_keys: Tuple[str, ...] = ()  # configured if any of these env vars is set
+    config_files: Tuple[str, ...] = ()  # ...or any of these files exists
+
+
+_SPECS: Dict[str, ProviderSpec] = {}
+_ADAPTERS: Dict[str, ProviderAdapter] = {}
+_lock = threading.Lock()
+
+
+def register_provider(spec: ProviderSpec) -> None:
+    """Register (or replace) a provider. Replacing drops any adapter already loaded for it."""
+    with _lock:
+        _SPECS[spec.name] = spec
+        _ADAPTERS.pop(spec.name, None)
+
+
+def get_provider_spec(name: str) -> ProviderSpec:
+    """Return the spec for a provider, raising ProviderError if it is unknown."""
+    spec = _SPECS.get(name)
+    if spec is None:
+        raise ProviderError(f"API type '{name}' is not recognized.", provider=name)
+    return spec
+
+
+def get_provider(name: str) -> ProviderAdapter:
+    """Return the adapter for a provider, importing it on first use."""
+    adapter = _ADAPTERS.get(name)
+    if adapter is not None:
+        return adapter
+
+    spec = get_provider_spec(name)
+    with _lock:
+        adapter = _ADAPTERS.get(name)
+        if adapter is None:
+            adapter = _build_adapter(spec)
+            _ADAPTERS[name] = adapter
+    return adapter
+
+
+def _build_adapter(spec: ProviderSpec) -> ProviderAdapter:
+    replay_dir = os.environ.get("PROVIDER_REPLAY_DIR")
+    if replay_dir:
+        from .recording import ReplayAdapter
+        return ReplayAdapter(spec.name, spec.capabilities, replay_dir)
+
+    # The adapter keeps the overridden provider's name and capabilities
+    override = os.environ.get("PROVIDER_OVERRIDE")
+    adapter_path = _SPECS[override].adapter_path if override in _SPECS else spec.adapter_path
+    module_path, class_name = adapter_path.split(":")
+    adapter_class = getattr(importlib.import_module(module_path), class_name)
+    adapter = adapter_class(spec.name, spec.capabilities)
+
+    record_dir = os.environ.get("PROVIDER_RECORD_DIR")
+    if record_dir:
+        from .recording import RecordingAdapter
+        adapter = RecordingAdapter(adapter, record_dir)
+    return adapter
+
+
+def get_capabilities(name: str) -> ProviderCapabilities:
+    """Return a provider's declared capabilities without importing it."""
+    return get_provider_spec(name).capabilities
+
+
+def is_configured(name: str) -> bool:
+    """Whether credentials for a provider are present in the environment (or it is served offline)."""
+    spec = _SPECS.get(name)
+    if spec is None:
+        return False
+    if os.environ.get("PROVIDER_OVERRIDE") in _SPECS or os.environ.get("PROVIDER_REPLAY_DIR"):
+        return True
+    if any(os.environ.get(key) for key in spec.env_keys):
+        return True
+    return any(os.path.exists(path) for path in spec.config_files)
+
+
+def list_providers(configured_only: bool = False) -> List[str]:
+    """Names of registered providers, optionally only those that are configured."""
+    return [name for name in _SPECS if not configured_only or is_configured(name)]
+
+
+def model_catalog(configured_only: bool = False) -> Dict[str, Dict[str, Any]]:
+    """
+    Build the model dropdown catalog from the registered providers.
+
+    Returns:
+        Mapping of display name to ``{"api": ..., "model_name": ..., "max_context": ...}``
+    """
+    catalog = {}
+    for name in list_providers(configured_only):
+        spec = _SPECS[name]
+        for display_name, info in spec.models.items():
+            entry = {"api": name, "max_context": spec.capabilities.max_context_tokens}
+            entry.update(info)
+            catalog[display_name] = entry
+    return catalog
+
+
+# --- Built-in Providers --- #
+
+register_provider(ProviderSpec(
+    name="gemini",
+    adapter_path="utils.providers.gemini_adapter:GeminiAdapter",
+    capabilities=ProviderCapabilities(streaming=True, multimodal=True, system_prompt=True, max_context_tokens=1_000_000),
+    models={
+        "Gemini 1.5 Pro (Google)": {"model_name": "gemini-1.5-pro", "max_context": 2_000_000},
+        "Gemini 1.5 Flash (Google)": {"model_name": "gemini-1.5-flash"},
+        "Gemini 2.0 Flash (Google)": {"model_name": "gemini-2.0-flash"},
+    },
+    env_keys=("GEMINI_API_KEY",),
+))
+
+register_provider(ProviderSpec(
+    name="anthropic",
+    adapter_path="utils.providers.anthropic_adapter:AnthropicAdapter",
+    capabilities=ProviderCapabilities(streaming=True, multimodal=False, system_prompt=True, max_context_tokens=200_000),
+    models={
+        "Claude 3.5 Sonnet (Anthropic)": {"model_name": "claude-3-5-sonnet-20241022"},
+    },
+    env_keys=("ANTHROPIC_API_KEY",),
+))
+
+register_provider(ProviderSpec(
+    name="openai",
+    adapter_path="utils.providers.openai_adapter:OpenAIAdapter",
+    capabilities=ProviderCapabilities(streaming=True, multimodal=False, system_prompt=True, max_context_tokens=128_000),
+    models={
+        "GPT-4o (OpenAI)": {"model_name": "gpt-4o"},
+        "GPT-4 Turbo (OpenAI)": {"model_name": "gpt-4-turbo"},
+        "GPT-3.5 Turbo (OpenAI)": {"model_name": "gpt-3.5-turbo", "max_context": 16_385},
+    },
+    env_keys=("OPENAI_API_KEY",),
+))
+
+register_provider(ProviderSpec(
+    name="perplexity",
+    adapter_path="utils.providers.perplexity_adapter:PerplexityAdapter",
+    capabilities=ProviderCapabilities(streaming=True, multimodal=False, system_prompt=True, max_context_tokens=4096),
+    models={
+        "Perplexity Online 70B (Perplexity)": {"model_name": "pplx-70b-online"},
+        "Perplexity Chat 70B (Perplexity)": {"model_name": "pplx-70b-chat"},
+    },
+    env_keys=("PERPLEXITY_API_KEY",),
+))
+
+register_provider(ProviderSpec(
+    name="vertex",
+    adapter_path="utils.providers.vertex_adapter:VertexAdapter",
+    capabilities=ProviderCapabilities(streaming=True, multimodal=True, system_prompt=True, max_context_tokens=1_000_000),
+    models={
+        "Gemini 2.5 Pro Preview (Vertex AI)": {"model_name": "gemini-2.5-pro-preview-03-25"},
+        "Gemini 2.0 Flash (Vertex AI)": {"model_name": "gemini-2.0-flash-001"},
+    },
+    env_keys=("GOOGLE_CLOUD_PROJECT",),
+    config_files=(os.environ.get("VERTEX_SERVICE_ACCOUNT", "service-account-key.json"),),
+))
+
+# Offline mock models are only listed when MOCK_PROVIDER_ENABLED is set, but the adapter is
+# always registered so PROVIDER_OVERRIDE=mock can stand in for every provider.
+_MOCK_MODELS = {
+    "Mock Fast (Offline)": {"model_name": "mock-fast"},
+    "Mock Slow (Offline)": {"model_name": "mock-slow"},
+    "Mock Long Tail (Offline)": {"model_name": "mock-tail"},
+    "Mock Flaky (Offline)": {"model_name": "mock-flaky"},
+    "Mock Instant (Offline)": {"model_name": "mock-instant"},
+}
+
+register_provider(ProviderSpec(
+    name="mock",
+    adapter_path="utils.providers.mock_adapter:MockAdapter",
+    capabilities=ProviderCapabilities(streaming=True, multimodal=True, system_prompt=True, max_context_tokens=128_000),
+    models=_MOCK_MODELS if os.environ.get("MOCK_PROVIDER_ENABLED") else {},
+    env_keys=("MOCK_PROVIDER_ENABLED",),
+))
@@ -0,0 +1,58 @@
+"""
+Anthropic adapter.
+"""
+import os
+from typing import Iterator
+
+from .base import ChatChunk, ChatRequest, ProviderAdapter, error_from_exception, message_text
+
+DEFAULT_MAX_TOKENS = 1500
+
+
+class AnthropicAdapter(ProviderAdapter):
+    """Streams messages from the Anthropic API."""
+
+    _client = None
+
+    def _get_client(self):
+        if AnthropicAdapter._client is None:
+            from anthropic import Anthropic
+
+            api_key = os.environ.get("ANTHROPIC_API_KEY")
+            if not api_key:
+                raise ValueError("Anthropic API key not found. Set ANTHROPIC_API_KEY environment variable.")
+            AnthropicAdapter._client = Anthropic(api_key=api_key)
+        return AnthropicAdapter._client
+
+    def stream(self, request: ChatRequest) -> Iterator[ChatChunk]:
+        try:
+            client = self._get_client()
+
+            messages = []
+            for message in request.history:
+                role = "user" if message["role"] == "user" else "assistant"
+                text = message_text(message)
+                if text:
+                    messages.append({"role": role, "content": text})
+            messages.append({"role": "user", "content": request.prompt})
+
+            kwargs = {
+                "model": request.model_name,
+                "messages": messages,
+                "temperature": request.temperature,
+                "max_tokens": request.max_tokens or DEFAULT_MAX_TOKENS,
+            }
+            if request.system_prompt:
+                kwargs["system"] = request.system_prompt
+
+            with client.messages.stream(**kwargs) as response_stream:
+                for text in response_stream.text_stream:
+                    if text:
+                        yield ChatChunk(text=text)
+                final = response_stream.get_final_message()
+            yield ChatChunk(
+                usage={"input_tokens": final.usage.input_tokens, "output_tokens": final.usage.output_tokens},
+                finish_reason=final.stop_reason,
+            )
+        except Exception as e:
+            raise error_from_exception(e, self.name) from e
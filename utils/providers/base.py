@@ -0,0 +1,173 @@
+"""
+Common request/response shapes and the base class for provider adapters.
+"""
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional
+
+
+@dataclass
+class ProviderCapabilities:
+    """What a provider can do, declared up front so the router never has to import an SDK to find out."""
+    streaming: bool = True
+    multimodal: bool = False
+    system_prompt: bool = True
+    max_context_tokens: int = 8192
+
+
+@dataclass
+class ChatRequest:
+    """A provider-agnostic chat request."""
+    model_name: str
+    prompt: str
+    history: List[Dict[str, Any]] = field(default_factory=list)
+    image_data: Optional[str] = None  # base64
+    audio_data: Optional[str] = None  # base64
+    screen_data: Optional[str] = None  # base64
+    temperature: float = 0.7
+    system_prompt: Optional[str] = None
+    max_tokens: Optional[int] = None
+    user_id: Optional[str] = None  # app user, for rate limiting and accounting; adapters ignore it
+
+
+@dataclass
+class ChatChunk:
+    """A piece of a streamed response. The final chunk of a stream may carry usage and no text."""
+    text: str = ""
+    usage: Optional[Dict[str, int]] = None
+    finish_reason: Optional[str] = None
+
+
+@dataclass
+class ChatResponse:
+    """A complete (non-streamed) response."""
+    text: str
+    model: str
+    provider: str
+    usage: Optional[Dict[str, int]] = None
+    finish_reason: Optional[str] = None
+
+
+class ProviderError(Exception):
+    """
+    Raised by adapters for any upstream failure.
+
+    Carries the HTTP-ish status code and Retry-After hint (when the SDK exposes them)
+    so callers can decide whether a retry makes sense.
+    """
+
+    def __init__(
+        self,
+        message: str,
+        provider: Optional[str] = None,
+        status_code: Optional[int] = None,
+        retry_after: Optional[float] = None,
+    ):
+        super().__init__(message)
+        self.provider = provider
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def _parse_retry_after(value: Any) -> Optional[float]:
+    """Parse a Retry-After header value given in seconds."""
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def error_from_exception(exc: Exception, provider: str) -> ProviderError:
+    """
+    Convert an SDK exception into a ProviderError, keeping status code and Retry-After if present.
+
+    The OpenAI and Anthropic SDKs expose ``status_code`` and ``response``; google-api-core
+    exceptions expose an integer ``code``; requests exposes ``response.status_code``.
+    """
+    if isinstance(exc, ProviderError):
+        return exc
+
+    status_code = getattr(exc, "status_code", None)
+    if status_code is None and isinstance(getattr(exc, "code", None), int):
+        status_code = exc.code
+
+    response = getattr(exc, "response", None)
+    retry_after = None
+    if response is not None:
+        if status_code is None:
+            status_code = getattr(response, "status_code", None)
+        headers = getattr(response, "headers", None) or {}
+        try:
+            retry_after = _parse_retry_after(headers.get("retry-after") or headers.get("Retry-After"))
+        except AttributeError:
+            retry_after = None
+
+    return ProviderError(str(exc), provider=provider, status_code=status_code, retry_after=retry_after)
+
+
+def message_text(message: Dict[str, Any]) -> str:
+    """Return the text of a history message whose content may be a string or a multimodal list."""
+    content = message.get("content", "")
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "\n".join(part for part in content if isinstance(part, str))
+    return str(content)
+
+
+def sniff_mime(data: bytes, default: str) -> str:
+    """Guess the MIME type of image/audio bytes from their magic number."""
+    if data.startswith(b"\x89PNG"):
+        return "image/png"
+    if data.startswith(b"\xff\xd8"):
+        return "image/jpeg"
+    if data.startswith(b"GIF8"):
+        return "image/gif"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[:4] == b"RIFF" and data[8:12] == b"WAVE":
+        return "audio/wav"
+    if data.startswith(b"ID3") or data[:2] in (b"\xff\xfb", b"\xff\xf3", b"\xff\xf2"):
+        return "audio/mp3"
+    if data.startswith(b"OggS"):
+        return "audio/ogg"
+    return default
+
+
+class ProviderAdapter:
+    """
+    Base class for provider adapters.
+
+    Subclasses implement ``stream`` (preferred) or ``generate``; each default is
+    written in terms of the other, so implementing one is enough.
+    """
+
+    def __init__(self, name: str, capabilities: ProviderCapabilities):
+        self.name = name
+        self.capabilities = capabilities
+
+    def stream(self, request: ChatRequest) -> Iterator[ChatChunk]:
+        """Yield response chunks. Providers without native streaming return one chunk."""
+        response = self.generate(request)
+        yield ChatChunk(text=response.text, usage=response.usage, finish_reason=response.finish_reason)
+
+    def generate(self, request: ChatRequest) -> ChatResponse:
+        """Return the complete response, collected from ``stream`` by default."""
+        parts = []
+        usage = None
+        finish_reason = None
+        for chunk in self.stream(request):
+            if chunk.text:
+                parts.append(chunk.text)
+            if chunk.usage:
+                usage = chunk.usage
+            if chunk.finish_reason:
+                finish_reason = chunk.finish_reason
+        return ChatResponse(
+            text="".join(parts),
+            model=request.model_name,
+            provider=self.name,
+            usage=usage,
+            finish_reason=finish_reason,
+        )
@@ -0,0 +1,106 @@
+"""
+Gemini adapter (google.generativeai).
+"""
+import base64
+import os
+from typing import Any, Dict, Iterator, List
+
+from .base import ChatChunk, ChatRequest, ProviderAdapter, error_from_exception, sniff_mime
+
+
+def _blob(data_b64: str, default_mime: str) -> Dict[str, Any]:
+    """Decode base64 media into an inline blob part."""
+    data = base64.b64decode(data_b64)
+    return {"mime_type": sniff_mime(data, default_mime), "data": data}
+
+
+def format_history(history: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Convert app message history (text or multimodal list content) to Gemini chat history.
+    """
+    formatted = []
+    for message in history:
+        role = "user" if message["role"] == "user" else "model"
+        content = message.get("content", "")
+        parts = []
+        if isinstance(content, str):
+            parts.append(content)
+        elif isinstance(content, list):
+            for part in content:
+                if isinstance(part, str):
+                    parts.append(part)
+                elif isinstance(part, dict) and part.get("data"):
+                    if part.get("type") == "image":
+                        parts.append(_blob(part["data"], "image/jpeg"))
+                    elif part.get("type") == "audio":
+                        parts.append(_blob(part["data"], "audio/wav"))
+        if message.get("image"):
+            parts.append(_blob(message["image"], "image/jpeg"))
+        if parts:
+            formatted.append({"role": role, "parts": parts})
+    return formatted
+
+
+def usage_from_metadata(metadata: Any) -> Dict[str, int]:
+    """Read token counts from a Gemini ``usage_metadata`` object."""
+    return {
+        "input_tokens": getattr(metadata, "prompt_token_count", 0) or 0,
+        "output_tokens": getattr(metadata, "candidates_token_count", 0) or 0,
+    }
+
+
+class GeminiAdapter(ProviderAdapter):
+    """Streams chat responses from the Gemini API, with image/audio/screenshot input."""
+
+    _configured_key = None
+
+    def _genai(self):
+        import google.generativeai as genai
+
+        api_key = os.environ.get("GEMINI_API_KEY")
+        if not api_key:
+            raise ValueError("Gemini API key not found. Set GEMINI_API_KEY environment variable.")
+        if api_key != GeminiAdapter._configured_key:
+            genai.configure(api_key=api_key)
+            GeminiAdapter._configured_key = api_key
+        return genai
+
+    def stream(self, request: ChatRequest) -> Iterator[ChatChunk]:
+        try:
+            genai = self._genai()
+
+            model_kwargs = {}
+            if request.system_prompt:
+                model_kwargs["system_instruction"] = request.system_prompt
+            model = genai.GenerativeModel(request.model_name, **model_kwargs)
+
+            content_parts = []
+            if request.image_data:
+                content_parts.append(_blob(request.image_data, "image/jpeg"))
+            if request.screen_data and request.screen_data != request.image_data:
+                content_parts.append(_blob(request.screen_data, "image/png"))
+            if request.audio_data:
+                content_parts.append(_blob(request.audio_data, "audio/wav"))
+            content_parts.append(request.prompt)
+
+            generation_config = {"temperature": request.temperature}
+            if request.max_tokens:
+                generation_config["max_output_tokens"] = request.max_tokens
+
+            chat = model.start_chat(history=format_history(request.history))
+            response_stream = chat.send_message(content_parts, generation_config=generation_config, stream=True)
+
+            usage = None
+            finish_reason = None
+            for chunk in response_stream:
+                # chunk.text raises when a chunk has no text parts (e.g. safety-only chunks)
+                text = "".join(part.text for part in chunk.parts if getattr(part, "text", None))
+                if getattr(chunk, "usage_metadata", None):
+                    usage = usage_from_metadata(chunk.usage_metadata)
+                if chunk.candidates and getattr(chunk.candidates[0], "finish_reason", None):
+                    finish_reason = str(chunk.candidates[0].finish_reason).split(".")[-1].lower()
+                if text:
+                    yield ChatChunk(text=text)
+            yield ChatChunk(usage=usage, finish_reason=finish_reason or "stop")
+        except Exception as e:
+            raise error_from_exception(e, self.name) from e
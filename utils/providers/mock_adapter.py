@@ -0,0 +1,123 @@
+"""
+Offline mock provider for load tests and benchmarks.
+
+Responses are generated locally with a configurable latency profile: time to first
+token drawn from a log-normal distribution (with an optional slow tail), a steady
+token rate, a chunk size, and injected errors before or during the stream. Nothing
+here touches the network.
+
+The model name picks a profile from PROFILES (unknown names use MOCK_PROFILE, so the
+mock can stand in for any provider via PROVIDER_OVERRIDE=mock). Any MOCK_* variable
+that is set overrides that field for every profile.
+"""
+import hashlib
+import math
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass, replace
+from typing import Iterator
+
+from .base import ChatChunk, ChatRequest, ProviderAdapter, ProviderCapabilities, ProviderError, message_text
+
+_WORDS = (
+    "the garden model answer stream token latency cache request provider response chat "
+    "gemini vertex prompt context history window region batch queue worker session media "
+    "signal metric trace cost budget retry circuit fallback hedge replay fixture benchmark"
+).split()
+
+
+@dataclass
+class MockProfile:
+    """Latency, throughput and failure characteristics of a mock model."""
+    ttft_seconds: float = 0.2  # median time to first token
+    ttft_sigma: float = 0.25  # log-normal spread of the first-token delay (0 = fixed)
+    tail_probability: float = 0.0  # chance of a slow outlier call...
+    tail_multiplier: float = 10.0  # ...whose first-token delay is this many times longer
+    tokens_per_second: float = 100.0  # 0 = no delay between chunks
+    chunk_tokens: int = 4
+    response_tokens: int = 120
+    error_rate: float = 0.0  # chance of failing before the first chunk
+    midstream_error_rate: float = 0.0  # chance of failing part-way through
+    error_status: int = 503
+
+
+PROFILES = {
+    "mock-instant": MockProfile(ttft_seconds=0.0, ttft_sigma=0.0, tokens_per_second=0.0),
+    "mock-fast": MockProfile(),
+    "mock-slow": MockProfile(ttft_seconds=1.5, ttft_sigma=0.4, tokens_per_second=30.0),
+    "mock-tail": MockProfile(tail_probability=0.05, tail_multiplier=15.0),
+    "mock-flaky": MockProfile(error_rate=0.2, midstream_error_rate=0.05),
+}
+
+_ENV_FIELDS = {
+    "MOCK_TTFT_SECONDS": ("ttft_seconds", float),
+    "MOCK_TTFT_SIGMA": ("ttft_sigma", float),
+    "MOCK_TAIL_PROBABILITY": ("tail_probability", float),
+    "MOCK_TAIL_MULTIPLIER": ("tail_multiplier", float),
+    "MOCK_TOKENS_PER_SECOND": ("tokens_per_second", float),
+    "MOCK_CHUNK_TOKENS": ("chunk_tokens", int),
+    "MOCK_RESPONSE_TOKENS": ("response_tokens", int),
+    "MOCK_ERROR_RATE": ("error_rate", float),
+    "MOCK_MIDSTREAM_ERROR_RATE": ("midstream_error_rate", float),
+    "MOCK_ERROR_STATUS": ("error_status", int),
+}
+
+
+def get_profile(model_name: str) -> MockProfile:
+    """The profile for a mock model name, with any MOCK_* environment overrides applied."""
+    profile = PROFILES.get(model_name) or PROFILES.get(os.environ.get("MOCK_PROFILE", "mock-fast"), MockProfile())
+    overrides = {field: cast(os.environ[env]) for env, (field, cast) in _ENV_FIELDS.items() if os.environ.get(env)}
+    return replace(profile, **overrides) if overrides else profile
+
+
+def _estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+class MockAdapter(ProviderAdapter):
+    """Streams locally generated text with simulated latency and failures."""
+
+    def __init__(self, name: str, capabilities: ProviderCapabilities):
+        super().__init__(name, capabilities)
+        seed = os.environ.get("MOCK_SEED")
+        # Seeded runs draw the same latencies and failures in the same order
+        self._rng = random.Random(int(seed)) if seed else random.Random()
+        self._rng_lock = threading.Lock()
+
+    def _draw(self, profile: MockProfile):
+        with self._rng_lock:
+            ttft = profile.ttft_seconds * math.exp(profile.ttft_sigma * self._rng.gauss(0, 1))
+            if self._rng.random() < profile.tail_probability:
+                ttft *= profile.tail_multiplier
+            fail_early = self._rng.random() < profile.error_rate
+            fail_at = None
+            if self._rng.random() < profile.midstream_error_rate:
+                fail_at = self._rng.randint(1, max(1, profile.response_tokens - 1))
+        return ttft, fail_early, fail_at
+
+    def stream(self, request: ChatRequest) -> Iterator[ChatChunk]:
+        profile = get_profile(request.model_name)
+        ttft, fail_early, fail_at = self._draw(profile)
+
+        # The text depends only on the prompt, so repeated prompts get identical answers
+        digest = hashlib.sha256(f"{request.model_name}\n{request.prompt}".encode("utf-8")).digest()
+        words = random.Random(digest).choices(_WORDS, k=profile.response_tokens)
+
+        time.sleep(ttft)
+        if fail_early:
+            raise ProviderError(f"Injected mock failure ({profile.error_status})", provider=self.name,
+                                status_code=profile.error_status)
+
+        chunk_tokens = max(1, profile.chunk_tokens)
+        for start in range(0, len(words), chunk_tokens):
+            if fail_at is not None and start >= fail_at:
+                raise ProviderError("Injected mock failure mid-stream", provider=self.name,
+                                    status_code=profile.error_status)
+            if start and profile.tokens_per_second > 0:
+                time.sleep(chunk_tokens / profile.tokens_per_second)
+            yield ChatChunk(text=("" if start == 0 else " ") + " ".join(words[start:start + chunk_tokens]))
+
+        input_tokens = _estimate_tokens(request.prompt) + sum(_estimate_tokens(message_text(m)) for m in request.history)
+        yield ChatChunk(usage={"input_tokens": input_tokens, "output_tokens": len(words)}, finish_reason="stop")
@@ -0,0 +1,63 @@
+"""
+OpenAI adapter.
+"""
+import os
+from typing import Iterator
+
+from .base import ChatChunk, ChatRequest, ProviderAdapter, error_from_exception, message_text
+
+DEFAULT_MAX_TOKENS = 1500
+
+
+class OpenAIAdapter(ProviderAdapter):
+    """Streams chat completions from the OpenAI API."""
+
+    _client = None
+
+    def _get_client(self):
+        if OpenAIAdapter._client is None:
+            from openai import OpenAI
+
+            api_key = os.environ.get("OPENAI_API_KEY")
+            if not api_key:
+                raise ValueError("OpenAI API key not found. Set OPENAI_API_KEY environment variable.")
+            OpenAIAdapter._client = OpenAI(api_key=api_key)
+        return OpenAIAdapter._client
+
+    def stream(self, request: ChatRequest) -> Iterator[ChatChunk]:
+        try:
+            client = self._get_client()
+
+            messages = []
+            if request.system_prompt:
+                messages.append({"role": "system", "content": request.system_prompt})
+            for message in request.history:
+                role = "user" if message["role"] == "user" else "assistant"
+                messages.append({"role": role, "content": message_text(message)})
+            messages.append({"role": "user", "content": request.prompt})
+
+            response_stream = client.chat.completions.create(
+                model=request.model_name,
+                messages=messages,
+                temperature=request.temperature,
+                max_tokens=request.max_tokens or DEFAULT_MAX_TOKENS,
+                stream=True,
+                stream_options={"include_usage": True},
+            )
+            # The finish reason comes on the last choice chunk, usage on a final chunk with no choices
+            usage = None
+            finish_reason = None
+            for chunk in response_stream:
+                if chunk.choices:
+                    finish_reason = chunk.choices[0].finish_reason or finish_reason
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        yield ChatChunk(text=delta)
+                if getattr(chunk, "usage", None):
+                    usage = {
+                        "input_tokens": chunk.usage.prompt_tokens,
+                        "output_tokens": chunk.usage.completion_tokens,
+                    }
+            yield ChatChunk(usage=usage, finish_reason=finish_reason or "stop")
+        except Exception as e:
+            raise error_from_exception(e, self.name) from e
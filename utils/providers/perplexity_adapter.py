@@ -0,0 +1,71 @@
+"""
+Perplexity adapter (OpenAI-compatible REST API, streamed as server-sent events).
+"""
+import json
+import os
+from typing import Iterator
+
+from .base import ChatChunk, ChatRequest, ProviderAdapter, ProviderError, error_from_exception, message_text
+
+API_URL = "https://api.perplexity.ai/chat/completions"
+DEFAULT_SYSTEM_PROMPT = "You are a helpful AI assistant."
+
+
+class PerplexityAdapter(ProviderAdapter):
+    """Streams chat completions from the Perplexity API."""
+
+    def stream(self, request: ChatRequest) -> Iterator[ChatChunk]:
+        import requests
+
+        api_key = os.environ.get("PERPLEXITY_API_KEY")
+        if not api_key:
+            raise ProviderError("Perplexity API key not found. Set PERPLEXITY_API_KEY environment variable.", provider=self.name)
+
+        messages = [{"role": "system", "content": request.system_prompt or DEFAULT_SYSTEM_PROMPT}]
+        for message in request.history:
+            role = "user" if message["role"] == "user" else "assistant"
+            messages.append({"role": role, "content": message_text(message)})
+        messages.append({"role": "user", "content": request.prompt})
+
+        data = {
+            "model": request.model_name,
+            "messages": messages,
+            "temperature": request.temperature,
+            "stream": True,
+        }
+        if request.max_tokens:
+            data["max_tokens"] = request.max_tokens
+
+        try:
+            response = requests.post(
+                API_URL,
+                headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
+                json=data,
+                stream=True,
+                timeout=(10, 120),
+            )
+            response.raise_for_status()
+
+            usage = None
+            finish_reason = None
+            with response:
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line or not line.startswith("data:"):
+                        continue
+                    payload = line[len("data:"):].strip()
+                    if payload == "[DONE]":
+                        break
+                    event = json.loads(payload)
+                    if event.get("usage"):
+                        usage = {
+                            "input_tokens": event["usage"].get("prompt_tokens", 0),
+                            "output_tokens": event["usage"].get("completion_tokens", 0),
+                        }
+                    for choice in event.get("choices", []):
+                        finish_reason = choice.get("finish_reason") or finish_reason
+                        delta = choice.get("delta", {}).get("content")
+                        if delta:
+                            yield ChatChunk(text=delta)
+            yield ChatChunk(usage=usage, finish_reason=finish_reason or "stop")
+        except Exception as e:
+            raise error_from_exception(e, self.name) from e
@@ -0,0 +1,116 @@
+"""
+Record real provider streams to fixture files and replay them offline.
+
+With PROVIDER_RECORD_DIR set, every adapter is wrapped in a RecordingAdapter that
+writes each stream (chunk text, usage and arrival time, or the error it ended with)
+to ``<dir>/<provider>/<fingerprint>.json``. With PROVIDER_REPLAY_DIR set, adapters
+are replaced by ReplayAdapter, which serves those fixtures with the recorded timing
+(scaled by PROVIDER_REPLAY_SPEED) without importing any SDK or opening a connection.
+
+The fingerprint covers everything that determines the answer: provider, model,
+prompt, history, system prompt, temperature, token limit and attachment hashes.
+"""
+import hashlib
+import json
+import os
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+from .base import ChatChunk, ChatRequest, ProviderAdapter, ProviderCapabilities, ProviderError, message_text
+
+
+def request_fingerprint(provider: str, request: ChatRequest) -> str:
+    """Stable hash of a request, used as its fixture file name."""
+    def digest(data: Optional[str]) -> Optional[str]:
+        return hashlib.sha256(data.encode("utf-8")).hexdigest() if data else None
+
+    payload = {
+        "provider": provider,
+        "model_name": request.model_name,
+        "prompt": request.prompt,
+        "history": [[m.get("role"), message_text(m)] for m in request.history],
+        "system_prompt": request.system_prompt,
+        "temperature": request.temperature,
+        "max_tokens": request.max_tokens,
+        "attachments": [digest(request.image_data), digest(request.audio_data), digest(request.screen_data)],
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def fixture_path(directory: str, provider: str, request: ChatRequest) -> str:
+    return os.path.join(directory, provider, f"{request_fingerprint(provider, request)}.json")
+
+
+class RecordingAdapter(ProviderAdapter):
+    """Passes calls through to a real adapter and saves each completed or failed stream."""
+
+    def __init__(self, inner: ProviderAdapter, directory: str):
+        super().__init__(inner.name, inner.capabilities)
+        self.inner = inner
+        self.directory = directory
+
+    def stream(self, request: ChatRequest) -> Iterator[ChatChunk]:
+        started = time.monotonic()
+        events: List[Dict[str, Any]] = []
+        try:
+            for chunk in self.inner.stream(request):
+                events.append({
+                    "t": round(time.monotonic() - started, 4),
+                    "text": chunk.text,
+                    "usage": chunk.usage,
+                    "finish_reason": chunk.finish_reason,
+                })
+                yield chunk
+        except ProviderError as e:
+            events.append({"t": round(time.monotonic() - started, 4),
+                           "error": {"message": str(e), "status_code": e.status_code}})
+            self._save(request, events)
+            raise
+        self._save(request, events)
+
+    def _save(self, request: ChatRequest, events: List[Dict[str, Any]]) -> None:
+        path = fixture_path(self.directory, self.name, request)
+        fixture = {
+            "provider": self.name,
+            "model_name": request.model_name,
+            "prompt": request.prompt[:200],
+            "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "events": events,
+        }
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(fixture, f, indent=2)
+        except OSError as e:
+            print(f"Could not save provider fixture {path}: {e}")
+
+
+class ReplayAdapter(ProviderAdapter):
+    """Serves recorded fixtures in place of a provider, reproducing their timing."""
+
+    def __init__(self, name: str, capabilities: ProviderCapabilities, directory: str,
+                 speed: float = float(os.environ.get("PROVIDER_REPLAY_SPEED", 1.0))):
+        super().__init__(name, capabilities)
+        self.directory = directory
+        self.speed = speed  # 2.0 replays twice as fast; 0 replays without any delay
+
+    def stream(self, request: ChatRequest) -> Iterator[ChatChunk]:
+        path = fixture_path(self.directory, self.name, request)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                fixture = json.load(f)
+        except (OSError, ValueError):
+            raise ProviderError(f"No recorded fixture for this {self.name} request ({os.path.basename(path)}).",
+                                provider=self.name, status_code=404)
+
+        started = time.monotonic()
+        for event in fixture["events"]:
+            if self.speed > 0:
+                delay = event["t"] / self.speed - (time.monotonic() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            if "error" in event:
+                raise ProviderError(event["error"]["message"], provider=self.name,
+                                    status_code=event["error"].get("status_code"))
+            yield ChatChunk(text=event.get("text", ""), usage=event.get("usage"),
+                            finish_reason=event.get("finish_reason"))
@@ -0,0 +1,64 @@
+"""
+Vertex AI adapter (google-genai client in Vertex mode).
+
+Calls are spread over the regions in VERTEX_REGIONS by utils/vertex_regions.py and
+fail over to the next region on quota or availability errors before the first chunk.
+"""
+import itertools
+import time
+from typing import Iterator
+
+from .base import ChatChunk, ChatRequest, ProviderAdapter, error_from_exception
+
+DEFAULT_MAX_TOKENS = 1024
+
+
+class VertexAdapter(ProviderAdapter):
+    """Streams responses from Gemini models hosted on Vertex AI."""
+
+    def stream(self, request: ChatRequest) -> Iterator[ChatChunk]:
+        try:
+            from utils.vertex_ai import build_vertex_contents, stream_vertex_content, vertex_chunk_text, vertex_usage
+            from utils.vertex_regions import get_region_pool, should_fail_over
+
+            contents = build_vertex_contents(request.prompt, request.history, request.image_data, request.audio_data)
+            pool = get_region_pool()
+            regions = pool.candidates(request.model_name)
+
+            for attempt, region in enumerate(regions):
+                started = time.monotonic()
+                try:
+                    response_stream = iter(stream_vertex_content(
+                        contents,
+                        request.model_name,
+                        temperature=request.temperature,
+                        max_output_tokens=request.max_tokens or DEFAULT_MAX_TOKENS,
+                        system_prompt=request.system_prompt,
+                        location=region,
+                    ))
+                    first = next(response_stream, None)
+                except Exception as e:
+                    error = error_from_exception(e, self.name)
+                    failing_over = attempt < len(regions) - 1 and should_fail_over(error)
+                    pool.record_failure(request.model_name, region, error, failing_over)
+                    if failing_over:
+                        print(f"Vertex AI {region} failed ({error}); trying {regions[attempt + 1]}")
+                        continue
+                    raise error from e
+                pool.record_success(request.model_name, region, time.monotonic() - started)
+                break
+
+            # Usage metadata arrives on the last chunk (earlier chunks may carry partial counts)
+            usage = None
+            finish_reason = None
+            head = [first] if first is not None else []
+            for chunk in itertools.chain(head, response_stream):
+                usage = vertex_usage(getattr(chunk, "usage_metadata", None)) or usage
+                if chunk.candidates and getattr(chunk.candidates[0], "finish_reason", None):
+                    finish_reason = str(chunk.candidates[0].finish_reason).split(".")[-1].lower()
+                text = vertex_chunk_text(chunk)
+                if text:
+                    yield ChatChunk(text=text)
+            yield ChatChunk(usage=usage, finish_reason=finish_reason or "stop")
+        except Exception as e:
+            raise error_from_exception(e, self.name) from e
@@ -0,0 +1,263 @@
+"""
+Client-side rate limiting and concurrency control for provider calls.
+
+Every call needs a permit from the governor for its provider/model. A permit is
+granted when
+  - the provider/model token bucket has a token (requests per minute),
+  - the user's own token bucket has a token, and
+  - fewer than ``max_concurrent`` calls are in flight for that provider/model.
+
+Callers without a user id get a bucket per Streamlit session rather than one shared
+"anonymous" bucket. Calls the router makes on its own account (hedges, fallbacks,
+retries, audits) pass ``charge_user=False``: they still need a provider token and a
+concurrency slot, but do not spend the user's budget.
+
+Callers that cannot get a permit right away wait in a bounded queue. Waiters are
+served round-robin by user, so one busy user cannot starve everyone else. When
+the queue is full, or a waiter times out, RateLimitExceeded is raised instead of
+letting the burst reach the provider.
+"""
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+from utils.providers.base import ProviderError
+from utils.session_resources import current_session_id, on_session_end
+
+DEFAULT_RPM = float(os.environ.get("RATE_LIMIT_RPM", 60))
+USER_RPM = float(os.environ.get("RATE_LIMIT_USER_RPM", 20))
+MAX_CONCURRENT = int(os.environ.get("RATE_LIMIT_MAX_CONCURRENT", 8))
+MAX_QUEUE = int(os.environ.get("RATE_LIMIT_MAX_QUEUE", 50))
+MAX_WAIT_SECONDS = float(os.environ.get("RATE_LIMIT_MAX_WAIT", 30))
+
+ANONYMOUS_USER = "anonymous"
+
+
+class RateLimitExceeded(ProviderError):
+    """Raised when a call cannot get a permit within the allowed wait or queue length."""
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at ``rate`` tokens per second, holding at most ``capacity``."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self) -> float:
+        """Seconds until a token is available (0 if one is available now)."""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self.tokens >= 1:
+                return 0.0
+            return (1 - self.tokens) / self.rate if self.rate > 0 else float("inf")
+
+    def take(self) -> None:
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens -= 1
+
+
+def _rpm_for(provider: str) -> float:
+    """Requests per minute for a provider: RATE_LIMIT_RPM_<PROVIDER> overrides RATE_LIMIT_RPM."""
+    return float(os.environ.get(f"RATE_LIMIT_RPM_{provider.upper()}", DEFAULT_RPM))
+
+
+class _Waiter:
+    __slots__ = ("user", "seq", "charge")
+
+    def __init__(self, user: str, seq: int, charge: bool):
+        self.user = user
+        self.seq = seq
+        self.charge = charge
+
+
+class ProviderGovernor:
+    """Permits for one provider/model: a token bucket, a concurrency cap and a fair wait queue."""
+
+    def __init__(self, key: str, rpm: float, max_concurrent: int = MAX_CONCURRENT, max_queue: int = MAX_QUEUE):
+        self.key = key
+        self.bucket = TokenBucket(rate=rpm / 60.0, capacity=max(1.0, rpm / 6.0))  # allow a 10 second burst
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self.waiters: List[_Waiter] = []
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._serve_order = itertools.count()
+        self._last_served: Dict[str, int] = {}
+        # stats
+        self.granted = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.last_wait = 0.0
+
+    def _pick_next(self) -> Optional[_Waiter]:
+        """Fair choice: among waiters whose user has a token (or is not charged), the user served longest ago, then FIFO."""
+        eligible = [w for w in self.waiters if not w.charge or _user_bucket(w.user).wait_time() <= 0]
+        if not eligible:
+            return None
+        return min(eligible, key=lambda w: (self._last_served.get(w.user, -1), w.seq))
+
+    def acquire(self, user: str, timeout: float = MAX_WAIT_SECONDS, charge_user: bool = True) -> float:
+        """
+        Block until a permit is granted. Returns the time spent waiting.
+
+        With ``charge_user=False`` the call takes no token from the user's bucket (it
+        still takes one from the provider's, and waits its turn among the user's calls).
+
+        Raises:
+            RateLimitExceeded: If the queue is full or ``timeout`` passes first.
+        """
+        start = time.monotonic()
+        deadline = start + timeout
+        with self._cond:
+            if len(self.waiters) >= self.max_queue:
+                self.rejected += 1
+                raise RateLimitExceeded(
+                    f"Too many requests queued for {self.key}; please try again shortly.",
+                    provider=self.key, status_code=429,
+                )
+            waiter = _Waiter(user, next(self._seq), charge_user)
+            self.waiters.append(waiter)
+            try:
+                while True:
+                    now = time.monotonic()
+                    delay = None
+                    if self.in_flight < self.max_concurrent and self._pick_next() is waiter:
+                        delay = self.bucket.wait_time()
+                        if delay <= 0:
+                            self.bucket.take()
+                            if charge_user:
+                                _user_bucket(user).take()
+                            self.in_flight += 1
+                            self._last_served[user] = next(self._serve_order)
+                            break
+                    if now >= deadline:
+                        self.rejected += 1
+                        raise RateLimitExceeded(
+                            f"Timed out after {timeout:.0f}s waiting for capacity on {self.key}.",
+                            provider=self.key, status_code=429,
+                        )
+                    # Wake up when a token is due, a permit is released, or at the latest every 250ms
+                    self._cond.wait(min(delay or 0.25, deadline - now, 0.25))
+            finally:
+                self.waiters.remove(waiter)
+                self._cond.notify_all()
+
+        waited = time.monotonic() - start
+        with self._cond:
+            self.granted += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+            self.last_wait = waited
+        return waited
+
+    def release(self) -> None:
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def stats(self) -> Dict[str, float]:
+        with self._cond:
+            return {
+                "queue_length": len(self.waiters),
+                "in_flight": self.in_flight,
+                "granted": self.granted,
+                "rejected": self.rejected,
+                "avg_wait_seconds": self.total_wait / self.granted if self.granted else 0.0,
+                "max_wait_seconds": self.max_wait,
+                "last_wait_seconds": self.last_wait,
+            }
+
+
+# --- Registry --- #
+
+_governors: Dict[str, ProviderGovernor] = {}
+_user_buckets: Dict[str, TokenBucket] = {}
+_registry_lock = threading.Lock()
+
+
+def _user_bucket(user: str) -> TokenBucket:
+    bucket = _user_buckets.get(user)
+    if bucket is None:
+        with _registry_lock:
+            bucket = _user_buckets.setdefault(user, TokenBucket(rate=USER_RPM / 60.0, capacity=max(1.0, USER_RPM / 6.0)))
+    return bucket
+
+
+def set_user_rate(user: str, rpm: float) -> None:
+    """Give one user (e.g. a batch job's service identity) its own requests-per-minute budget."""
+    with _registry_lock:
+        _user_buckets[user] = TokenBucket(rate=rpm / 60.0, capacity=max(1.0, rpm / 6.0))
+
+
+def get_governor(provider: str, model_name: str) -> ProviderGovernor:
+    """Return the governor for a provider/model pair, creating it on first use."""
+    key = f"{provider}/{model_name}"
+    governor = _governors.get(key)
+    if governor is None:
+        with _registry_lock:
+            governor = _governors.setdefault(key, ProviderGovernor(key, _rpm_for(provider)))
+    return governor
+
+
+def rate_limit_user(user_id: Optional[str] = None) -> str:
+    """The bucket a call is charged to: the user, else the calling session, else the shared anonymous bucket."""
+    if user_id:
+        return str(user_id)
+    session_id = current_session_id()
+    return f"{ANONYMOUS_USER}:{session_id}" if session_id else ANONYMOUS_USER
+
+
+@contextmanager
+def permit(provider: str, model_name: str, user_id: Optional[str] = None, charge_user: bool = True) -> Iterator[float]:
+    """
+    Hold a call permit for the duration of the block. Yields the time spent waiting for it.
+
+    Args:
+        charge_user: False for calls the router makes on its own account (hedges,
+            fallbacks, retries), which should not spend the user's requests per minute.
+    """
+    governor = get_governor(provider, model_name)
+    waited = governor.acquire(rate_limit_user(user_id), charge_user=charge_user)
+    try:
+        yield waited
+    finally:
+        governor.release()
+
+
+def _forget_session(session_id: str) -> None:
+    """Drop a disconnected session's anonymous bucket."""
+    user = f"{ANONYMOUS_USER}:{session_id}"
+    with _registry_lock:
+        _user_buckets.pop(user, None)
+        governors = list(_governors.values())
+    for governor in governors:
+        with governor._cond:
+            governor._last_served.pop(user, None)
+
+
+def _anonymous_sessions() -> List[str]:
+    prefix = f"{ANONYMOUS_USER}:"
+    with _registry_lock:
+        return [user[len(prefix):] for user in _user_buckets if user.startswith(prefix)]
+
+
+on_session_end(_forget_session, _anonymous_sessions)
+
+
+def get_rate_limit_stats() -> Dict[str, Dict[str, float]]:
+    """Queue length, in-flight calls and wait times for every provider/model seen so far."""
+    return {key: governor.stats() for key, governor in list(_governors.items())}
@@ -0,0 +1,257 @@
+"""
+Retry with jittered exponential backoff and per-provider circuit breakers.
+
+Streaming calls are only retried before their first chunk is delivered, so a user
+never sees a partial answer followed by a second, different one.
+"""
+import os
+import random
+import threading
+import time
+from typing import Callable, Dict, Iterator, Optional, TypeVar
+
+from utils.providers.base import ProviderError, error_from_exception
+from utils.tracing import current_span
+
+T = TypeVar("T")
+
+# Status codes worth retrying: timeouts, rate limits and transient server errors
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+class RetryPolicy:
+    """How many times to retry and how long to wait between attempts."""
+
+    def __init__(
+        self,
+        max_attempts: int = int(os.environ.get("RETRY_MAX_ATTEMPTS", 3)),
+        base_delay: float = float(os.environ.get("RETRY_BASE_DELAY", 0.5)),
+        max_delay: float = float(os.environ.get("RETRY_MAX_DELAY", 8.0)),
+        max_retry_after: float = float(os.environ.get("RETRY_MAX_RETRY_AFTER", 30.0)),
+    ):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+
+
+DEFAULT_POLICY = RetryPolicy()
+
+
+class CircuitOpenError(ProviderError):
+    """Raised instead of calling a provider whose circuit is open."""
+
+
+def is_retryable(exc: Exception) -> bool:
+    """Whether a failure is transient (rate limit, overload, timeout, dropped connection)."""
+    if isinstance(exc, CircuitOpenError):
+        return False
+    error = error_from_exception(exc, provider="")
+    if error.status_code is not None:
+        return error.status_code in RETRYABLE_STATUS
+    cause = exc.__cause__ or exc
+    if isinstance(cause, (ConnectionError, TimeoutError)):
+        return True
+    # requests/httpx connection and timeout errors, without importing either library
+    return type(cause).__name__ in ("ConnectionError", "Timeout", "ReadTimeout", "ConnectTimeout",
+                                    "APIConnectionError", "APITimeoutError", "ServiceUnavailable")
+
+
+def backoff_delay(attempt: int, policy: RetryPolicy = DEFAULT_POLICY, retry_after: Optional[float] = None) -> float:
+    """
+    Delay before retry number ``attempt`` (1-based), using full jitter.
+
+    A Retry-After hint from the provider is honoured as a lower bound, capped at
+    ``policy.max_retry_after``.
+    """
+    ceiling = min(policy.max_delay, policy.base_delay * (2 ** (attempt - 1)))
+    delay = random.uniform(0, ceiling)
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, policy.max_retry_after))
+    return delay
+
+
+class CircuitBreaker:
+    """
+    Classic three-state breaker.
+
+    closed -> open after ``failure_threshold`` consecutive failures;
+    open -> half_open once ``reset_timeout`` has passed;
+    half_open lets one probe through: success closes the circuit, failure re-opens it.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = int(os.environ.get("CIRCUIT_FAILURE_THRESHOLD", 5)),
+        reset_timeout: float = float(os.environ.get("CIRCUIT_RESET_SECONDS", 30.0)),
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        """Whether a call may go through now. In half-open state only one probe is allowed."""
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == self.HALF_OPEN:
+                if self._probe_in_flight:
+                    return False
+                self._probe_in_flight = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.times_opened += 1
+                    _count("circuit_opened", self.name)
+                    print(f"Circuit for {self.name} opened after {self.failures} failures")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+    def release_probe(self) -> None:
+        """Free the half-open probe slot when a call ends without telling us anything about health."""
+        with self._lock:
+            self._probe_in_flight = False
+
+
+# --- Registry and stats --- #
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+_stats: Dict[str, Dict[str, int]] = {"retries": {}, "circuit_opened": {}, "rejected": {}, "gave_up": {}}
+_stats_lock = threading.Lock()
+
+
+def _count(stat: str, provider: str) -> None:
+    with _stats_lock:
+        _stats[stat][provider] = _stats[stat].get(provider, 0) + 1
+
+
+def get_breaker(provider: str) -> CircuitBreaker:
+    """Return the circuit breaker for a provider, creating it on first use."""
+    breaker = _breakers.get(provider)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.setdefault(provider, CircuitBreaker(provider))
+    return breaker
+
+
+def get_resilience_stats() -> Dict[str, Dict]:
+    """Retry/circuit counters per provider plus the current state of every breaker."""
+    with _stats_lock:
+        stats = {name: dict(values) for name, values in _stats.items()}
+    stats["circuits"] = {name: breaker.state for name, breaker in _breakers.items()}
+    return stats
+
+
+def _check_circuit(provider: str, breaker: CircuitBreaker) -> None:
+    if not breaker.allow_request():
+        _count("rejected", provider)
+        raise CircuitOpenError(
+            f"{provider} is temporarily unavailable after repeated failures; try again shortly.",
+            provider=provider,
+            status_code=503,
+        )
+
+
+def _record_failure(provider: str, breaker: CircuitBreaker, exc: Exception) -> None:
+    # Client errors (bad request, auth) say nothing about provider health
+    if is_retryable(exc):
+        breaker.record_failure()
+    else:
+        breaker.release_probe()
+
+
+def _wait_before_retry(provider: str, attempt: int, policy: RetryPolicy, exc: Exception,
+                       sleep: Callable[[float], None]) -> None:
+    error = error_from_exception(exc, provider)
+    delay = backoff_delay(attempt, policy, error.retry_after)
+    _count("retries", provider)
+    print(f"Retrying {provider} after error ({error.status_code or type(exc).__name__}), "
+          f"attempt {attempt + 1}/{policy.max_attempts} in {delay:.2f}s")
+    sleep(delay)
+
+
+def call_with_retry(provider: str, fn: Callable[[], T], policy: Optional[RetryPolicy] = None,
+                    sleep: Callable[[float], None] = time.sleep) -> T:
+    """Call ``fn`` through the provider's circuit breaker, retrying transient failures."""
+    policy = policy or DEFAULT_POLICY
+    breaker = get_breaker(provider)
+    for attempt in range(1, policy.max_attempts + 1):
+        _check_circuit(provider, breaker)
+        try:
+            result = fn()
+        except Exception as e:
+            _record_failure(provider, breaker, e)
+            if attempt < policy.max_attempts and is_retryable(e):
+                _wait_before_retry(provider, attempt, policy, e, sleep)
+                current_span().set_attribute("retries", attempt)
+                continue
+            if is_retryable(e):
+                _count("gave_up", provider)
+            raise
+        breaker.record_success()
+        return result
+    raise AssertionError("unreachable")
+
+
+def stream_with_retry(provider: str, open_stream: Callable[[], Iterator[T]], policy: Optional[RetryPolicy] = None,
+                      sleep: Callable[[float], None] = time.sleep) -> Iterator[T]:
+    """
+    Iterate a provider stream through its circuit breaker.
+
+    ``open_stream`` is called again on a transient failure, but only until the first
+    item has been yielded; after that, errors propagate to the caller unchanged.
+    """
+    policy = policy or DEFAULT_POLICY
+    breaker = get_breaker(provider)
+    for attempt in range(1, policy.max_attempts + 1):
+        _check_circuit(provider, breaker)
+        stream = open_stream()
+        try:
+            first = next(stream)
+        except StopIteration:
+            breaker.record_success()
+            return
+        except Exception as e:
+            _record_failure(provider, breaker, e)
+            if attempt < policy.max_attempts and is_retryable(e):
+                _wait_before_retry(provider, attempt, policy, e, sleep)
+                current_span().set_attribute("retries", attempt)
+                continue
+            if is_retryable(e):
+                _count("gave_up", provider)
+            raise
+        breaker.record_success()
+        break
+
+    yield first
+    try:
+        yield from stream
+    except Exception as e:
+        _record_failure(provider, breaker, e)
+        raise
@@ -0,0 +1,254 @@
+"""
+Exact-match response cache for deterministic chat requests.
+
+Responses are keyed by a canonical hash of the model, generation config, system
+prompt, full message history and attachment hashes. A small in-memory LRU sits in
+front of an on-disk tier under RESPONSE_CACHE_DIR; both expire entries after
+RESPONSE_CACHE_TTL seconds and the disk tier is trimmed oldest-first to
+RESPONSE_CACHE_MAX_MB.
+
+Only requests at temperature 0 are cached unless the caller (or
+RESPONSE_CACHE_ANY_TEMPERATURE) opts in, since sampling at higher temperatures is
+expected to vary between calls.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, Optional
+
+from utils.providers import ChatChunk
+
+RESPONSE_CACHE_ENABLED = os.environ.get("RESPONSE_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+RESPONSE_CACHE_DIR = os.environ.get("RESPONSE_CACHE_DIR", "data/response_cache")
+RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", 24 * 3600))
+RESPONSE_CACHE_MEMORY_ITEMS = int(os.environ.get("RESPONSE_CACHE_MEMORY_ITEMS", 256))
+RESPONSE_CACHE_MAX_MB = float(os.environ.get("RESPONSE_CACHE_MAX_MB", 100))
+RESPONSE_CACHE_ANY_TEMPERATURE = os.environ.get("RESPONSE_CACHE_ANY_TEMPERATURE", "false").lower() in ("1", "true", "yes")
+
+_KEY_VERSION = 1  # bump to invalidate every entry when the key or entry format changes
+
+
+def should_cache(temperature: float, opt_in: Optional[bool] = None) -> bool:
+    """
+    Whether a request may use the cache.
+
+    Args:
+        temperature: The request's sampling temperature.
+        opt_in: True to cache regardless of temperature, False to bypass the cache,
+            None to cache only deterministic (temperature 0) requests.
+    """
+    if not RESPONSE_CACHE_ENABLED or opt_in is False:
+        return False
+    return bool(opt_in) or RESPONSE_CACHE_ANY_TEMPERATURE or temperature <= 0
+
+
+def _digest(data: Any) -> str:
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+def _canonical(value: Any) -> Any:
+    """Reduce a value to JSON-serialisable data, replacing binary blobs with their hashes."""
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if isinstance(value, (bytes, bytearray)):
+        return {"sha256": _digest(bytes(value))}
+    if isinstance(value, dict):
+        return {str(k): _canonical(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(v) for v in value]
+    return repr(value)
+
+
+def cache_key(model_info: Dict[str, Any], call: Dict[str, Any]) -> str:
+    """
+    Canonical hash of everything that determines a model's answer.
+
+    ``call`` holds the arguments of generate_chat_response. The user id is left out
+    so identical requests from different users share an entry.
+    """
+    attachments = {
+        name: _digest(call[name]) if call.get(name) else None
+        for name in ("image_data", "audio_data", "screen_data")
+    }
+    payload = {
+        "version": _KEY_VERSION,
+        "api": model_info["api"],
+        "model_name": model_info["model_name"],
+        "temperature": call.get("temperature"),
+        "max_tokens": call.get("max_tokens"),
+        "system_prompt": call.get("system_prompt"),
+        "history": _canonical(call.get("message_history") or []),
+        "prompt": call.get("prompt"),
+        "attachments": attachments,
+    }
+    return _digest(json.dumps(payload, sort_keys=True, separators=(",", ":")))
+
+
+class ResponseCache:
+    """Two-tier (memory LRU + disk) cache of completed responses."""
+
+    def __init__(self, directory: str = RESPONSE_CACHE_DIR, ttl: float = RESPONSE_CACHE_TTL,
+                 memory_items: int = RESPONSE_CACHE_MEMORY_ITEMS, max_bytes: float = RESPONSE_CACHE_MAX_MB * 1024 * 1024):
+        self.directory = directory
+        self.ttl = ttl
+        self.memory_items = memory_items
+        self.max_bytes = max_bytes
+        self._memory: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._disk_bytes: Optional[int] = None  # computed on first write
+        self._lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "bypassed": 0, "stores": 0,
+                      "expired": 0, "evicted": 0}
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def _expired(self, entry: Dict[str, Any]) -> bool:
+        return time.time() - entry.get("created", 0) > self.ttl
+
+    def _remember(self, key: str, entry: Dict[str, Any]) -> None:
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the cached entry for ``key``, or None on a miss or expired entry."""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if not self._expired(entry):
+                    self._memory.move_to_end(key)
+                    self.stats["memory_hits"] += 1
+                    return entry
+                del self._memory[key]
+                self.stats["expired"] += 1
+
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            entry = None
+
+        with self._lock:
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            if self._expired(entry):
+                self.stats["expired"] += 1
+                self.stats["misses"] += 1
+                self._remove_file(path)
+                return None
+            self.stats["disk_hits"] += 1
+            self._remember(key, entry)
+            return entry
+
+    def put(self, key: str, entry: Dict[str, Any]) -> None:
+        """Store a completed response in both tiers."""
+        entry = dict(entry, created=time.time())
+        data = json.dumps(entry).encode("utf-8")
+        path = self._path(key)
+        with self._lock:
+            self._remember(key, entry)
+            self.stats["stores"] += 1
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                if self._disk_bytes is None:
+                    self._disk_bytes = sum(os.path.getsize(p) for p, _ in self._disk_files())
+                if os.path.exists(path):
+                    self._remove_file(path)
+                tmp_path = f"{path}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+                self._disk_bytes += len(data)
+                if self._disk_bytes > self.max_bytes:
+                    self._trim_disk()
+            except OSError as e:
+                print(f"Could not write response cache entry: {e}")
+
+    def _disk_files(self) -> List:
+        """(path, mtime) of every entry on disk."""
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith(".json"):
+                    path = os.path.join(root, name)
+                    try:
+                        files.append((path, os.path.getmtime(path)))
+                    except OSError:
+                        pass
+        return files
+
+    def _remove_file(self, path: str) -> int:
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return 0
+        if self._disk_bytes is not None:
+            self._disk_bytes -= size
+        return size
+
+    def _trim_disk(self) -> None:
+        """Delete the oldest entries until the disk tier is back under 90% of its limit."""
+        for path, _ in sorted(self._disk_files(), key=lambda item: item[1]):
+            if self._disk_bytes <= self.max_bytes * 0.9:
+                break
+            if self._remove_file(path):
+                self.stats["evicted"] += 1
+
+    def record_bypass(self) -> None:
+        """Count a request that skipped the cache (e.g. temperature > 0)."""
+        with self._lock:
+            self.stats["bypassed"] += 1
+
+    def clear(self) -> None:
+        """Drop every entry from both tiers."""
+        with self._lock:
+            self._memory.clear()
+            for path, _ in self._disk_files():
+                self._remove_file(path)
+            self._disk_bytes = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+            hits = stats["memory_hits"] + stats["disk_hits"]
+            lookups = hits + stats["misses"]
+            stats["hit_rate"] = hits / lookups if lookups else 0.0
+            stats["memory_items"] = len(self._memory)
+            stats["disk_bytes"] = self._disk_bytes
+            return stats
+
+
+def replay(entry: Dict[str, Any]) -> Iterator[ChatChunk]:
+    """Yield a cached response as the chunks it originally streamed in, so callers see a normal stream."""
+    chunks = entry.get("chunks") or [entry.get("text", "")]
+    for text in chunks:
+        yield ChatChunk(text=text)
+    yield ChatChunk(usage=entry.get("usage"), finish_reason=entry.get("finish_reason") or "stop")
+
+
+_cache: Optional[ResponseCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    """Return the process-wide response cache, creating it on first use."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResponseCache()
+    return _cache
+
+
+def get_response_cache_stats() -> Dict[str, Any]:
+    """Hit/miss counts and tier sizes of the response cache."""
+    return get_response_cache().get_stats()
@@ -0,0 +1,272 @@
+"""
+Semantic response cache for near-duplicate prompts.
+
+Stand-alone prompts (no prior history, no attachments) are embedded on the CPU and
+compared against previously answered prompts of the same user, model and system
+prompt. If the closest one is at least SEMANTIC_CACHE_THRESHOLD similar (cosine),
+its answer is served, with the matched prompt and score attached as provenance.
+
+Similarity alone cannot tell apart long prompts that differ in one key word ("the
+sum of a list" / "the product of a list" score above 0.9), so by default
+(SEMANTIC_CACHE_SAME_WORDS) a match must also use the same content words: only
+stop words, word order, case, punctuation and plural "s" may differ.
+
+The default embedder is a hashing vectorizer (word unigrams and bigrams plus
+character trigrams hashed into a sparse vector), which needs no model download
+and no dependencies. Set SEMANTIC_CACHE_MODEL to a sentence-transformers model
+name to use that instead when the package is installed.
+
+A sample of hits (SEMANTIC_CACHE_AUDIT_RATE) is checked by asking the model
+anyway in the background; an answer that is not similar to the cached one counts
+as a false hit.
+"""
+import math
+import os
+import random
+import re
+import threading
+import time
+import zlib
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+from utils.lazy import is_available, lazy_import
+
+SEMANTIC_CACHE_ENABLED = os.environ.get("SEMANTIC_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", 0.95))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.environ.get("SEMANTIC_CACHE_MAX_ENTRIES", 2000))
+SEMANTIC_CACHE_MAX_PER_SCOPE = int(os.environ.get("SEMANTIC_CACHE_MAX_PER_SCOPE", 200))
+SEMANTIC_CACHE_TTL = float(os.environ.get("SEMANTIC_CACHE_TTL", 24 * 3600))
+SEMANTIC_CACHE_AUDIT_RATE = float(os.environ.get("SEMANTIC_CACHE_AUDIT_RATE", 0.02))
+SEMANTIC_CACHE_AUDIT_THRESHOLD = float(os.environ.get("SEMANTIC_CACHE_AUDIT_THRESHOLD", 0.5))
+SEMANTIC_CACHE_MODEL = os.environ.get("SEMANTIC_CACHE_MODEL")
+SEMANTIC_CACHE_SAME_WORDS = os.environ.get("SEMANTIC_CACHE_SAME_WORDS", "true").lower() in ("1", "true", "yes")
+
+_DIMENSIONS = 2 ** 18
+_WORD_RE = re.compile(r"[a-z0-9']+")
+_STOP_WORDS = frozenset(
+    "a an the and or but of to in on at for with by from as is are was were be been being do does did "
+    "i me my you your we our it its this that these those what which who whom how can could would should "
+    "will please tell give show explain".split()
+)
+
+sentence_transformers = lazy_import("sentence_transformers")
+
+Vector = Dict[int, float]
+
+
+# --- Embedding --- #
+
+def _normalise(vector: Vector) -> Vector:
+    norm = math.sqrt(sum(v * v for v in vector.values()))
+    if not norm:
+        return vector
+    return {k: v / norm for k, v in vector.items()}
+
+
+def hashing_embed(text: str) -> Vector:
+    """Embed text as an L2-normalised sparse vector of hashed word and character n-grams."""
+    words = _WORD_RE.findall(text.lower())
+    features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    joined = f" {' '.join(words)} "
+    features += [joined[i:i + 3] for i in range(len(joined) - 2)]
+    vector: Vector = {}
+    for feature in features:
+        h = zlib.crc32(feature.encode("utf-8"))
+        index = h % _DIMENSIONS
+        # The top hash bit picks a sign so collisions tend to cancel out
+        vector[index] = vector.get(index, 0.0) + (1.0 if h & 0x80000000 else -1.0)
+    return _normalise(vector)
+
+
+_model = None
+_model_lock = threading.Lock()
+
+
+def _model_embed(text: str) -> Vector:
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                _model = sentence_transformers.SentenceTransformer(SEMANTIC_CACHE_MODEL, device="cpu")
+    dense = _model.encode(text, normalize_embeddings=True)
+    return {i: float(v) for i, v in enumerate(dense)}
+
+
+def get_embedder() -> Callable[[str], Vector]:
+    """The configured embedder: a local sentence-transformers model if set and installed, else hashing."""
+    if SEMANTIC_CACHE_MODEL and is_available("sentence_transformers"):
+        return _model_embed
+    return hashing_embed
+
+
+def similarity(a: Vector, b: Vector) -> float:
+    """Cosine similarity of two normalised vectors."""
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(v * b.get(k, 0.0) for k, v in a.items())
+
+
+def content_words(text: str) -> frozenset:
+    """The words of ``text`` that carry its meaning: no stop words, case or plural "s"."""
+    words = set()
+    for word in _WORD_RE.findall(text.lower()):
+        if word in _STOP_WORDS:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        words.add(word)
+    return frozenset(words)
+
+
+# --- Index --- #
+
+class SemanticCache:
+    """
+    In-memory vector index of answered prompts, scoped by user, model and system prompt.
+
+    Entries are kept per scope (oldest first, at most ``max_per_scope`` each), so a
+    lookup only compares against its own scope, and it scores a snapshot of them
+    outside the lock.
+    """
+
+    def __init__(self, threshold: float = SEMANTIC_CACHE_THRESHOLD, max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES,
+                 ttl: float = SEMANTIC_CACHE_TTL, embed: Optional[Callable[[str], Vector]] = None,
+                 max_per_scope: int = SEMANTIC_CACHE_MAX_PER_SCOPE):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.max_per_scope = max_per_scope
+        self.ttl = ttl
+        self.embed = embed or get_embedder()
+        self._scopes: Dict[str, Deque[Dict[str, Any]]] = {}
+        self._size = 0
+        self._lock = threading.Lock()
+        self.stats = {"lookups": 0, "hits": 0, "stores": 0, "audited": 0, "false_hits": 0}
+        self.false_hit_samples: Deque[Dict[str, Any]] = deque(maxlen=20)
+
+    def lookup(self, scope: str, prompt: str) -> Optional[Tuple[Dict[str, Any], float]]:
+        """Return the closest entry in ``scope`` and its similarity, if it clears the threshold."""
+        vector = self.embed(prompt)
+        with self._lock:
+            self.stats["lookups"] += 1
+            self._expire(scope, time.time())
+            entries = list(self._scopes.get(scope, ()))
+        words = content_words(prompt) if SEMANTIC_CACHE_SAME_WORDS else None
+        best, best_score = None, 0.0
+        for entry in entries:
+            if words is not None and entry["words"] != words:
+                continue
+            score = similarity(vector, entry["vector"])
+            if score > best_score:
+                best, best_score = entry, score
+        if best is None or best_score < self.threshold:
+            return None
+        with self._lock:
+            self.stats["hits"] += 1
+        return best, best_score
+
+    def _expire(self, scope: str, now: float) -> None:
+        """Drop a scope's entries older than the TTL. Caller holds the lock."""
+        entries = self._scopes.get(scope)
+        while entries and now - entries[0]["created"] > self.ttl:
+            entries.popleft()
+            self._size -= 1
+        if entries is not None and not entries:
+            del self._scopes[scope]
+
+    def _evict_oldest(self) -> None:
+        """Drop the oldest entry of any scope. Caller holds the lock."""
+        scope = min(self._scopes, key=lambda name: self._scopes[name][0]["created"])
+        self._scopes[scope].popleft()
+        self._size -= 1
+        if not self._scopes[scope]:
+            del self._scopes[scope]
+
+    def add(self, scope: str, prompt: str, response: str, model_key: str) -> None:
+        """Index an answered prompt."""
+        entry = {
+            "scope": scope,
+            "prompt": prompt,
+            "response": response,
+            "model": model_key,
+            "vector": self.embed(prompt),
+            "words": content_words(prompt),
+            "created": time.time(),
+        }
+        with self._lock:
+            self._expire(scope, entry["created"])
+            entries = self._scopes.setdefault(scope, deque())
+            entries.append(entry)
+            self._size += 1
+            self.stats["stores"] += 1
+            if len(entries) > self.max_per_scope:
+                entries.popleft()
+                self._size -= 1
+            while self._size > self.max_entries:
+                self._evict_oldest()
+
+    def should_audit(self) -> bool:
+        return random.random() < SEMANTIC_CACHE_AUDIT_RATE
+
+    def record_audit(self, prompt: str, entry: Dict[str, Any], fresh_response: str) -> bool:
+        """
+        Compare a freshly generated answer with the cached one served for ``prompt``.
+        Returns True (and keeps a sample) if the cached answer looks like a false hit.
+        """
+        score = similarity(self.embed(fresh_response), self.embed(entry["response"]))
+        false_hit = score < SEMANTIC_CACHE_AUDIT_THRESHOLD
+        with self._lock:
+            self.stats["audited"] += 1
+            if false_hit:
+                self.stats["false_hits"] += 1
+                self.false_hit_samples.append({
+                    "prompt": prompt,
+                    "matched_prompt": entry["prompt"],
+                    "answer_similarity": score,
+                })
+        if false_hit:
+            print(f"Semantic cache false hit: {prompt!r} matched {entry['prompt']!r} (answers {score:.2f} similar)")
+        return false_hit
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+            stats["entries"] = self._size
+            stats["scopes"] = len(self._scopes)
+            stats["hit_rate"] = stats["hits"] / stats["lookups"] if stats["lookups"] else 0.0
+            stats["false_hit_rate"] = stats["false_hits"] / stats["audited"] if stats["audited"] else 0.0
+            stats["false_hit_samples"] = list(self.false_hit_samples)
+            return stats
+
+
+def cache_scope(model_key: str, system_prompt: Optional[str], user_id: Optional[str] = None) -> str:
+    """
+    Entries only match prompts from the same user, sent to the same model with the same
+    system prompt: an answer (and the prompt it matched) is never shown to another user.
+    """
+    return f"{user_id or ''}\n{model_key}\n{system_prompt or ''}"
+
+
+def is_cacheable(call: Dict[str, Any]) -> bool:
+    """Only stand-alone text prompts are matched; prior turns or attachments change what a prompt means."""
+    return not call.get("message_history") and not any(
+        call.get(name) for name in ("image_data", "audio_data", "screen_data"))
+
+
+_cache: Optional[SemanticCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_semantic_cache() -> SemanticCache:
+    """Return the process-wide semantic cache, creating it on first use."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = SemanticCache()
+    return _cache
+
+
+def get_semantic_cache_stats() -> Dict[str, Any]:
+    """Lookups, hit rate and audited false-hit rate of the semantic cache."""
+    return get_semantic_cache().get_stats()
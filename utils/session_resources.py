@@ -0,0 +1,364 @@
+"""
+Session-scoped temp files and cleanup when sessions end.
+
+Recorders, TTS and voice commands used to leave temp files in the system temp
+directory, deleted only if the user pressed a reset button, so a long-running
+replica slowly filled its disk. Temp files are now made with ``new_temp_file()``
+in this process's own directory under SESSION_TEMP_DIR and tracked against the
+Streamlit session that made them. A janitor thread, started with the app:
+
+  - deletes a session's files, and runs the session-end hooks other modules
+    registered with ``on_session_end()`` (media store, generation jobs, ...), once
+    the session has disconnected,
+  - deletes files made outside any session once unused for SESSION_TEMP_TTL,
+  - deletes the directories of processes that have exited (at startup, leftovers
+    of the previous run), never those of other live processes, and
+  - trims the least recently used session-less files when this process's files
+    grow past SESSION_TEMP_MAX_MB. Files of connected sessions are never trimmed.
+"""
+import contextvars
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+SESSION_TEMP_DIR = os.environ.get("SESSION_TEMP_DIR") or os.path.join(tempfile.gettempdir(), "gemini-garden")
+SESSION_TEMP_TTL_SECONDS = float(os.environ.get("SESSION_TEMP_TTL", 3600))
+SESSION_TEMP_MAX_MB = float(os.environ.get("SESSION_TEMP_MAX_MB", 512))
+SESSION_JANITOR_SECONDS = float(os.environ.get("SESSION_JANITOR_SECONDS", 60))
+
+LOCAL_SESSION = "local"  # files made outside a Streamlit script run (background threads, scripts)
+
+_HOST = socket.gethostname()
+_PROCESS_TAG = f"{_HOST}-{os.getpid()}-{int(time.time())}"
+
+_working_for: contextvars.ContextVar = contextvars.ContextVar("working_for", default=None)
+
+
+def current_session_id() -> Optional[str]:
+    """
+    The id of the Streamlit session running on this thread (or that the work on it is
+    being done for, see ``run_for_session``), or None outside a script run.
+    """
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+    except ImportError:
+        return _working_for.get()
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx is not None else _working_for.get()
+
+
+def run_for_session(session_id: Optional[str], fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Call ``fn`` on a background thread on behalf of a session, so current_session_id() returns it."""
+    token = _working_for.set(session_id)
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        _working_for.reset(token)
+
+
+def session_alive(session_id: str) -> bool:
+    """Whether a Streamlit session is still connected (True when it cannot be told)."""
+    try:
+        from streamlit import runtime
+        if not runtime.exists():
+            return True
+        return runtime.get_instance().is_active_session(session_id)
+    except Exception:
+        return True  # if we cannot tell, never clean up someone's work
+
+
+def _last_used(path: str, created: float) -> float:
+    """When a file was last written (or created, if later)."""
+    try:
+        return max(created, os.path.getmtime(path))
+    except OSError:
+        return created
+
+
+def _remove(path: str) -> int:
+    """Delete a file, returning the bytes freed (0 if it was already gone)."""
+    try:
+        size = os.path.getsize(path)
+        os.remove(path)
+        return size
+    except OSError:
+        return 0
+
+
+# --- Per-process directories --- #
+
+def process_dir(root: str) -> str:
+    """This process's own directory under ``root``; other processes and replicas use their own."""
+    return os.path.join(root, _PROCESS_TAG)
+
+
+def _owner_alive(name: str) -> bool:
+    """Whether the process that made directory ``name`` (see process_dir) may still be using it."""
+    try:
+        host, pid, _ = name.rsplit("-", 2)
+        pid = int(pid)
+    except ValueError:
+        return False  # not a process directory: left by an older version
+    if host != _HOST or name == _PROCESS_TAG:
+        return True  # ours, or another machine's (which sweeps its own)
+    if pid == os.getpid():
+        return False  # an earlier process that had our pid (e.g. pid 1 in a restarted container)
+    if os.name == "nt":
+        return True  # os.kill cannot probe a process on Windows
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True  # exists, but belongs to another user
+    return True
+
+
+def sweep_dead_process_dirs(root: str) -> Tuple[int, int, int]:
+    """
+    Delete everything under ``root`` left by processes that have exited (and loose
+    files left by older versions), leaving directories of live processes alone.
+
+    Returns:
+        (files removed, bytes freed, bytes that could not be removed)
+    """
+    try:
+        names = os.listdir(root)
+    except OSError:
+        return 0, 0, 0
+    paths = []
+    for name in names:
+        path = os.path.join(root, name)
+        if not os.path.isdir(path):
+            paths.append(path)
+        elif not _owner_alive(name):
+            paths += [os.path.join(folder, file_name) for folder, _, files in os.walk(path) for file_name in files]
+    removed = freed = left = 0
+    for path in paths:
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            continue  # already gone
+        try:
+            os.remove(path)
+        except OSError as e:
+            print(f"Could not remove leftover file {path}: {e}")
+            left += size
+            continue
+        removed += 1
+        freed += size
+    for name in names:
+        path = os.path.join(root, name)
+        if os.path.isdir(path) and not _owner_alive(name):
+            shutil.rmtree(path, ignore_errors=True)
+    return removed, freed, left
+
+
+class SessionResources:
+    """Temp files per session, plus the hooks to run when a session ends."""
+
+    def __init__(self, directory: str = SESSION_TEMP_DIR, ttl: float = SESSION_TEMP_TTL_SECONDS,
+                 max_bytes: float = SESSION_TEMP_MAX_MB * 1024 * 1024):
+        self.root = directory
+        self.directory = process_dir(directory)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._files: Dict[str, Tuple[str, float]] = {}  # path -> (session, created)
+        self._hooks: List[Tuple[Callable[[str], Any], Optional[Callable[[], Iterable[str]]]]] = []
+        self._lock = threading.Lock()
+        self.stats = {"created": 0, "released": 0, "expired": 0, "swept": 0, "trimmed": 0,
+                      "sessions_ended": 0, "bytes_freed": 0}
+
+    # --- Temp files --- #
+
+    def new_temp_file(self, suffix: str = "", session_id: Optional[str] = None) -> str:
+        """Create an empty temp file owned by a session and return its path."""
+        session_id = session_id or current_session_id() or LOCAL_SESSION
+        os.makedirs(self.directory, exist_ok=True)
+        fd, path = tempfile.mkstemp(suffix=suffix, prefix=f"{session_id[:8]}-", dir=self.directory)
+        os.close(fd)
+        with self._lock:
+            self._files[path] = (session_id, time.time())
+            self.stats["created"] += 1
+        return path
+
+    def release(self, path: Optional[str]) -> None:
+        """Delete a temp file now (it is fine if it is already gone). Paths outside the temp directory are left alone."""
+        if not path or os.path.dirname(os.path.abspath(path)) != os.path.abspath(self.directory):
+            return
+        with self._lock:
+            tracked = self._files.pop(path, None) is not None
+            if tracked:
+                self.stats["released"] += 1
+        freed = _remove(path)
+        with self._lock:
+            self.stats["bytes_freed"] += freed
+
+    # --- Sessions --- #
+
+    def on_session_end(self, callback: Callable[[str], Any],
+                       sessions: Optional[Callable[[], Iterable[str]]] = None) -> None:
+        """
+        Run ``callback(session_id)`` whenever a session ends.
+
+        Args:
+            callback: Frees whatever the caller holds for the session.
+            sessions: Returns the sessions the caller holds something for, so the
+                janitor also watches sessions that have no temp files.
+        """
+        with self._lock:
+            self._hooks.append((callback, sessions))
+
+    def release_session(self, session_id: str) -> int:
+        """Delete a session's temp files and run the session-end hooks. Returns files deleted."""
+        with self._lock:
+            paths = [path for path, (owner, _) in self._files.items() if owner == session_id]
+            for path in paths:
+                del self._files[path]
+            hooks = list(self._hooks)
+            self.stats["sessions_ended"] += 1
+        freed = sum(_remove(path) for path in paths)
+        for callback, _ in hooks:
+            try:
+                callback(session_id)
+            except Exception as e:
+                print(f"Session cleanup hook {getattr(callback, '__qualname__', callback)} failed: {e}")
+        with self._lock:
+            self.stats["bytes_freed"] += freed
+        return len(paths)
+
+    def _known_sessions(self) -> List[str]:
+        with self._lock:
+            sessions = {owner for owner, _ in self._files.values()}
+            providers = [provider for _, provider in self._hooks if provider is not None]
+        for provider in providers:
+            try:
+                sessions.update(provider())
+            except Exception as e:
+                print(f"Could not list sessions for cleanup: {e}")
+        sessions.discard(LOCAL_SESSION)
+        return list(sessions)
+
+    # --- Janitor --- #
+
+    def sweep(self) -> Dict[str, int]:
+        """One janitor pass: ended sessions, idle session-less files, dead processes' directories, size cap."""
+        ended = [session_id for session_id in self._known_sessions() if not session_alive(session_id)]
+        for session_id in ended:
+            self.release_session(session_id)
+
+        # Files of live sessions go when their session ends. Files made outside a session
+        # have no session to end, so they go once unused for the TTL.
+        now = time.time()
+        with self._lock:
+            unowned = [(path, created) for path, (owner, created) in self._files.items() if owner == LOCAL_SESSION]
+        idle = sorted((_last_used(path, created), path) for path, created in unowned)
+        expired = {path for last_used, path in idle if now - last_used > self.ttl}
+        freed = self._forget_and_remove(list(expired))
+
+        swept, swept_bytes, _ = sweep_dead_process_dirs(self.root)
+        freed += swept_bytes
+
+        # Over the size cap, drop the least recently used session-less files; live sessions' files stay
+        trimmed = 0
+        total = self._tracked_bytes()
+        for last_used, path in idle:
+            if total <= self.max_bytes:
+                break
+            if path in expired:
+                continue
+            size = self._forget_and_remove([path])
+            total -= size
+            freed += size
+            trimmed += 1
+        if total > self.max_bytes:
+            print(f"Session temp files use {total / 1024 / 1024:.0f} MB, over SESSION_TEMP_MAX_MB; "
+                  "all of it belongs to connected sessions")
+
+        with self._lock:
+            self.stats["expired"] += len(expired)
+            self.stats["swept"] += swept
+            self.stats["trimmed"] += trimmed
+            self.stats["bytes_freed"] += freed
+        return {"sessions_ended": len(ended), "expired": len(expired), "swept": swept, "trimmed": trimmed}
+
+    def _forget_and_remove(self, paths: List[str]) -> int:
+        with self._lock:
+            for path in paths:
+                self._files.pop(path, None)
+        return sum(_remove(path) for path in paths)
+
+    def _tracked_bytes(self) -> int:
+        with self._lock:
+            paths = list(self._files)
+        total = 0
+        for path in paths:
+            try:
+                total += os.path.getsize(path)
+            except OSError:
+                pass
+        return total
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats, files=len(self._files),
+                         sessions=len({owner for owner, _ in self._files.values()}), hooks=len(self._hooks))
+        stats["bytes"] = self._tracked_bytes()
+        return stats
+
+
+def _janitor_loop(resources: SessionResources, interval: float) -> None:
+    while True:
+        try:
+            result = resources.sweep()
+            if any(result.values()):
+                print(f"Session janitor: {result}")
+        except Exception as e:
+            print(f"Session janitor pass failed: {e}")
+        time.sleep(interval)
+
+
+_resources: Optional[SessionResources] = None
+_resources_lock = threading.Lock()
+
+
+def get_session_resources() -> SessionResources:
+    """Get or create the process-wide session resource manager (starting the janitor, whose first pass runs at once)."""
+    global _resources
+    if _resources is None:
+        with _resources_lock:
+            if _resources is None:
+                _resources = SessionResources()
+                if SESSION_JANITOR_SECONDS > 0:
+                    threading.Thread(target=_janitor_loop, args=(_resources, SESSION_JANITOR_SECONDS), daemon=True,
+                                     name="session-janitor").start()
+    return _resources
+
+
+def start_session_janitor() -> None:
+    """Start the janitor now (once per process), so leftovers from a previous run are swept at startup."""
+    get_session_resources()
+
+
+def new_temp_file(suffix: str = "", session_id: Optional[str] = None) -> str:
+    """Create a temp file owned by the calling session (see SessionResources.new_temp_file)."""
+    return get_session_resources().new_temp_file(suffix, session_id)
+
+
+def release_temp_file(path: Optional[str]) -> None:
+    """Delete a temp file made with new_temp_file."""
+    get_session_resources().release(path)
+
+
+def on_session_end(callback: Callable[[str], Any], sessions: Optional[Callable[[], Iterable[str]]] = None) -> None:
+    """Register cleanup to run when a session ends (see SessionResources.on_session_end)."""
+    get_session_resources().on_session_end(callback, sessions)
+
+
+def get_session_resource_stats() -> Dict[str, Any]:
+    """Tracked temp files and sessions, and what the janitor has cleaned up so far."""
+    return get_session_resources().get_stats()
@@ -0,0 +1,155 @@
+"""
+In-flight request coalescing ("single flight").
+
+Identical deterministic requests that arrive while one is already being answered
+join that flight instead of making their own provider call. The first request's
+stream is pumped on a background thread into a shared buffer; every subscriber
+(including the first) reads the buffered chunks from the start and then follows
+the live stream, so late joiners still get the whole answer.
+
+A request joins (and, if it leads, starts the upstream call) only once its stream
+is first read, so a stream that is never read holds nothing. If every subscriber
+goes away before the answer is complete, the upstream call is stopped and the
+flight is dropped, so the next identical request starts afresh.
+"""
+import os
+import threading
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from utils.providers import ChatChunk
+from utils.tracing import run_in_context
+
+SINGLEFLIGHT_ENABLED = os.environ.get("SINGLEFLIGHT_ENABLED", "true").lower() in ("1", "true", "yes")
+
+
+class Flight:
+    """One upstream call shared by every identical request that joins it before it finishes."""
+
+    def __init__(self, key: str, open_stream: Callable[[Dict[str, Any]], Iterator[ChatChunk]]):
+        self.key = key
+        self.info: Dict[str, Any] = {}  # filled in by the upstream call (served model, usage, ...)
+        self.chunks: List[ChatChunk] = []
+        self.error: Optional[BaseException] = None
+        self.done = False
+        self.abandoned = False
+        self.subscribers = 0
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=run_in_context(self._pump), args=(open_stream,), daemon=True,
+                                        name=f"flight-{key[:8]}")
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def _pump(self, open_stream: Callable[[Dict[str, Any]], Iterator[ChatChunk]]) -> None:
+        iterator = None
+        try:
+            iterator = open_stream(self.info)
+            for chunk in iterator:
+                with self._cond:
+                    if self.abandoned:
+                        break
+                    self.chunks.append(chunk)
+                    self._cond.notify_all()
+        except BaseException as e:
+            self.error = e
+        finally:
+            if iterator is not None and hasattr(iterator, "close"):
+                try:
+                    iterator.close()
+                except Exception:
+                    pass
+            with self._cond:
+                self.done = True
+                self._cond.notify_all()
+            _land(self)
+
+    def subscribe(self, info: Dict[str, Any], follower: bool) -> Iterator[ChatChunk]:
+        """
+        Yield every chunk of the flight from the beginning. The subscriber slot must
+        already have been taken (``join_flight`` does so on the first read).
+        """
+        index = 0
+        try:
+            while True:
+                with self._cond:
+                    while index >= len(self.chunks) and not self.done:
+                        self._cond.wait()
+                    if index < len(self.chunks):
+                        chunk = self.chunks[index]
+                        index += 1
+                    elif self.error is not None:
+                        raise self.error
+                    else:
+                        break
+                if index == 1:
+                    info.update(self.info)
+                    if follower:
+                        info["coalesced"] = True
+                yield chunk
+            info.update(self.info)
+            if follower:
+                info["coalesced"] = True
+        finally:
+            _leave(self)
+
+
+# --- Registry --- #
+
+_flights: Dict[str, Flight] = {}
+_lock = threading.Lock()
+_stats = {"flights": 0, "coalesced": 0, "abandoned": 0}
+
+
+def _land(flight: Flight) -> None:
+    with _lock:
+        if _flights.get(flight.key) is flight:
+            del _flights[flight.key]
+
+
+def _leave(flight: Flight) -> None:
+    with _lock:
+        flight.subscribers -= 1
+        if flight.subscribers > 0 or flight.done:
+            return
+        # Nobody is listening any more: stop the upstream call and let the next request start over
+        if _flights.get(flight.key) is flight:
+            del _flights[flight.key]
+        _stats["abandoned"] += 1
+    with flight._cond:
+        flight.abandoned = True
+
+
+def join_flight(key: str, open_stream: Callable[[Dict[str, Any]], Iterator[ChatChunk]],
+                info: Dict[str, Any]) -> Iterator[ChatChunk]:
+    """
+    Stream the answer for ``key``, sharing an in-flight upstream call if there is one.
+
+    Nothing happens until the returned stream is first read: that is when the caller
+    joins a flight, or starts one.
+
+    Args:
+        key: Identity of the request (e.g. the response cache key).
+        open_stream: Starts the upstream call; receives the dict to record response
+            details in, which is copied into every subscriber's ``info``.
+        info: The caller's response_info. Followers also get ``"coalesced": True``.
+    """
+    with _lock:
+        flight = _flights.get(key)
+        follower = flight is not None
+        if flight is None:
+            flight = _flights[key] = Flight(key, open_stream)
+            _stats["flights"] += 1
+        else:
+            _stats["coalesced"] += 1
+        flight.subscribers += 1
+    if not follower:
+        flight.start()
+    yield from flight.subscribe(info, follower)
+
+
+def get_singleflight_stats() -> Dict[str, int]:
+    """Upstream calls made, requests that joined one instead, and flights abandoned midway."""
+    with _lock:
+        stats = dict(_stats)
+        stats["in_flight"] = len(_flights)
+        return stats
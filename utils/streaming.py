@@ -0,0 +1,263 @@
+"""
+Helpers for consuming response streams.
+"""
+import os
+import queue
+import threading
+import time
+from typing import Any, Callable, Iterator, List, Optional, Sequence, Tuple
+
+from utils.tracing import run_in_context
+
+STREAM_RENDER_INTERVAL_SECONDS = float(os.environ.get("STREAM_RENDER_INTERVAL_MS", 50)) / 1000
+STREAM_RENDER_MAX_CHARS = int(os.environ.get("STREAM_RENDER_MAX_CHARS", 2000))
+
+_DONE = object()
+
+
+class BackgroundStream:
+    """
+    Pump an iterator on a daemon thread so the caller can wait for its first item
+    with a timeout, race it against another stream, or abandon it.
+
+    Iterating a BackgroundStream yields the items in order and re-raises any error
+    the underlying iterator raised. ``cancel()`` stops the pump at the next item and
+    closes the underlying iterator (and with it the provider connection). Provider
+    calls made on the pump thread still hold a work pool call slot, so these threads
+    do not raise the number of calls in flight (see utils/work_pool.py).
+    """
+
+    def __init__(self, open_stream: Callable[[], Iterator[Any]], name: str = ""):
+        self.name = name
+        self.started_at = time.monotonic()
+        self.first_item_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.error: Optional[BaseException] = None
+        self.items = 0
+        self._queue: "queue.Queue" = queue.Queue()
+        self._first = threading.Event()
+        self._cancelled = threading.Event()
+        self._callbacks = []
+        self._callbacks_lock = threading.Lock()
+        self._watchers: List[threading.Event] = []
+        self._thread = threading.Thread(target=run_in_context(self._pump), args=(open_stream,), daemon=True,
+                                        name=f"stream-{name}" if name else None)
+        self._thread.start()
+
+    def _pump(self, open_stream: Callable[[], Iterator[Any]]) -> None:
+        iterator = None
+        try:
+            iterator = open_stream()
+            for item in iterator:
+                if self.first_item_at is None:
+                    self.first_item_at = time.monotonic()
+                    self._set_first()
+                if self._cancelled.is_set():
+                    break
+                self.items += 1
+                self._queue.put(item)
+        except BaseException as e:
+            self.error = e
+        finally:
+            if iterator is not None and hasattr(iterator, "close"):
+                try:
+                    iterator.close()
+                except Exception:
+                    pass
+            self.finished_at = time.monotonic()
+            self._set_first()
+            self._queue.put(_DONE)
+            with self._callbacks_lock:
+                callbacks, self._callbacks = self._callbacks, []
+            for callback in callbacks:
+                callback(self)
+
+    def _set_first(self) -> None:
+        with self._callbacks_lock:
+            self._first.set()
+            for event in self._watchers:
+                event.set()
+
+    def watch(self, event: threading.Event) -> None:
+        """Set ``event`` when the first item arrives or the stream ends (now, if it already has)."""
+        with self._callbacks_lock:
+            if self._first.is_set():
+                event.set()
+            else:
+                self._watchers.append(event)
+
+    def add_done_callback(self, callback: Callable[["BackgroundStream"], None]) -> None:
+        """Call ``callback(stream)`` when the pump finishes (immediately if it already has)."""
+        with self._callbacks_lock:
+            if not self.done:
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def wait_first(self, timeout: Optional[float] = None) -> bool:
+        """Wait until the first item arrives or the stream ends. False means it timed out."""
+        return self._first.wait(timeout)
+
+    @property
+    def failed_before_first_item(self) -> bool:
+        return self.first_item_at is None and self.error is not None
+
+    @property
+    def ttft(self) -> Optional[float]:
+        """Seconds from start to first item, if it has arrived."""
+        if self.first_item_at is None:
+            return None
+        return self.first_item_at - self.started_at
+
+    @property
+    def done(self) -> bool:
+        return self.finished_at is not None
+
+    def cancel(self) -> None:
+        """
+        Stop pumping at the next item. A call already blocked upstream cannot be interrupted,
+        but ``first_item_at`` is still recorded when that item arrives.
+        """
+        self._cancelled.set()
+
+    def take(self, timeout: Optional[float] = None) -> Tuple[List[Any], bool]:
+        """
+        Wait up to ``timeout`` for at least one item, then return every item already
+        queued without waiting further. The flag is True once the stream has ended.
+        """
+        items = []
+        try:
+            item = self._queue.get(timeout=timeout)
+            while True:
+                if item is _DONE:
+                    self._queue.put(_DONE)  # keep the end marker for later calls
+                    return items, True
+                items.append(item)
+                item = self._queue.get_nowait()
+        except queue.Empty:
+            return items, False
+
+    def __iter__(self) -> Iterator[Any]:
+        try:
+            while True:
+                item = self._queue.get()
+                if item is _DONE:
+                    break
+                yield item
+            if self.error is not None and not self._cancelled.is_set():
+                raise self.error
+        finally:
+            # The consumer went away early (e.g. the page reran): stop the upstream call too
+            if not self.done:
+                self.cancel()
+
+
+def first_of(streams: Sequence[BackgroundStream], timeout: Optional[float] = None) -> Optional[BackgroundStream]:
+    """
+    Wait for the first of several streams to produce an item.
+
+    Streams that fail before their first item are skipped while any other stream is
+    still pending. Returns the winner, the last stream to fail if all of them failed,
+    or None if ``timeout`` passed first.
+    """
+    event = threading.Event()
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        event.clear()
+        for stream in streams:
+            stream.watch(event)
+        started = [s for s in streams if s.first_item_at is not None]
+        if started:
+            return min(started, key=lambda s: s.first_item_at)
+        if all(s.done for s in streams):
+            return max(streams, key=lambda s: s.finished_at)
+        remaining = None if deadline is None else deadline - time.monotonic()
+        if remaining is not None and remaining <= 0:
+            return None
+        event.wait(remaining)
+
+
+
+# --- Rendering --- #
+
+def coalesce(chunks: Iterator[str], interval: float = STREAM_RENDER_INTERVAL_SECONDS,
+             max_chars: int = STREAM_RENDER_MAX_CHARS) -> Iterator[str]:
+    """
+    Join text chunks into batches of at most one per ``interval`` seconds (sooner once
+    ``max_chars`` are waiting), so a UI redraws per batch rather than per chunk.
+
+    Text is never held back for longer than ``interval``: the source is read on a
+    background thread, so a batch goes out on time even when the next chunk is slow.
+    Errors from ``chunks`` are re-raised after the text before them has been yielded.
+    """
+    stream = BackgroundStream(lambda: iter(chunks), name="coalesce")
+    try:
+        pending: List[str] = []
+        pending_chars = 0
+        last_flush = 0.0
+        while True:
+            timeout = None if not pending else max(0.0, last_flush + interval - time.monotonic())
+            items, ended = stream.take(timeout)
+            pending.extend(items)
+            pending_chars += sum(len(item) for item in items)
+            now = time.monotonic()
+            if pending and (ended or now - last_flush >= interval or pending_chars >= max_chars):
+                yield "".join(pending)
+                pending, pending_chars, last_flush = [], 0, now
+            if ended:
+                break
+        if stream.error is not None:
+            raise stream.error
+    finally:
+        if not stream.done:
+            stream.cancel()
+
+
+def _paragraph_end(text: str, start: int) -> int:
+    """
+    Index just past the last blank line in ``text[start:]`` that is not inside a code
+    fence (``text[:start]`` ends outside one), or ``start`` if there is none.
+    """
+    end = start
+    in_fence = False
+    position = start
+    for line in text[start:].splitlines(keepends=True):
+        position += len(line)
+        if line.lstrip().startswith("```"):
+            in_fence = not in_fence
+        elif not in_fence and not line.strip() and position < len(text):
+            end = position
+    return end
+
+
+def render_markdown_stream(container: Any, chunks: Iterator[str], interval: float = STREAM_RENDER_INTERVAL_SECONDS,
+                           max_chars: int = STREAM_RENDER_MAX_CHARS) -> str:
+    """
+    Render streamed markdown into a Streamlit container, redrawing at most once per
+    ``interval`` (see coalesce).
+
+    Finished paragraphs are written once into their own element and left alone; only
+    the paragraph still being written is redrawn. Each update therefore costs the size
+    of the last paragraph rather than of the whole answer so far.
+
+    Args:
+        container: Where to render: ``st`` (the enclosing ``with`` block) or any container.
+        chunks: Text chunks, e.g. a response stream or ``job.follow()``.
+        interval: Minimum seconds between redraws.
+        max_chars: Redraw early once this many characters are waiting.
+
+    Returns:
+        The full text.
+    """
+    text = ""
+    frozen = 0  # text[:frozen] is already rendered in finished elements
+    tail = container.empty()
+    for batch in coalesce(chunks, interval, max_chars):
+        text += batch
+        cut = _paragraph_end(text, frozen)
+        if cut > frozen:
+            tail.markdown(text[frozen:cut])
+            tail = container.empty()
+            frozen = cut
+        tail.markdown(text[frozen:])
+    return text
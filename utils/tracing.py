@@ -0,0 +1,329 @@
+"""
+Lightweight request tracing.
+
+Spans record how long each stage of a chat turn took (page rendering, router,
+provider stream, history storage) along with attributes such as model, tokens,
+bytes and cache outcome. Choose where they go with TRACING_EXPORTER:
+
+  none     (default) tracing is off and every call is a cheap no-op
+  console  one line per finished span on stdout
+  json     one JSON object per span appended to TRACING_FILE, using OpenTelemetry
+           field names (trace_id, span_id, parent_span_id, start/end_time_unix_nano)
+  otlp     forwarded to an OpenTelemetry SDK tracer with the OTLP exporter; needs the
+           opentelemetry-sdk and opentelemetry-exporter-otlp packages and honours the
+           standard OTEL_EXPORTER_OTLP_* variables
+
+Use ``span()`` as a context manager for ordinary code and ``trace_iter()`` for
+streams, which cannot hold a span open across yields. Threads started by
+BackgroundStream and the single-flight pump copy the caller's context, so their
+spans nest under the request that started them.
+"""
+import contextvars
+import functools
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional
+
+from utils.lazy import is_available, lazy_import
+
+TRACING_EXPORTER = os.environ.get("TRACING_EXPORTER", "none").lower()
+TRACING_FILE = os.environ.get("TRACING_FILE", "data/traces.jsonl")
+TRACING_SAMPLE_RATE = float(os.environ.get("TRACING_SAMPLE_RATE", 1.0))
+SERVICE_NAME = os.environ.get("OTEL_SERVICE_NAME", "gemini-garden")
+
+otel_trace = lazy_import("opentelemetry.trace")
+
+_current: "contextvars.ContextVar[Optional[Span]]" = contextvars.ContextVar("current_span", default=None)
+
+
+def _attribute_value(value: Any) -> Any:
+    """OpenTelemetry attributes must be primitives (or lists of them)."""
+    if value is None or isinstance(value, (str, bool, int, float)):
+        return value
+    if isinstance(value, (list, tuple)) and all(isinstance(v, (str, bool, int, float)) for v in value):
+        return list(value)
+    return str(value)
+
+
+class Span:
+    """A timed operation with attributes. Create spans with ``span()`` or ``start_span()``."""
+
+    def __init__(self, name: str, parent: Optional["Span"], attributes: Dict[str, Any]):
+        self.name = name
+        self.parent = parent
+        self.trace_id = parent.trace_id if parent else f"{random.getrandbits(128):032x}"
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.sampled = parent.sampled if parent else random.random() < TRACING_SAMPLE_RATE
+        self.attributes: Dict[str, Any] = {}
+        self.status = "OK"
+        self.error: Optional[str] = None
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self._otel = _exporter.start(self) if self.sampled else None
+        self.set_attributes(attributes)
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        if value is None:
+            return
+        value = _attribute_value(value)
+        self.attributes[key] = value
+        if self._otel is not None:
+            self._otel.set_attribute(key, value)
+
+    def set_attributes(self, attributes: Dict[str, Any]) -> None:
+        for key, value in attributes.items():
+            self.set_attribute(key, value)
+
+    def record_exception(self, exc: BaseException) -> None:
+        self.status = "ERROR"
+        self.error = f"{type(exc).__name__}: {exc}"
+        if self._otel is not None:
+            self._otel.record_exception(exc)
+            self._otel.set_status(otel_trace.Status(otel_trace.StatusCode.ERROR, str(exc)))
+
+    @property
+    def duration_ms(self) -> Optional[float]:
+        return (self.end_ns - self.start_ns) / 1e6 if self.end_ns else None
+
+    def end(self) -> None:
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if self.sampled:
+            _exporter.export(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent.span_id if self.parent else None,
+            "start_time_unix_nano": self.start_ns,
+            "end_time_unix_nano": self.end_ns,
+            "duration_ms": round(self.duration_ms, 3) if self.end_ns else None,
+            "status": self.status,
+            "error": self.error,
+            "attributes": self.attributes,
+            "service.name": SERVICE_NAME,
+        }
+
+
+class _NoopSpan:
+    """Stands in for a span when tracing is off."""
+    name = ""
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def set_attributes(self, attributes: Dict[str, Any]) -> None:
+        pass
+
+    def record_exception(self, exc: BaseException) -> None:
+        pass
+
+    def end(self) -> None:
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+# --- Exporters --- #
+
+class _Exporter:
+    enabled = False
+
+    def start(self, span: Span) -> Any:
+        return None
+
+    def export(self, span: Span) -> None:
+        pass
+
+
+class _ConsoleExporter(_Exporter):
+    enabled = True
+
+    def export(self, span: Span) -> None:
+        depth = 0
+        parent = span.parent
+        while parent is not None:
+            depth += 1
+            parent = parent.parent
+        status = "" if span.status == "OK" else f" [{span.error}]"
+        print(f"[trace {span.trace_id[:8]}] {'  ' * depth}{span.name} {span.duration_ms:.1f}ms "
+              f"{json.dumps(span.attributes, default=str)}{status}")
+
+
+class _JsonExporter(_Exporter):
+    enabled = True
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, span: Span) -> None:
+        line = json.dumps(span.to_dict(), default=str)
+        with self._lock:
+            try:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+            except OSError as e:
+                print(f"Could not write trace span: {e}")
+
+
+class _OtlpExporter(_Exporter):
+    """Mirrors our spans onto OpenTelemetry SDK spans, which the SDK batches to the collector."""
+    enabled = True
+
+    def __init__(self):
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+
+        provider = TracerProvider(resource=Resource.create({"service.name": SERVICE_NAME}))
+        provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+        self.tracer = provider.get_tracer("utils.tracing")
+
+    def start(self, span: Span) -> Any:
+        context = None
+        if span.parent is not None and span.parent._otel is not None:
+            context = otel_trace.set_span_in_context(span.parent._otel)
+        return self.tracer.start_span(span.name, context=context, start_time=span.start_ns)
+
+    def export(self, span: Span) -> None:
+        span._otel.end(end_time=span.end_ns)
+
+
+def _make_exporter() -> _Exporter:
+    if TRACING_EXPORTER == "console":
+        return _ConsoleExporter()
+    if TRACING_EXPORTER == "json":
+        return _JsonExporter(TRACING_FILE)
+    if TRACING_EXPORTER == "otlp":
+        if is_available("opentelemetry.sdk") and is_available("opentelemetry.exporter.otlp"):
+            return _OtlpExporter()
+        print("TRACING_EXPORTER=otlp needs opentelemetry-sdk and opentelemetry-exporter-otlp; tracing is off")
+    return _Exporter()
+
+
+_exporter = _make_exporter()
+
+
+def tracing_enabled() -> bool:
+    return _exporter.enabled
+
+
+# --- API --- #
+
+def current_span() -> Any:
+    """The active span, or a no-op span if there is none."""
+    return _current.get() or NOOP_SPAN
+
+
+def start_span(name: str, parent: Optional[Span] = None, **attributes: Any) -> Any:
+    """
+    Start a span without making it current; call ``end()`` on it when done.
+    Its parent is ``parent`` or else the currently active span.
+    """
+    if not _exporter.enabled:
+        return NOOP_SPAN
+    return Span(name, parent or _current.get(), attributes)
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Any]:
+    """Time the enclosed block as a child of the active span. Exceptions are recorded and re-raised."""
+    if not _exporter.enabled:
+        yield NOOP_SPAN
+        return
+    new_span = Span(name, _current.get(), attributes)
+    token = _current.set(new_span)
+    try:
+        yield new_span
+    except BaseException as e:
+        if not isinstance(e, GeneratorExit):
+            new_span.record_exception(e)
+        raise
+    finally:
+        _current.reset(token)
+        new_span.end()
+
+
+def trace_iter(name: str, iterable: Iterable, attributes: Optional[Dict[str, Any]] = None,
+               on_item: Optional[Callable[[Any, Any], None]] = None,
+               on_end: Optional[Callable[[Any], None]] = None) -> Iterator:
+    """
+    Trace consumption of a stream.
+
+    The span starts when the first item is requested, records time to first item and
+    the item count, and ends when the stream is exhausted, fails or is closed. It is
+    current only while the underlying iterator is running, so spans started by the
+    producer nest under it without leaking into the consumer between items.
+
+    Args:
+        name: Span name.
+        iterable: The stream to trace.
+        attributes: Initial span attributes.
+        on_item: Called with (span, item) for each item, e.g. to count tokens.
+        on_end: Called with the span just before it ends, e.g. to copy response details.
+    """
+    if not _exporter.enabled:
+        yield from iterable
+        return
+
+    stream_span = Span(name, _current.get(), attributes or {})
+    iterator = iter(iterable)
+    items = 0
+    try:
+        while True:
+            token = _current.set(stream_span)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                break
+            finally:
+                _current.reset(token)
+            if items == 0:
+                stream_span.set_attribute("ttft_ms", round((time.time_ns() - stream_span.start_ns) / 1e6, 3))
+            items += 1
+            if on_item is not None:
+                on_item(stream_span, item)
+            yield item
+    except GeneratorExit:
+        stream_span.set_attribute("cancelled", True)
+        raise
+    except BaseException as e:
+        stream_span.record_exception(e)
+        raise
+    finally:
+        if hasattr(iterator, "close"):
+            iterator.close()
+        stream_span.set_attribute("items", items)
+        if on_end is not None:
+            on_end(stream_span)
+        stream_span.end()
+
+
+def traced(name: str) -> Callable:
+    """Decorator form of ``span()`` for plain functions."""
+    def decorator(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def run_in_context(fn: Callable) -> Callable:
+    """Wrap a thread target so it runs with a copy of the caller's context (and active span)."""
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(fn, *args, **kwargs)
@@ -3,15 +3,20 @@ Text-to-Speech utilities using ElevenLabs API
 """
 import os
 import base64
-import tempfile
 import hashlib
 import streamlit as st
 from typing import Optional, Dict, List, Tuple, Any
+from utils.metrics import counter, histogram
+from utils.session_resources import new_temp_file, release_temp_file
 
 # Cache directory for storing generated audio
 CACHE_DIR = "data/tts_cache"
 os.makedirs(CACHE_DIR, exist_ok=True)
 
+TTS_CACHE_LOOKUPS = counter("gg_tts_cache_lookups_total", "Text-to-speech cache lookups by result.", ("result",))
+TTS_SECONDS = histogram("gg_tts_generate_seconds", "Time to synthesize speech with ElevenLabs.")
+TTS_ERRORS = counter("gg_tts_errors_total", "Failed text-to-speech generations.")
+
 # ElevenLabs API key
 ELEVENLABS_API_KEY = os.environ.get("ELEVENLABS_API_KEY")
 
@@ -159,10 +164,12 @@ def text_to_speech(
             with open(cache_path, 'rb') as f:
                 audio_bytes = f.read()
                 base64_audio = base64.b64encode(audio_bytes).decode('utf-8')
+                TTS_CACHE_LOOKUPS.labels("hit").inc()
                 return cache_path, base64_audio
         except Exception as e:
             print(f"Cache read error: {e}")
             # Continue to generate if cache read failed
+    TTS_CACHE_LOOKUPS.labels("miss" if use_cache else "bypass").inc()
     
     # Generate audio
     try:
@@ -176,23 +183,22 @@ def text_to_speech(
         client = globals()["eleven_client"]
         
         # Generate audio
-        audio_iterator = client.text_to_speech.convert(
-            text=text,
-            voice_id=voice_id,
-            model_id=model_id,
-            output_format="mp3_44100_128"
-        )
-        
-        # Convert iterator to bytes
-        audio_bytes = b"".join(audio_iterator)
+        with TTS_SECONDS.time():
+            audio_iterator = client.text_to_speech.convert(
+                text=text,
+                voice_id=voice_id,
+                model_id=model_id,
+                output_format="mp3_44100_128"
+            )
+            
+            # Convert iterator to bytes
+            audio_bytes = b"".join(audio_iterator)
         
         # Determine output path (cache or temporary)
         if use_cache:
             output_path = cache_path
         else:
-            temp_file = tempfile.NamedTemporaryFile(suffix=".mp3", delete=False)
-            output_path = temp_file.name
-            temp_file.close()
+            output_path = new_temp_file(".mp3")
         
         # Save the audio file
         with open(output_path, 'wb') as f:
@@ -204,6 +210,7 @@ def text_to_speech(
         return output_path, base64_audio
         
     except Exception as e:
+        TTS_ERRORS.inc()
         st.error(f"Error generating speech: {e}")
         return None, None
 
@@ -316,6 +323,8 @@ def render_play_button(message_text: str, key: str):
             )
             
             if audio_path:
+                if st.session_state[f"{player_key}_path"] != audio_path:
+                    release_temp_file(st.session_state[f"{player_key}_path"])  # a no-op for cached files
                 st.session_state[f"{player_key}_path"] = audio_path
                 st.session_state[f"{player_key}_show"] = True
     
@@ -6,36 +6,60 @@ from typing import Dict, Any, List, Optional, Callable
 from utils.voice_commands import get_voice_help_text
 from datetime import datetime
 import os
-from flask import Flask, request, Response
 
 UPLOAD_FOLDER = './uploads'
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-
-app = Flask(__name__)
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-
-@app.route('/upload', methods=['POST'])
-def upload_file():
-    """Handle file uploads and save them to the 'uploads' folder."""
-    if 'file' not in request.files:
-        return "No file part in the request", 400
-
-    file = request.files['file']
-    if file.filename == '':
-        return "No selected file", 400
-
-    file.save(os.path.join(app.config['UPLOAD_FOLDER'], file.filename))
-    return "File uploaded successfully!"
-
-@app.route('/stream', methods=['GET'])
-def stream_response():
-    """Stream chat responses in chunks with typing indicators."""
-    def generate_response():
-        yield "Typing...\n"
-        yield "Hello! How can I help you?\n"
-        yield "Let me know if you need anything else.\n"
-    
-    return Response(generate_response(), content_type='text/plain')
+
+_upload_app = None
+
+def create_upload_app():
+    """
+    Create the Flask app that serves file uploads and the demo stream endpoint.
+
+    Flask is imported here rather than at module level so Streamlit pages that only
+    use the UI helpers below do not pay for it.
+    """
+    global _upload_app
+    if _upload_app is not None:
+        return _upload_app
+
+    from flask import Flask, request, Response
+
+    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+
+    app = Flask(__name__)
+    app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+
+    @app.route('/upload', methods=['POST'])
+    def upload_file():
+        """Handle file uploads and save them to the 'uploads' folder."""
+        if 'file' not in request.files:
+            return "No file part in the request", 400
+
+        file = request.files['file']
+        if file.filename == '':
+            return "No selected file", 400
+
+        file.save(os.path.join(app.config['UPLOAD_FOLDER'], file.filename))
+        return "File uploaded successfully!"
+
+    @app.route('/stream', methods=['GET'])
+    def stream_response():
+        """Stream chat responses in chunks with typing indicators."""
+        def generate_response():
+            yield "Typing...\n"
+            yield "Hello! How can I help you?\n"
+            yield "Let me know if you need anything else.\n"
+
+        return Response(generate_response(), content_type='text/plain')
+
+    _upload_app = app
+    return app
+
+def __getattr__(name):
+    # `from utils.ui_components import app` still works; the app is built on first access
+    if name == "app":
+        return create_upload_app()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def render_voice_command_ui(
     voice_active: bool,
@@ -0,0 +1,427 @@
+"""
+Token usage and cost accounting.
+
+Every provider call is metered as it streams (see ``metered()``): token counts come
+from the usage the adapter reports on its final chunk, or are estimated from the text
+when a stream is cancelled or the provider reports none. Calls are attributed to the
+user on the request and to the conversation set with ``usage_scope()``, priced from
+MODEL_PRICES, and added to in-memory hourly rollups.
+
+Rollups are written by a background thread every USAGE_FLUSH_SECONDS (or sooner once
+USAGE_FLUSH_MAX_ROWS rollups are pending) with one batched upsert into the
+``usage_rollups`` table (docs/create_usage_table.sql), or appended to
+data/usage_rollups.jsonl when no PostgreSQL URL is configured. Requests never wait
+on a database write.
+
+Quotas: ``check_quota()`` runs the registered hooks before a request is routed. The
+built-in hook enforces USAGE_DAILY_TOKEN_LIMIT and USAGE_DAILY_COST_LIMIT per user
+(0 = unlimited); add others with ``add_quota_hook()``.
+"""
+import atexit
+import contextvars
+import datetime
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from utils.lazy import lazy_import
+from utils.metrics import counter
+from utils.providers.base import ChatChunk, ChatRequest, message_text
+from utils.rate_limit import ANONYMOUS_USER
+
+psycopg2 = lazy_import("psycopg2")
+
+USAGE_FLUSH_SECONDS = float(os.environ.get("USAGE_FLUSH_SECONDS", 30))
+USAGE_FLUSH_MAX_ROWS = int(os.environ.get("USAGE_FLUSH_MAX_ROWS", 500))
+USAGE_FILE = os.environ.get("USAGE_FILE", "data/usage_rollups.jsonl")
+DAILY_TOKEN_LIMIT = int(os.environ.get("USAGE_DAILY_TOKEN_LIMIT", 0))
+DAILY_COST_LIMIT = float(os.environ.get("USAGE_DAILY_COST_LIMIT", 0))
+
+# USD per million (input, output) tokens, keyed by provider model name
+DEFAULT_PRICES: Dict[str, Tuple[float, float]] = {
+    "gemini-1.5-pro": (1.25, 5.0),
+    "gemini-1.5-flash": (0.075, 0.30),
+    "gemini-2.0-flash": (0.10, 0.40),
+    "gemini-2.0-flash-001": (0.10, 0.40),
+    "gemini-2.5-pro-preview-03-25": (1.25, 10.0),
+    "claude-3-5-sonnet-20241022": (3.0, 15.0),
+    "gpt-4o": (2.50, 10.0),
+    "gpt-4-turbo": (10.0, 30.0),
+    "gpt-3.5-turbo": (0.50, 1.50),
+    "pplx-70b-online": (1.0, 1.0),
+    "pplx-70b-chat": (1.0, 1.0),
+}
+
+
+def _load_prices() -> Dict[str, Tuple[float, float]]:
+    prices = dict(DEFAULT_PRICES)
+    override = os.environ.get("MODEL_PRICES")
+    if override:
+        try:
+            prices.update({model: (float(p[0]), float(p[1])) for model, p in json.loads(override).items()})
+        except (ValueError, TypeError, IndexError) as e:
+            print(f"Ignoring invalid MODEL_PRICES: {e}")
+    return prices
+
+
+MODEL_PRICES = _load_prices()
+
+USAGE_TOKENS = counter("gg_usage_tokens_total", "Tokens consumed, by provider, model and kind.",
+                       ("provider", "model", "kind"))
+USAGE_COST = counter("gg_usage_cost_usd_total", "Estimated provider cost in USD.", ("provider", "model"))
+
+_conversation: "contextvars.ContextVar[Optional[str]]" = contextvars.ContextVar("usage_conversation", default=None)
+
+
+def price_of(model_name: str, input_tokens: int, output_tokens: int) -> float:
+    """Estimated USD cost of a call. Unknown models (such as the mock provider) cost nothing."""
+    input_price, output_price = MODEL_PRICES.get(model_name, (0.0, 0.0))
+    return (input_tokens * input_price + output_tokens * output_price) / 1_000_000
+
+
+def _estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1 if text else 0
+
+
+@contextmanager
+def usage_scope(conversation_id: Optional[str]) -> Iterator[None]:
+    """Attribute provider calls made inside the block (including from its worker threads) to a conversation."""
+    token = _conversation.set(str(conversation_id) if conversation_id is not None else None)
+    try:
+        yield
+    finally:
+        _conversation.reset(token)
+
+
+# --- Ledger --- #
+
+class UsageLedger:
+    """In-memory hourly rollups, flushed in batches by a background thread."""
+
+    def __init__(self, flush_seconds: float = USAGE_FLUSH_SECONDS, flush_max_rows: int = USAGE_FLUSH_MAX_ROWS):
+        self.flush_seconds = flush_seconds
+        self.flush_max_rows = flush_max_rows
+        self._pending: Dict[Tuple[str, str, str, str, str], Dict[str, float]] = {}
+        self._today: Dict[str, Dict[str, float]] = {}  # user -> totals for the current UTC day
+        self._by_model: Dict[str, Dict[str, float]] = {}  # model -> totals since start
+        self._day = datetime.datetime.utcnow().date()
+        self._seeded: set = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._table_ready = False
+        self.stats = {"recorded": 0, "estimated": 0, "flushes": 0, "rows_written": 0, "flush_errors": 0}
+        self._thread = threading.Thread(target=self._flush_loop, daemon=True, name="usage-flush")
+        self._thread.start()
+
+    def record(self, user_id: Optional[str], provider: str, model_name: str, input_tokens: int,
+               output_tokens: int, latency_seconds: float, estimated: bool = False,
+               conversation_id: Optional[str] = None) -> float:
+        """Add one provider call to the rollups. Returns its estimated cost in USD."""
+        user = str(user_id) if user_id else ANONYMOUS_USER
+        cost = price_of(model_name, input_tokens, output_tokens)
+        now = datetime.datetime.utcnow()
+        hour = now.replace(minute=0, second=0, microsecond=0).isoformat()
+        key = (hour, user, provider, model_name, conversation_id or "")
+        with self._lock:
+            self._roll_day(now)
+            row = self._pending.setdefault(key, {"requests": 0, "input_tokens": 0, "output_tokens": 0,
+                                                 "estimated_requests": 0, "cost_usd": 0.0, "latency_seconds": 0.0})
+            for totals in (row, self._today.setdefault(user, _empty_totals()),
+                           self._by_model.setdefault(model_name, _empty_totals())):
+                totals["requests"] += 1
+                totals["input_tokens"] += input_tokens
+                totals["output_tokens"] += output_tokens
+                totals["cost_usd"] += cost
+            row["latency_seconds"] += latency_seconds
+            row["estimated_requests"] += int(estimated)
+            self.stats["recorded"] += 1
+            self.stats["estimated"] += int(estimated)
+            pending = len(self._pending)
+        if pending >= self.flush_max_rows:
+            self._wake.set()
+
+        USAGE_TOKENS.labels(provider, model_name, "input").inc(input_tokens)
+        USAGE_TOKENS.labels(provider, model_name, "output").inc(output_tokens)
+        USAGE_COST.labels(provider, model_name).inc(cost)
+        return cost
+
+    def _roll_day(self, now: datetime.datetime) -> None:
+        """Start a new day's totals once midnight UTC has passed. Caller holds the lock."""
+        if now.date() != self._day:
+            self._day = now.date()
+            self._today.clear()
+            self._seeded.clear()
+
+    def user_today(self, user_id: Optional[str]) -> Dict[str, float]:
+        """Totals for a user since midnight UTC, including calls recorded by earlier processes once seeded."""
+        user = str(user_id) if user_id else ANONYMOUS_USER
+        # A user refused by a daily limit records nothing more, so the day must also roll over here
+        with self._lock:
+            self._roll_day(datetime.datetime.utcnow())
+        if user not in self._seeded:
+            self._seed_user(user)
+        with self._lock:
+            return dict(self._today.get(user) or _empty_totals())
+
+    def _seed_user(self, user: str) -> None:
+        """Add today's already-flushed usage from the database, once per user per day."""
+        persisted = _query_rows(
+            "SELECT COALESCE(SUM(requests), 0), COALESCE(SUM(input_tokens), 0), COALESCE(SUM(output_tokens), 0), "
+            "COALESCE(SUM(cost_usd), 0) FROM usage_rollups WHERE user_id = %s AND period_start >= %s",
+            (user, datetime.datetime.combine(self._day, datetime.time())),
+        )
+        with self._lock:
+            if user in self._seeded:
+                return
+            self._seeded.add(user)
+            if persisted:
+                # Rows still pending are counted in _today already and were not in the table yet
+                requests, input_tokens, output_tokens, cost = persisted[0]
+                totals = self._today.setdefault(user, _empty_totals())
+                totals["requests"] += int(requests)
+                totals["input_tokens"] += int(input_tokens)
+                totals["output_tokens"] += int(output_tokens)
+                totals["cost_usd"] += float(cost)
+
+    def rollup(self, by: str = "user") -> Dict[str, Dict[str, float]]:
+        """In-memory totals by "user" (today) or "model" (since this process started)."""
+        with self._lock:
+            self._roll_day(datetime.datetime.utcnow())
+            source = self._today if by == "user" else self._by_model
+            return {key: dict(values) for key, values in source.items()}
+
+    # --- Flushing --- #
+
+    def _flush_loop(self) -> None:
+        while True:
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self) -> int:
+        """Write pending rollups now. Returns the number of rows written."""
+        with self._lock:
+            rows, self._pending = self._pending, {}
+        if not rows:
+            return 0
+        try:
+            if _db_url():
+                self._write_db(rows)
+            else:
+                self._write_file(rows)
+        except Exception as e:
+            print(f"Could not flush {len(rows)} usage rollups: {e}")
+            with self._lock:
+                self.stats["flush_errors"] += 1
+                # Put them back so the next flush retries; merge with anything recorded since
+                for key, values in rows.items():
+                    row = self._pending.setdefault(key, {name: 0 for name in values})
+                    for name, value in values.items():
+                        row[name] += value
+            return 0
+        with self._lock:
+            self.stats["flushes"] += 1
+            self.stats["rows_written"] += len(rows)
+        return len(rows)
+
+    def _write_db(self, rows: Dict[Tuple[str, str, str, str, str], Dict[str, float]]) -> None:
+        conn = psycopg2.connect(_db_url())
+        try:
+            cursor = conn.cursor()
+            if not self._table_ready:
+                with open(_SCHEMA_PATH, "r", encoding="utf-8") as f:
+                    cursor.execute(f.read())
+                self._table_ready = True
+            cursor.executemany(_UPSERT, [
+                (hour, user, provider, model, conversation, int(v["requests"]), int(v["input_tokens"]),
+                 int(v["output_tokens"]), int(v["estimated_requests"]), v["cost_usd"], v["latency_seconds"])
+                for (hour, user, provider, model, conversation), v in rows.items()
+            ])
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _write_file(self, rows: Dict[Tuple[str, str, str, str, str], Dict[str, float]]) -> None:
+        directory = os.path.dirname(USAGE_FILE)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(USAGE_FILE, "a", encoding="utf-8") as f:
+            for (hour, user, provider, model, conversation), values in rows.items():
+                f.write(json.dumps({"period_start": hour, "user_id": user, "provider": provider, "model": model,
+                                    "conversation_id": conversation, **values}) + "\n")
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+            stats["pending_rows"] = len(self._pending)
+            stats["users_today"] = len(self._today)
+            return stats
+
+
+def _empty_totals() -> Dict[str, float]:
+    return {"requests": 0, "input_tokens": 0, "output_tokens": 0, "cost_usd": 0.0}
+
+
+def _db_url() -> Optional[str]:
+    return os.environ.get("POSTGRESQL_URL") or os.environ.get("DATABASE_URL")
+
+
+def _query_rows(sql: str, params: tuple) -> List[tuple]:
+    """Run a read-only query against the usage table; returns [] without a database or on error."""
+    if not _db_url():
+        return []
+    try:
+        conn = psycopg2.connect(_db_url())
+        try:
+            cursor = conn.cursor()
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+        finally:
+            conn.close()
+    except Exception as e:
+        print(f"Usage query failed: {e}")
+        return []
+
+
+_SCHEMA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                            "docs", "create_usage_table.sql")
+
+_UPSERT = """
+    INSERT INTO usage_rollups (period_start, user_id, provider, model, conversation_id, requests,
+                               input_tokens, output_tokens, estimated_requests, cost_usd, latency_seconds)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    ON CONFLICT (period_start, user_id, provider, model, conversation_id) DO UPDATE SET
+        requests = usage_rollups.requests + EXCLUDED.requests,
+        input_tokens = usage_rollups.input_tokens + EXCLUDED.input_tokens,
+        output_tokens = usage_rollups.output_tokens + EXCLUDED.output_tokens,
+        estimated_requests = usage_rollups.estimated_requests + EXCLUDED.estimated_requests,
+        cost_usd = usage_rollups.cost_usd + EXCLUDED.cost_usd,
+        latency_seconds = usage_rollups.latency_seconds + EXCLUDED.latency_seconds
+"""
+
+_ledger: Optional[UsageLedger] = None
+_ledger_lock = threading.Lock()
+
+
+def get_usage_ledger() -> UsageLedger:
+    """Get or create the process-wide usage ledger (starts its flush thread on first use)."""
+    global _ledger
+    if _ledger is None:
+        with _ledger_lock:
+            if _ledger is None:
+                _ledger = UsageLedger()
+                atexit.register(_ledger.flush)
+    return _ledger
+
+
+# --- Metering --- #
+
+def metered(provider: str, request: ChatRequest, chunks: Iterator[ChatChunk]) -> Iterator[ChatChunk]:
+    """
+    Pass a provider stream through, recording its usage once it finishes, fails or is closed.
+
+    Uses the token counts from the stream's usage chunk; without one (a cancelled hedge,
+    a provider that reports none) tokens are estimated from the prompt and streamed text.
+    """
+    started = time.monotonic()
+    usage = None
+    output_chars = 0
+    try:
+        for chunk in chunks:
+            if chunk.usage:
+                usage = chunk.usage
+            output_chars += len(chunk.text)
+            yield chunk
+    finally:
+        if usage:
+            input_tokens = int(usage.get("input_tokens") or 0)
+            output_tokens = int(usage.get("output_tokens") or 0)
+        else:
+            input_tokens = _estimate_tokens(request.prompt) + sum(_estimate_tokens(message_text(m))
+                                                                  for m in request.history)
+            output_tokens = output_chars // 4 + 1 if output_chars else 0
+        get_usage_ledger().record(request.user_id, provider, request.model_name, input_tokens, output_tokens,
+                                  time.monotonic() - started, estimated=not usage,
+                                  conversation_id=_conversation.get())
+
+
+def record_coalesced(user_id: Optional[str], provider: str, model_name: str, latency_seconds: float) -> None:
+    """
+    Record a request answered by another request's in-flight call (see utils/singleflight.py):
+    it counts as a request for the user, with no tokens since no call was made for it.
+    """
+    get_usage_ledger().record(user_id, provider, model_name, 0, 0, latency_seconds,
+                              conversation_id=_conversation.get())
+
+
+# --- Quotas --- #
+
+QuotaHook = Callable[[str, str, Dict[str, float]], Optional[str]]
+_quota_hooks: List[QuotaHook] = []
+
+
+def add_quota_hook(hook: QuotaHook) -> None:
+    """
+    Register a quota check. Hooks are called with (user, model_key, usage_today) before a
+    request is routed and return a reason string to refuse it, or None to allow it.
+    """
+    if hook not in _quota_hooks:
+        _quota_hooks.append(hook)
+
+
+def _daily_limits(user: str, model_key: str, today: Dict[str, float]) -> Optional[str]:
+    if DAILY_TOKEN_LIMIT and today["input_tokens"] + today["output_tokens"] >= DAILY_TOKEN_LIMIT:
+        return f"Daily token limit of {DAILY_TOKEN_LIMIT:,} reached. It resets at midnight UTC."
+    if DAILY_COST_LIMIT and today["cost_usd"] >= DAILY_COST_LIMIT:
+        return f"Daily spending limit of ${DAILY_COST_LIMIT:.2f} reached. It resets at midnight UTC."
+    return None
+
+
+if DAILY_TOKEN_LIMIT or DAILY_COST_LIMIT:
+    add_quota_hook(_daily_limits)
+
+
+def check_quota(user_id: Optional[str], model_key: str) -> Optional[str]:
+    """Run the quota hooks for a request. Returns the first refusal reason, or None if it may proceed."""
+    if not _quota_hooks:
+        return None
+    user = str(user_id) if user_id else ANONYMOUS_USER
+    today = get_usage_ledger().user_today(user)
+    for hook in _quota_hooks:
+        reason = hook(user, model_key, today)
+        if reason:
+            return reason
+    return None
+
+
+# --- Reporting --- #
+
+def get_usage_stats() -> Dict[str, Any]:
+    """Ledger counters plus today's per-user and per-model totals held in memory."""
+    ledger = get_usage_ledger()
+    stats = ledger.get_stats()
+    stats["by_user"] = ledger.rollup("user")
+    stats["by_model"] = ledger.rollup("model")
+    return stats
+
+
+def load_usage_rollups(group_by: str = "user", days: int = 7) -> List[Dict[str, Any]]:
+    """
+    Persisted totals for the last ``days`` days grouped by "user", "model" or "conversation",
+    most expensive first. Needs PostgreSQL; returns [] otherwise.
+    """
+    column = {"user": "user_id", "model": "model", "conversation": "conversation_id"}[group_by]
+    since = datetime.datetime.utcnow() - datetime.timedelta(days=days)
+    rows = _query_rows(
+        f"SELECT {column}, SUM(requests), SUM(input_tokens), SUM(output_tokens), SUM(cost_usd), "
+        f"SUM(latency_seconds) / NULLIF(SUM(requests), 0) FROM usage_rollups WHERE period_start >= %s "
+        f"GROUP BY {column} ORDER BY SUM(cost_usd) DESC",
+        (since,),
+    )
+    return [{group_by: key, "requests": int(requests), "input_tokens": int(input_tokens),
+             "output_tokens": int(output_tokens), "cost_usd": float(cost),
+             "avg_latency_seconds": float(latency) if latency is not None else None}
+            for key, requests, input_tokens, output_tokens, cost, latency in rows]
@@ -1,169 +1,380 @@
 """
 Vertex AI integration for models using service account authentication
+
+Clients are cached per (project, location, credentials source). Credentials are
+loaded once per source and refreshed in the background shortly before the access
+token expires, so requests after the first one do no setup work.
 """
 import os
 import json
-from google import genai
-from google.genai import types
 import base64
+import threading
+import time
+import datetime
+from typing import Any, Dict, Generator, Optional, Tuple
+from utils.lazy import lazy_import
+from utils.providers import ChatRequest, get_provider
+from utils.providers.base import sniff_mime
+from utils.rate_limit import permit
+from utils.resilience import stream_with_retry
+from utils.usage import metered
+from utils.work_pool import provider_slot
+
+# google-genai is imported the first time a Vertex model is used
+genai = lazy_import("google.genai")
+types = lazy_import("google.genai.types")
+google_auth = lazy_import("google.auth")
+google_auth_requests = lazy_import("google.auth.transport.requests")
+service_account = lazy_import("google.oauth2.service_account")
+
+SERVICE_ACCOUNT_PATH = os.environ.get("VERTEX_SERVICE_ACCOUNT", "service-account-key.json")
+VERTEX_LOCATION = os.environ.get("VERTEX_LOCATION", "us-central1")
+TOKEN_REFRESH_MARGIN_SECONDS = float(os.environ.get("VERTEX_TOKEN_REFRESH_MARGIN", 300))
+_SCOPES = ["https://www.googleapis.com/auth/cloud-platform"]
+
+
+# --- Client Cache --- #
+
+class _CachedCredentials:
+    """Credentials loaded once from a key file (or application default credentials) and kept fresh."""
+
+    def __init__(self, source: str):
+        self.source = source
+        if os.path.exists(source):
+            with open(source, "r") as f:
+                info = json.load(f)
+            self.credentials = service_account.Credentials.from_service_account_info(info, scopes=_SCOPES)
+            self.project = os.environ.get("GOOGLE_CLOUD_PROJECT") or info["project_id"]
+        else:
+            self.credentials, project = google_auth.default(scopes=_SCOPES)
+            self.project = os.environ.get("GOOGLE_CLOUD_PROJECT") or project
+            if not self.project:
+                raise RuntimeError(f"No service account key at {source} and no GOOGLE_CLOUD_PROJECT set")
+        self.refreshes = 0
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def _seconds_left(self) -> Optional[float]:
+        expiry = getattr(self.credentials, "expiry", None)
+        if not getattr(self.credentials, "token", None) or expiry is None:
+            return None
+        return (expiry - datetime.datetime.utcnow()).total_seconds()
+
+    def _refresh(self) -> None:
+        try:
+            self.credentials.refresh(google_auth_requests.Request())
+            self.refreshes += 1
+        except Exception as e:
+            print(f"Vertex AI token refresh failed for {self.source}: {e}")
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def ensure_fresh(self) -> None:
+        """
+        Fetch a token now if there is none (or it has expired); start a background refresh
+        if it expires within TOKEN_REFRESH_MARGIN_SECONDS, so no request waits on it.
+        """
+        seconds_left = self._seconds_left()
+        if seconds_left is not None and seconds_left > TOKEN_REFRESH_MARGIN_SECONDS:
+            return
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        if seconds_left is None or seconds_left <= 0:
+            self._refresh()
+        else:
+            threading.Thread(target=self._refresh, daemon=True, name="vertex-token-refresh").start()
+
+
+_credentials: Dict[str, _CachedCredentials] = {}
+_clients: Dict[Tuple[str, str, str], Any] = {}
+_client_lock = threading.Lock()
+_client_stats = {"hits": 0, "created": 0, "setup_seconds": 0.0}
+
+
+def get_vertex_client(location: Optional[str] = None, service_account_path: str = SERVICE_ACCOUNT_PATH):
+    """
+    Return the cached Vertex AI client for a region, creating it (and loading credentials) on first use.
+    Raises if credentials cannot be loaded.
+
+    Args:
+        location: Vertex AI region; defaults to VERTEX_LOCATION
+        service_account_path: Service account key file; application default credentials are used if it is missing
+    """
+    location = location or VERTEX_LOCATION
+    creds = _credentials.get(service_account_path)
+    if creds is not None:
+        client = _clients.get((creds.project, location, service_account_path))
+        if client is not None:
+            creds.ensure_fresh()
+            _client_stats["hits"] += 1
+            return client
+
+    with _client_lock:
+        started = time.perf_counter()
+        creds = _credentials.get(service_account_path)
+        if creds is None:
+            creds = _CachedCredentials(service_account_path)
+            _credentials[service_account_path] = creds
+        key = (creds.project, location, service_account_path)
+        client = _clients.get(key)
+        if client is None:
+            client = genai.Client(
+                vertexai=True,
+                project=creds.project,
+                location=location,
+                credentials=creds.credentials,
+            )
+            _clients[key] = client
+            _client_stats["created"] += 1
+            _client_stats["setup_seconds"] += time.perf_counter() - started
+    creds.ensure_fresh()
+    return client
 
-def initialize_vertex_ai(service_account_path="service-account-key.json"):
+
+def get_vertex_client_stats() -> Dict[str, Any]:
+    """Cached clients per region, cache hits and credential refreshes."""
+    with _client_lock:
+        stats = dict(_client_stats)
+        stats["clients"] = [f"{project}/{location}" for project, location, _ in _clients]
+        stats["token_refreshes"] = {source: creds.refreshes for source, creds in _credentials.items()}
+    return stats
+
+
+def initialize_vertex_ai(service_account_path=SERVICE_ACCOUNT_PATH, location=None):
     """
-    Initialize Vertex AI with service account credentials
-    
+    Get the Vertex AI client for a region (cached; see get_vertex_client)
+
     Args:
         service_account_path: Path to the service account JSON key file
+        location: Vertex AI region; defaults to VERTEX_LOCATION
+
+    Returns:
+        The client, or None if it could not be created
     """
-    # Read service account file
     try:
-        with open(service_account_path, 'r') as f:
-            service_account_info = json.load(f)
-            
-        # Initialize client with Vertex AI and project details
-        client = genai.Client(
-            vertexai=True,
-            project=service_account_info["project_id"],
-            location="us-central1",
-        )
-        return client
+        return get_vertex_client(location, service_account_path)
     except Exception as e:
         print(f"Error initializing Vertex AI: {e}")
         return None
 
+def _message_parts(msg: dict) -> list:
+    """Parts for one history message: its text, an attached "image", and any multimodal content items."""
+    parts = []
+    content = msg.get("content", "")
+    items = content if isinstance(content, list) else [content]
+    for item in items:
+        if isinstance(item, str):
+            if item:
+                parts.append(types.Part.from_text(text=item))
+        elif isinstance(item, dict) and item.get("data") and item.get("type") in ("image", "audio"):
+            data = base64.b64decode(item["data"])
+            default = "image/jpeg" if item["type"] == "image" else "audio/mp3"
+            parts.append(types.Part.from_bytes(data=data, mime_type=sniff_mime(data, default)))
+
+    # Add image if it exists in this message
+    if msg.get("image"):
+        image_bytes = base64.b64decode(msg["image"])
+        parts.append(types.Part.from_bytes(data=image_bytes, mime_type=sniff_mime(image_bytes, "image/jpeg")))
+    return parts or [types.Part.from_text(text="")]
+
+def build_vertex_contents(prompt: str, message_history: list, image_data=None, audio_data=None) -> list:
+    """
+    Format conversation history and the current prompt as Vertex AI contents
+
+    Args:
+        prompt: User's text prompt
+        message_history: Previous conversation history (messages may carry an "image",
+            or multimodal content lists as stored by Gemini Studio)
+        image_data: Optional base64 encoded image for the current prompt
+        audio_data: Optional base64 encoded audio for the current prompt
+
+    Returns:
+        List of types.Content
+    """
+    contents = []
+
+    # Add conversation history
+    for msg in message_history:
+        role = "user" if msg["role"] == "user" else "model"
+        contents.append(types.Content(role=role, parts=_message_parts(msg)))
+
+    # Add current prompt
+    parts = [types.Part.from_text(text=prompt)]
+
+    # Add image and audio data if provided
+    if image_data:
+        image_bytes = base64.b64decode(image_data)
+        parts.append(types.Part.from_bytes(data=image_bytes, mime_type=sniff_mime(image_bytes, "image/jpeg")))
+    if audio_data:
+        audio_bytes = base64.b64decode(audio_data)
+        parts.append(types.Part.from_bytes(data=audio_bytes, mime_type=sniff_mime(audio_bytes, "audio/wav")))
+
+    contents.append(types.Content(role="user", parts=parts))
+    return contents
+
+def _generation_config(temperature=0.7, max_output_tokens=1024, system_prompt=None):
+    return types.GenerateContentConfig(
+        temperature=temperature,
+        top_p=0.8,
+        max_output_tokens=max_output_tokens,
+        response_modalities=["TEXT"],
+        system_instruction=system_prompt,
+    )
+
+def _vertex_client(location=None):
+    client = initialize_vertex_ai(location=location)
+    if not client:
+        raise RuntimeError("Error initializing Vertex AI client")
+    return client
+
+def generate_vertex_content(contents: list, model_name: str, temperature=0.7, max_output_tokens=1024, system_prompt=None,
+                            location=None):
+    """
+    Run a single non-streaming generation in ``location`` (default VERTEX_LOCATION). Raises on any failure.
+
+    Returns:
+        The raw GenerateContentResponse
+    """
+    return _vertex_client(location).models.generate_content(
+        model=model_name,
+        contents=contents,
+        config=_generation_config(temperature, max_output_tokens, system_prompt)
+    )
+
+def stream_vertex_content(contents: list, model_name: str, temperature=0.7, max_output_tokens=1024, system_prompt=None,
+                          location=None):
+    """
+    Start a streaming generation in ``location`` (default VERTEX_LOCATION). Raises on any failure.
+
+    Returns:
+        An iterator of GenerateContentResponse chunks
+    """
+    return _vertex_client(location).models.generate_content_stream(
+        model=model_name,
+        contents=contents,
+        config=_generation_config(temperature, max_output_tokens, system_prompt)
+    )
+
+def vertex_chunk_text(chunk) -> str:
+    """The text carried by a response chunk (chunks may have no candidates or non-text parts)."""
+    if not chunk.candidates or not chunk.candidates[0].content or not chunk.candidates[0].content.parts:
+        return ""
+    return "".join(part.text for part in chunk.candidates[0].content.parts if getattr(part, "text", None))
+
+def vertex_usage(metadata) -> Optional[Dict[str, int]]:
+    """Token counts from a response's ``usage_metadata``, if it has any."""
+    if not metadata:
+        return None
+    return {
+        "input_tokens": metadata.prompt_token_count or 0,
+        "output_tokens": metadata.candidates_token_count or 0,
+    }
+
 def get_vertex_gemini_response(prompt: str, message_history: list, temperature=0.7, model_name="gemini-2.5-pro-preview-03-25", image_data=None):
     """
     Get response from Gemini model using Vertex AI
-    
+
     Args:
         prompt: User's text prompt
         message_history: Previous conversation history
         temperature: Generation temperature (0.0-1.0)
         model_name: Specific Gemini model name
         image_data: Optional base64 encoded image
-        
+
     Returns:
         Generated response text
     """
+    # Through the streaming path, so it shares its rate limit, call slot and usage accounting
+    text = "".join(get_vertex_gemini_streaming_response(
+        prompt, message_history, temperature=temperature, model_name=model_name, image_data=image_data,
+    ))
+    return text or "No response generated"
+
+def get_vertex_gemini_streaming_response(
+    prompt: str,
+    message_history: list,
+    temperature: float = 0.7,
+    model_name: str = "gemini-2.5-pro-preview-03-25",
+    image_data: Optional[str] = None,
+    audio_data: Optional[str] = None,
+    system_prompt: Optional[str] = None,
+    user_id: Optional[str] = None,
+    response_info: Optional[Dict[str, Any]] = None,
+    error_label: str = "Vertex AI Gemini model",
+) -> Generator[str, None, None]:
+    """
+    Stream a response from a Gemini model on Vertex AI, for use with st.write_stream
+
+    Args:
+        prompt: User's text prompt
+        message_history: Previous conversation history (may include images)
+        temperature: Generation temperature (0.0-1.0)
+        model_name: Specific Gemini model name
+        image_data: Optional base64 encoded image
+        audio_data: Optional base64 encoded audio
+        system_prompt: Optional system instruction
+        user_id: The app user, for rate limiting and usage accounting
+        response_info: Optional dict that receives the final "usage" once the stream ends
+        error_label: Names the model in the error message yielded on failure
+
+    Returns:
+        Generator yielding text deltas as they arrive
+    """
     try:
-        client = initialize_vertex_ai()
-        if not client:
-            return "Error initializing Vertex AI client"
-        
-        # Format conversation history for Vertex AI
-        contents = []
-        
-        # Add conversation history
-        for msg in message_history:
-            if msg["role"] == "user":
-                # For user messages
-                parts = [types.Part.from_text(text=msg["content"])]
-                
-                # Add image if it exists in this message
-                if "image" in msg and msg["image"]:
-                    image_bytes = base64.b64decode(msg["image"])
-                    parts.append(types.Part.from_data(data=image_bytes, mime_type="image/jpeg"))
-                    
-                contents.append(types.Content(role="user", parts=parts))
-            else:
-                # For assistant messages
-                contents.append(types.Content(
-                    role="model",
-                    parts=[types.Part.from_text(text=msg["content"])]
-                ))
-        
-        # Add current prompt
-        parts = [types.Part.from_text(text=prompt)]
-        
-        # Add image data if provided
-        if image_data:
-            image_bytes = base64.b64decode(image_data)
-            parts.append(types.Part.from_data(data=image_bytes, mime_type="image/jpeg"))
-            
-        contents.append(types.Content(role="user", parts=parts))
-        
-        # Configure generation parameters
-        generate_content_config = types.GenerateContentConfig(
+        request = ChatRequest(
+            model_name=model_name,
+            prompt=prompt,
+            history=message_history,
+            image_data=image_data,
+            audio_data=audio_data,
+            system_prompt=system_prompt,
             temperature=temperature,
-            top_p=0.8,
-            max_output_tokens=1024,
-            response_modalities=["TEXT"],
-        )
-        
-        # Generate content
-        response = client.models.generate_content(
-            model=model_name,
-            contents=contents,
-            generation_config=generate_content_config
+            user_id=user_id,
         )
-        
-        # Extract and return text response
-        if response.candidates and response.candidates[0].content and response.candidates[0].content.parts:
-            return response.candidates[0].content.parts[0].text
-        else:
-            return "No response generated"
-    
+        adapter = get_provider("vertex")
+        # Retried only until the first chunk arrives
+        with permit("vertex", model_name, user_id), provider_slot():
+            for chunk in metered("vertex", request, stream_with_retry("vertex", lambda: adapter.stream(request))):
+                if chunk.usage and response_info is not None:
+                    response_info["usage"] = chunk.usage
+                if chunk.text:
+                    yield chunk.text
     except Exception as e:
-        return f"Error with Vertex AI Gemini model: {str(e)}"
+        yield f"Error with {error_label}: {str(e)}"
+
+def get_vertex_live_streaming_response(prompt: str, message_history: list, model_name="gemini-2.0-flash-live-preview-04-09",
+                                       user_id=None, response_info=None) -> Generator[str, None, None]:
+    """
+    Stream a response from a Gemini Live model on Vertex AI
+
+    Args:
+        prompt: User's text prompt
+        message_history: Previous conversation history
+        model_name: Specific Gemini model name
+        user_id: The app user, for rate limiting and usage accounting
+        response_info: Optional dict that receives the final "usage" once the stream ends
+
+    Returns:
+        Generator yielding text deltas as they arrive
+    """
+    return get_vertex_gemini_streaming_response(
+        prompt, message_history, temperature=0.7, model_name=model_name, user_id=user_id,
+        response_info=response_info, error_label="Vertex AI Gemini Live model",
+    )
 
 def get_vertex_live_response(prompt: str, message_history: list, model_name="gemini-2.0-flash-live-preview-04-09"):
     """
     Get response from Gemini model using Vertex AI Live API
-    
+
     Args:
         prompt: User's text prompt
         message_history: Previous conversation history
         model_name: Specific Gemini model name
-        
+
     Returns:
         Generated response text
     """
-    try:
-        client = initialize_vertex_ai()
-        if not client:
-            return "Error initializing Vertex AI client"
-        
-        # Format conversation history for Vertex AI
-        contents = []
-        
-        # Add conversation history
-        for msg in message_history:
-            if msg["role"] == "user":
-                contents.append(types.Content(
-                    role="user",
-                    parts=[types.Part.from_text(text=msg["content"])]
-                ))
-            else:
-                contents.append(types.Content(
-                    role="model",
-                    parts=[types.Part.from_text(text=msg["content"])]
-                ))
-        
-        # Add current prompt
-        contents.append(types.Content(
-            role="user",
-            parts=[types.Part.from_text(text=prompt)]
-        ))
-        
-        # Generate content with streaming for live API
-        response_parts = []
-        for chunk in client.models.generate_content_stream(
-            model=model_name,
-            contents=contents,
-            generation_config=types.GenerateContentConfig(
-                temperature=0.7,
-                top_p=0.8,
-                max_output_tokens=1024,
-                response_modalities=["TEXT"],
-            )
-        ):
-            # Collect text chunks
-            if chunk.candidates:
-                for part in chunk.candidates[0].content.parts:
-                    if part.text:
-                        response_parts.append(part.text)
-        
-        # Combine all parts into full response
-        return "".join(response_parts)
-    
-    except Exception as e:
-        return f"Error with Vertex AI Gemini Live model: {str(e)}"
\ No newline at end of file
+    return "".join(get_vertex_live_streaming_response(prompt, message_history, model_name))
@@ -0,0 +1,168 @@
+"""
+Latency-aware region selection for Vertex AI.
+
+VERTEX_REGIONS lists the regions to spread Vertex calls over (default: just
+VERTEX_LOCATION, which keeps the single-region behaviour). Each call's time to
+first chunk is folded into a moving average per (model, region); calls go to a
+region picked at random with weight 1/latency², so the fastest region gets most
+traffic while the others keep being measured. Regions with no measurement yet
+are tried as if they were as fast as the best one.
+
+A quota (429) or availability (5xx) error before the first chunk fails the call
+over to the next region and cools the failing one down for VERTEX_REGION_COOLDOWN
+seconds. With VERTEX_REGION_PROBE_SECONDS set, a background thread also times a
+cheap count_tokens call against every region, which covers regions that have not
+served traffic recently.
+"""
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils.metrics import counter, gauge
+from utils.providers.base import ProviderError
+
+VERTEX_REGIONS = [r.strip() for r in os.environ.get("VERTEX_REGIONS", "").split(",") if r.strip()] or \
+    [os.environ.get("VERTEX_LOCATION", "us-central1")]
+REGION_COOLDOWN_SECONDS = float(os.environ.get("VERTEX_REGION_COOLDOWN", 60))
+PROBE_INTERVAL_SECONDS = float(os.environ.get("VERTEX_REGION_PROBE_SECONDS", 0))  # 0 = passive measurement only
+PROBE_MODEL = os.environ.get("VERTEX_REGION_PROBE_MODEL", "gemini-2.0-flash-001")
+EWMA_ALPHA = 0.2
+
+FAILOVER_STATUS_CODES = (429, 500, 502, 503, 504)
+_FAILOVER_MARKERS = ("RESOURCE_EXHAUSTED", "UNAVAILABLE", "quota")
+
+REGION_REQUESTS = counter("gg_vertex_region_requests_total", "Vertex AI calls by region and result.",
+                          ("region", "outcome"))
+REGION_LATENCY = gauge("gg_vertex_region_latency_seconds", "Moving average time to first chunk per region and model.",
+                       ("region", "model"))
+
+_PROBE_KEY = "__probe__"
+
+
+def should_fail_over(error: ProviderError) -> bool:
+    """Quota and availability errors are regional, so another region may well succeed."""
+    if error.status_code in FAILOVER_STATUS_CODES:
+        return True
+    return error.status_code is None and any(marker in str(error) for marker in _FAILOVER_MARKERS)
+
+
+class RegionPool:
+    """Tracks latency and health per region and orders regions for each call."""
+
+    def __init__(self, regions: List[str], cooldown_seconds: float = REGION_COOLDOWN_SECONDS):
+        self.regions = list(regions)
+        self.cooldown_seconds = cooldown_seconds
+        self._latency: Dict[Tuple[str, str], float] = {}  # (model, region) -> EWMA seconds
+        self._cooling_until: Dict[str, float] = {}
+        self._requests = {region: 0 for region in self.regions}
+        self._failures = {region: 0 for region in self.regions}
+        self._failovers = 0
+        self._lock = threading.Lock()
+        self._rng = random.Random()
+
+    def _estimate(self, model: str, region: str) -> Optional[float]:
+        return self._latency.get((model, region)) or self._latency.get((_PROBE_KEY, region))
+
+    def candidates(self, model: str) -> List[str]:
+        """
+        Regions to try for a call, in order: one drawn by latency weight among healthy
+        regions, then the other healthy regions fastest first, then cooling ones.
+        """
+        if len(self.regions) == 1:
+            return list(self.regions)
+        now = time.monotonic()
+        with self._lock:
+            healthy = [r for r in self.regions if self._cooling_until.get(r, 0) <= now]
+            cooling = sorted((r for r in self.regions if r not in healthy), key=lambda r: self._cooling_until[r])
+            if not healthy:
+                return cooling
+            estimates = {r: self._estimate(model, r) for r in healthy}
+        known = [e for e in estimates.values() if e]
+        best = min(known) if known else 1.0
+        weights = [1.0 / max(estimates[r] or best, 1e-3) ** 2 for r in healthy]
+        first = self._rng.choices(healthy, weights=weights)[0]
+        rest = sorted((r for r in healthy if r != first), key=lambda r: estimates[r] or best)
+        return [first] + rest + cooling
+
+    def record_success(self, model: str, region: str, ttft_seconds: float) -> None:
+        with self._lock:
+            self._observe(model, region, ttft_seconds)
+            self._requests[region] = self._requests.get(region, 0) + 1
+            self._cooling_until.pop(region, None)
+        REGION_REQUESTS.labels(region, "ok").inc()
+
+    def record_failure(self, model: str, region: str, error: ProviderError, failing_over: bool) -> None:
+        with self._lock:
+            self._requests[region] = self._requests.get(region, 0) + 1
+            self._failures[region] = self._failures.get(region, 0) + 1
+            if should_fail_over(error):
+                self._cooling_until[region] = time.monotonic() + self.cooldown_seconds
+            if failing_over:
+                self._failovers += 1
+        REGION_REQUESTS.labels(region, "failover" if failing_over else "error").inc()
+
+    def record_probe(self, region: str, seconds: float) -> None:
+        with self._lock:
+            self._observe(_PROBE_KEY, region, seconds)
+
+    def _observe(self, model: str, region: str, seconds: float) -> None:
+        key = (model, region)
+        previous = self._latency.get(key)
+        self._latency[key] = seconds if previous is None else (1 - EWMA_ALPHA) * previous + EWMA_ALPHA * seconds
+        REGION_LATENCY.labels(region, model).set(self._latency[key])
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            total = sum(self._requests.values())
+            regions = {}
+            for region in self.regions:
+                latencies = {model: round(value, 4) for (model, r), value in self._latency.items() if r == region}
+                regions[region] = {
+                    "requests": self._requests.get(region, 0),
+                    "share": self._requests.get(region, 0) / total if total else 0.0,
+                    "failures": self._failures.get(region, 0),
+                    "cooling_seconds": max(0.0, round(self._cooling_until.get(region, 0) - now, 1)),
+                    "latency_seconds": latencies,
+                }
+            return {"regions": regions, "failovers": self._failovers}
+
+
+# --- Probing --- #
+
+def _probe_loop(pool: RegionPool) -> None:
+    from utils.vertex_ai import get_vertex_client
+
+    while True:
+        for region in pool.regions:
+            started = time.monotonic()
+            try:
+                get_vertex_client(region).models.count_tokens(model=PROBE_MODEL, contents="ping")
+            except Exception as e:
+                print(f"Vertex AI probe of {region} failed: {e}")
+                continue
+            pool.record_probe(region, time.monotonic() - started)
+        time.sleep(PROBE_INTERVAL_SECONDS)
+
+
+_pool: Optional[RegionPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_region_pool() -> RegionPool:
+    """Get or create the process-wide region pool (starting the prober if enabled)."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = RegionPool(VERTEX_REGIONS)
+                if PROBE_INTERVAL_SECONDS > 0 and len(VERTEX_REGIONS) > 1:
+                    threading.Thread(target=_probe_loop, args=(_pool,), daemon=True, name="vertex-probe").start()
+    return _pool
+
+
+def get_region_stats() -> Dict[str, Any]:
+    """Per-region request share, failures, cooldown and latency averages per model."""
+    return get_region_pool().stats()
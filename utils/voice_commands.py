@@ -7,11 +7,14 @@ import os
 import time
 import threading
 import json
-import pyaudio
 import wave
-import tempfile
-import speech_recognition as sr
 from typing import Dict, List, Callable, Optional, Tuple
+from utils.lazy import lazy_import
+from utils.session_resources import new_temp_file, release_temp_file
+
+# Audio libraries are only imported once voice input is actually used
+pyaudio = lazy_import("pyaudio")
+sr = lazy_import("speech_recognition")
 
 # Command mapping: Maps spoken phrases to actions
 COMMAND_MAPPING = {
@@ -186,10 +189,8 @@ def record_voice_command(duration=3) -> Tuple[Optional[bytes], Optional[str]]:
     channels = 1
     sample_rate = 16000
     
-    # Create a temporary file
-    temp_file = tempfile.NamedTemporaryFile(suffix=".wav", delete=False)
-    temp_file_path = temp_file.name
-    temp_file.close()
+    # Create a temporary file (deleted with the session if nobody cleans it up)
+    temp_file_path = new_temp_file(".wav")
     
     p = None
     
@@ -231,8 +232,7 @@ def record_voice_command(duration=3) -> Tuple[Optional[bytes], Optional[str]]:
         
     except Exception as e:
         print(f"Error recording voice command: {str(e)}")
-        if os.path.exists(temp_file_path):
-            os.unlink(temp_file_path)
+        release_temp_file(temp_file_path)
         return None, None
         
     finally:
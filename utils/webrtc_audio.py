@@ -6,29 +6,23 @@ which offers better quality and real-time processing compared to basic
 audio recording.
 """
 
-import base64
-import numpy as np
 import streamlit as st
-import av
 from typing import List, Optional, Dict, Any, Tuple
 from datetime import datetime
-from streamlit_webrtc import (
-    webrtc_streamer,
-    WebRtcMode,
-    RTCConfiguration,
-    VideoProcessorBase,
-    AudioProcessorBase,
-    # ClientSettings # Removed this import as it caused an ImportError
-)
-import tempfile
 import os
 import time
 import uuid
+from utils.lazy import lazy_import
+from utils.media_store import set_media
+from utils.session_resources import new_temp_file, release_temp_file
 
-# Configure RTC for STUN servers
-RTC_CONFIGURATION = RTCConfiguration(
-    {"iceServers": [{"urls": ["stun:stun.l.google.com:19302"]}]} # Using Google's public STUN server
-)
+# WebRTC, PyAV and NumPy are only imported once a recorder or stream is rendered
+np = lazy_import("numpy")
+av = lazy_import("av")
+webrtc = lazy_import("streamlit_webrtc")
+
+# Configure RTC for STUN servers (webrtc_streamer accepts the plain dict form)
+RTC_CONFIGURATION = {"iceServers": [{"urls": ["stun:stun.l.google.com:19302"]}]} # Using Google's public STUN server
 
 # Define WebRTC client settings - Removed as ClientSettings import failed
 # WEBRTC_CLIENT_SETTINGS = ClientSettings(
@@ -53,9 +47,9 @@ def webcam_stream():
     """Start webcam streaming using WebRTC."""
     # Note: Requires ClientSettings or similar configuration to be passed if needed.
     # Currently relies on default settings or RTC_CONFIGURATION only.
-    webrtc_streamer(
+    webrtc.webrtc_streamer(
         key="webcam-stream",
-        mode=WebRtcMode.SENDRECV,
+        mode=webrtc.WebRtcMode.SENDRECV,
         rtc_configuration=RTC_CONFIGURATION, # Pass the RTC config
         # client_settings=WEBRTC_CLIENT_SETTINGS, # Removed due to import error
         video_frame_callback=video_frame_callback,
@@ -70,10 +64,12 @@ def tts_playback(text):
 
         # Generate TTS audio
         tts = gTTS(text)
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as tmp:
-            tts.save(tmp.name)
-            playsound(tmp.name)
-            os.unlink(tmp.name)
+        path = new_temp_file(".mp3")
+        try:
+            tts.save(path)
+            playsound(path)
+        finally:
+            release_temp_file(path)
     except ImportError:
         st.error("gTTS or playsound not installed. Cannot play TTS.")
     except Exception as e:
@@ -86,104 +82,126 @@ def screen_share():
     if screen_file:
         st.image(screen_file, caption="Shared Screen", use_column_width=True)
 
-class AudioProcessor(AudioProcessorBase):
-    """Audio processor for WebRTC streaming that saves audio frames to a buffer"""
-
-    def __init__(self, max_duration: int = 60):
-        """
-        Initialize the audio processor with the specified maximum duration
-
-        Args:
-            max_duration: Maximum recording duration in seconds
-        """
-        self.audio_buffer = []
-        self.sample_rate = 48000  # WebRTC typically uses 48kHz
-        self.channels = 1  # Mono audio
-        self.max_frames = max_duration * self.sample_rate
-        self.start_time = None
-        self.recording_complete = False
-        self.stopped = False
-        self.output_file = None
-
-        # Create a temporary file to store the audio
-        fd, self.output_path = tempfile.mkstemp(suffix=".wav")
-        os.close(fd)
-
-    def recv(self, frame: av.AudioFrame) -> av.AudioFrame:
-        """
-        Process each incoming audio frame
-
-        Args:
-            frame: Audio frame from WebRTC
-
-        Returns:
-            The unmodified audio frame
-        """
-        if self.stopped or self.recording_complete:
-            return frame
-
-        if self.start_time is None:
-            self.start_time = time.time()
-
-        # Convert frame to numpy array
-        sound_array = frame.to_ndarray()
-
-        # Append to buffer
-        self.audio_buffer.append(sound_array)
-
-        # Check if we've reached the maximum duration
-        total_samples = sum(len(chunk) for chunk in self.audio_buffer)
-        if total_samples >= self.max_frames:
-            self.recording_complete = True
-            self._save_audio()
-
-        return frame
-
-    def stop(self):
-        """Stop recording and save the audio file"""
-        if not self.stopped:
-            self.stopped = True
-            self._save_audio()
+_audio_processor_class = None
 
-    def _save_audio(self):
-        """Save the recorded audio to a WAV file"""
-        if not self.audio_buffer or self.output_file:
-             # Don't save if buffer is empty or already saved
-            return
-
-        try:
-            import soundfile as sf
-
-            # Concatenate all audio chunks
-            audio_data = np.concatenate(self.audio_buffer, axis=0)
-
-            # Save as WAV file
-            sf.write(
-                self.output_path,
-                audio_data,
-                self.sample_rate,
-                format='WAV'
-            )
+def get_audio_processor_class():
+    """
+    Return the AudioProcessor class, defining it on first use.
 
-            # Set the output file flag
-            self.output_file = self.output_path
-            print(f"Audio saved to: {self.output_path}") # Debug print
+    It subclasses streamlit_webrtc's AudioProcessorBase, so defining it at import time
+    would pull in streamlit_webrtc and PyAV for every page that imports this module.
+    """
+    global _audio_processor_class
+    if _audio_processor_class is not None:
+        return _audio_processor_class
+
+    class AudioProcessor(webrtc.AudioProcessorBase):
+        """Audio processor for WebRTC streaming that saves audio frames to a buffer"""
+
+        def __init__(self, max_duration: int = 60):
+            """
+            Initialize the audio processor with the specified maximum duration
+
+            Args:
+                max_duration: Maximum recording duration in seconds
+            """
+            self.audio_buffer = []
+            self.samples = 0  # recorded so far (the buffer is emptied once saved)
+            self.sample_rate = 48000  # WebRTC typically uses 48kHz
+            self.channels = 1  # Mono audio
+            self.max_frames = max_duration * self.sample_rate
+            self.start_time = None
+            self.recording_complete = False
+            self.stopped = False
+            self.output_file = None
+
+            # Create a temporary file to store the audio (deleted with the session)
+            self.output_path = new_temp_file(".wav")
+
+        def recv(self, frame: av.AudioFrame) -> av.AudioFrame:
+            """
+            Process each incoming audio frame
+
+            Args:
+                frame: Audio frame from WebRTC
+
+            Returns:
+                The unmodified audio frame
+            """
+            if self.stopped or self.recording_complete:
+                return frame
+
+            if self.start_time is None:
+                self.start_time = time.time()
+
+            # Convert frame to numpy array
+            sound_array = frame.to_ndarray()
+
+            # Append to buffer
+            self.audio_buffer.append(sound_array)
+            self.samples += len(sound_array)
+
+            # Check if we've reached the maximum duration
+            if self.samples >= self.max_frames:
+                self.recording_complete = True
+                self._save_audio()
 
-        except ImportError:
-            st.error("SoundFile library not installed. Cannot save audio.")
-        except Exception as e:
-            st.error(f"Error saving audio: {str(e)}")
+            return frame
 
-    @property
-    def recording_duration(self) -> float:
-        """Get the current recording duration in seconds"""
-        if self.start_time is None:
-            return 0
-        if self.stopped or self.recording_complete:
-            # Calculate duration based on buffer if stopped/completed
-            total_samples = sum(len(chunk) for chunk in self.audio_buffer)
-            return total_samples / self.sample_rate
-        return time.time() - self.start_time
+        def stop(self):
+            """Stop recording and save the audio file"""
+            if not self.stopped:
+                self.stopped = True
+                self._save_audio()
+
+        def _save_audio(self):
+            """Save the recorded audio to a WAV file"""
+            if not self.audio_buffer or self.output_file:
+                 # Don't save if buffer is empty or already saved
+                return
+
+            try:
+                import soundfile as sf
+
+                # Concatenate all audio chunks
+                audio_data = np.concatenate(self.audio_buffer, axis=0)
+
+                # Save as WAV file
+                sf.write(
+                    self.output_path,
+                    audio_data,
+                    self.sample_rate,
+                    format='WAV'
+                )
+
+                # Set the output file flag; the samples now live in the file only
+                self.output_file = self.output_path
+                self.audio_buffer = []
+                print(f"Audio saved to: {self.output_path}") # Debug print
+
+            except ImportError:
+                st.error("SoundFile library not installed. Cannot save audio.")
+            except Exception as e:
+                st.error(f"Error saving audio: {str(e)}")
+
+        @property
+        def recording_duration(self) -> float:
+            """Get the current recording duration in seconds"""
+            if self.start_time is None:
+                return 0
+            if self.stopped or self.recording_complete:
+                # Calculate duration based on samples recorded if stopped/completed
+                return self.samples / self.sample_rate
+            return time.time() - self.start_time
+
+    _audio_processor_class = AudioProcessor
+    return AudioProcessor
+
+def __getattr__(name):
+    # Keep `from utils.webrtc_audio import AudioProcessor` working
+    if name == "AudioProcessor":
+        return get_audio_processor_class()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def audio_recorder_ui(
@@ -206,7 +224,8 @@ def audio_recorder_ui(
         show_playback: Whether to show audio playback after recording
 
     Returns:
-        Base64-encoded audio data if recording is complete, None otherwise
+        A media store reference to the recording if it is complete, None otherwise
+        (resolve it with utils.media_store.resolve_media)
     """
     # Session state initialization
     data_key = f"{key}_data"
@@ -222,7 +241,7 @@ def audio_recorder_ui(
         st.session_state[duration_key] = durations[0]
     # Initialize processor only if needed
     if processor_key not in st.session_state or st.session_state[processor_key] is None:
-        st.session_state[processor_key] = AudioProcessor(max_duration=st.session_state[duration_key])
+        st.session_state[processor_key] = get_audio_processor_class()(max_duration=st.session_state[duration_key])
 
     # Display title and description
     st.subheader(title)
@@ -241,8 +260,10 @@ def audio_recorder_ui(
     if selected_duration != st.session_state[duration_key]:
         st.session_state[duration_key] = selected_duration
         # Recreate processor with new duration if it exists or if state is clear
-        st.session_state[processor_key] = AudioProcessor(max_duration=selected_duration)
-        st.session_state[data_key] = None # Clear previous data on duration change
+        if st.session_state.get(processor_key):
+            release_temp_file(st.session_state[processor_key].output_path)
+        st.session_state[processor_key] = get_audio_processor_class()(max_duration=selected_duration)
+        set_media(st.session_state, data_key, None) # Clear previous data on duration change
         st.session_state[file_path_key] = None
         st.rerun()
 
@@ -253,13 +274,13 @@ def audio_recorder_ui(
     with col1:
         # Make sure processor exists
         if processor_key not in st.session_state or st.session_state[processor_key] is None:
-             st.session_state[processor_key] = AudioProcessor(max_duration=st.session_state[duration_key])
+             st.session_state[processor_key] = get_audio_processor_class()(max_duration=st.session_state[duration_key])
 
         # Create the WebRTC streamer
         try:
-            webrtc_ctx = webrtc_streamer(
+            webrtc_ctx = webrtc.webrtc_streamer(
                 key=key, # Use the provided key
-                mode=WebRtcMode.SENDONLY,
+                mode=webrtc.WebRtcMode.SENDONLY,
                 audio_processor_factory=lambda: st.session_state[processor_key],
                 rtc_configuration=RTC_CONFIGURATION,
                 media_stream_constraints={"audio": True, "video": False},
@@ -291,7 +312,7 @@ def audio_recorder_ui(
                          try:
                              with open(processor.output_file, "rb") as f:
                                  audio_bytes = f.read()
-                                 st.session_state[data_key] = base64.b64encode(audio_bytes).decode("utf-8")
+                                 set_media(st.session_state, data_key, audio_bytes)
                              st.success("Recording complete!")
                          except Exception as e:
                              st.error(f"Error reading saved audio file: {e}")
@@ -311,15 +332,10 @@ def audio_recorder_ui(
             processor = st.session_state.get(processor_key)
             if processor:
                  processor.stop() # Ensure it stops
-                 if processor.output_path and os.path.exists(processor.output_path):
-                      try:
-                          os.remove(processor.output_path)
-                          print(f"Deleted temp file: {processor.output_path}")
-                      except OSError as e:
-                          print(f"Error deleting temp file {processor.output_path}: {e}")
+                 release_temp_file(processor.output_path)
 
             # Clear session state
-            st.session_state[data_key] = None
+            set_media(st.session_state, data_key, None)
             st.session_state[file_path_key] = None
             st.session_state[processor_key] = None # Force re-creation
 
@@ -332,9 +348,9 @@ def audio_recorder_ui(
         except Exception as e:
             st.error(f"Could not play audio file: {e}")
             # Potentially clear state if file is corrupted/unreadable
-            st.session_state[data_key] = None
+            set_media(st.session_state, data_key, None)
             st.session_state[file_path_key] = None
 
 
-    # Return base64-encoded audio data
+    # Return the media store reference to the recording
     return st.session_state.get(data_key)
@@ -0,0 +1,358 @@
+"""
+Shared, bounded worker pool for model requests.
+
+Without it every Streamlit script thread makes its provider call inline, so a burst
+of sessions turns into the same number of concurrent outbound requests. Page code
+instead submits its generation work here and reads the result through a handle:
+
+    handle = get_work_pool().stream(generate_chat_response, selected_model_key=..., ...)
+    full_response = st.write_stream(handle)
+
+WORK_POOL_WORKERS threads serve two lanes. Interactive work (a user waiting on an
+answer) is always taken first; background work (cache audits, summaries, ...) runs
+on at most WORK_POOL_BACKGROUND_WORKERS of the workers so it can never crowd out
+people. When WORK_POOL_MAX_QUEUE tasks are already waiting, submitting raises
+WorkPoolFull rather than growing the backlog without bound.
+
+The provider call itself may run on a helper thread of a task (fallback and hedge
+streams, single-flight pumps), so every outbound provider call also holds one of
+WORK_POOL_WORKERS call slots (``provider_slot()``) while it streams. However work
+is threaded, at most that many provider calls are in flight at once.
+
+Tasks remember the Streamlit session that submitted them. A reaper cancels the
+queued and running work of sessions that have disconnected, and a stream handle
+whose reader goes away (the page reran) stops its task at the next chunk.
+"""
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional
+
+from utils.metrics import counter, gauge, histogram
+from utils.providers.base import ProviderError
+from utils.session_resources import current_session_id, run_for_session, session_alive
+from utils.tracing import run_in_context
+
+WORK_POOL_WORKERS = int(os.environ.get("WORK_POOL_WORKERS", 16))
+WORK_POOL_BACKGROUND_WORKERS = int(os.environ.get("WORK_POOL_BACKGROUND_WORKERS", max(1, WORK_POOL_WORKERS // 4)))
+WORK_POOL_MAX_QUEUE = int(os.environ.get("WORK_POOL_MAX_QUEUE", 200))
+WORK_POOL_REAP_SECONDS = float(os.environ.get("WORK_POOL_REAP_SECONDS", 5))
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+LANES = (INTERACTIVE, BACKGROUND)
+
+QUEUE_DEPTH = gauge("gg_work_pool_queue_depth", "Tasks waiting for a worker.", ("lane",))
+ACTIVE_WORKERS = gauge("gg_work_pool_active", "Workers running a task.", ("lane",))
+QUEUE_WAIT = histogram("gg_work_pool_queue_wait_seconds", "Time tasks spent queued before a worker took them.",
+                       ("lane",))
+TASKS = counter("gg_work_pool_tasks_total", "Finished work pool tasks by lane and outcome.", ("lane", "outcome"))
+PROVIDER_CALLS = gauge("gg_work_pool_provider_calls", "Provider calls in flight (bounded by WORK_POOL_WORKERS).")
+SLOT_WAIT = histogram("gg_work_pool_slot_wait_seconds", "Time provider calls waited for a call slot.")
+
+_DONE = object()
+
+
+class WorkPoolFull(ProviderError):
+    """Raised when the pool's queue is full; the caller should ask the user to retry shortly."""
+
+
+class Task:
+    """A unit of work in the pool. ``future`` holds its return value or exception."""
+
+    def __init__(self, fn: Callable[[], Any], lane: str, session_id: Optional[str], name: str):
+        self.fn = fn
+        self.lane = lane
+        self.session_id = session_id
+        self.name = name
+        self.future: Future = Future()
+        self.cancelled = threading.Event()
+        self.enqueued_at = time.monotonic()
+        self.started_at: Optional[float] = None
+
+    def cancel(self) -> None:
+        """Drop the task if it is still queued; a running task sees ``cancelled`` and stops cooperatively."""
+        self.cancelled.set()
+        self.future.cancel()
+
+    def result(self, timeout: Optional[float] = None) -> Any:
+        return self.future.result(timeout)
+
+    @property
+    def done(self) -> bool:
+        return self.future.done()
+
+
+class StreamHandle:
+    """
+    Read side of a streaming task. Iterating it yields the task's items as they are
+    produced and re-raises the task's error; leaving the loop early cancels the task.
+    """
+
+    def __init__(self, task: Task):
+        self.task = task
+        self.items: "deque" = deque()
+        self._cond = threading.Condition()
+        self._finished = False
+        self.error: Optional[BaseException] = None
+
+    def _put(self, item: Any) -> None:
+        with self._cond:
+            if item is _DONE:
+                self._finished = True
+            elif not self._finished:
+                self.items.append(item)
+            self._cond.notify_all()
+
+    def cancel(self) -> None:
+        self.task.cancel()
+        self._put(_DONE)
+
+    @property
+    def done(self) -> bool:
+        return self._finished
+
+    def __iter__(self) -> Iterator[Any]:
+        try:
+            while True:
+                with self._cond:
+                    while not self.items and not self._finished:
+                        self._cond.wait()
+                    if self.items:
+                        item = self.items.popleft()
+                    else:
+                        break
+                yield item
+            if self.error is not None and not self.task.cancelled.is_set():
+                raise self.error
+        finally:
+            if not self._finished:
+                self.task.cancel()
+
+
+class WorkPool:
+    """Fixed set of worker threads serving an interactive and a background lane."""
+
+    def __init__(self, workers: int = WORK_POOL_WORKERS, background_workers: int = WORK_POOL_BACKGROUND_WORKERS,
+                 max_queue: int = WORK_POOL_MAX_QUEUE, reap_seconds: float = WORK_POOL_REAP_SECONDS):
+        self.workers = workers
+        self.background_workers = min(background_workers, workers)
+        self.max_queue = max_queue
+        self._queues: Dict[str, Deque[Task]] = {lane: deque() for lane in LANES}
+        self._running: Dict[str, List[Task]] = {lane: [] for lane in LANES}
+        self._cond = threading.Condition()
+        self._completed = {lane: 0 for lane in LANES}
+        self._rejected = 0
+        self._reaped = 0
+        self._slots = threading.BoundedSemaphore(workers)
+        self._calls = 0
+        for i in range(workers):
+            threading.Thread(target=self._work, daemon=True, name=f"work-pool-{i}").start()
+        if reap_seconds > 0:
+            threading.Thread(target=self._reap_loop, args=(reap_seconds,), daemon=True, name="work-pool-reaper").start()
+
+    # --- Submitting --- #
+
+    def submit(self, fn: Callable[..., Any], *args: Any, lane: str = INTERACTIVE,
+               session_id: Optional[str] = None, name: str = "", **kwargs: Any) -> Task:
+        """
+        Queue ``fn(*args, **kwargs)`` on a worker.
+
+        Args:
+            fn: The work. It runs with a copy of the caller's context (trace span, usage scope),
+                and current_session_id() returns the session it was submitted for.
+            lane: INTERACTIVE or BACKGROUND.
+            session_id: Streamlit session to tie the task to (default: the calling session).
+            name: Label for logs and stats.
+
+        Returns:
+            The Task; ``task.result()`` waits for the return value.
+
+        Raises:
+            WorkPoolFull: If WORK_POOL_MAX_QUEUE tasks are already waiting.
+        """
+        if lane not in LANES:
+            raise ValueError(f"Unknown work pool lane: {lane}")
+        session_id = session_id or current_session_id()
+        bound = run_in_context(run_for_session)
+        task = Task(lambda: bound(session_id, fn, *args, **kwargs), lane, session_id, name)
+        with self._cond:
+            if sum(len(q) for q in self._queues.values()) >= self.max_queue:
+                self._rejected += 1
+                TASKS.labels(lane, "rejected").inc()
+                raise WorkPoolFull("The server is busy; please try again shortly.", provider="work_pool",
+                                   status_code=429)
+            self._queues[lane].append(task)
+            QUEUE_DEPTH.labels(lane).set(len(self._queues[lane]))
+            self._cond.notify()
+        return task
+
+    def stream(self, open_stream: Callable[..., Iterator[Any]], *args: Any, lane: str = INTERACTIVE,
+               session_id: Optional[str] = None, name: str = "", **kwargs: Any) -> StreamHandle:
+        """
+        Run a generator on a worker and return a handle to iterate its items from the page.
+
+        ``open_stream(*args, **kwargs)`` is called on the worker, so the generator's work
+        (the provider call) happens there too. Pass plain values, not st.session_state
+        lookups: the worker has no script run context. Cancelling the task closes the
+        generator at the next item.
+        """
+        holder: Dict[str, StreamHandle] = {}
+
+        def pump() -> None:
+            handle = holder["handle"]
+            iterator = None
+            try:
+                iterator = open_stream(*args, **kwargs)
+                for item in iterator:
+                    if handle.task.cancelled.is_set():
+                        break
+                    handle._put(item)
+            except BaseException as e:
+                handle.error = e
+                raise
+            finally:
+                if iterator is not None and hasattr(iterator, "close"):
+                    try:
+                        iterator.close()
+                    except Exception:
+                        pass
+                handle._put(_DONE)
+
+        task = self.submit(pump, lane=lane, session_id=session_id, name=name)
+        handle = holder["handle"] = StreamHandle(task)
+        # A task cancelled while still queued never runs pump(), so end the stream here
+        task.future.add_done_callback(lambda f: handle._put(_DONE) if f.cancelled() else None)
+        return handle
+
+    # --- Workers --- #
+
+    def _next_task(self) -> Task:
+        """Interactive first; background only while it is under its share of the workers."""
+        with self._cond:
+            while True:
+                for lane in LANES:
+                    queue = self._queues[lane]
+                    if not queue:
+                        continue
+                    if lane == BACKGROUND and len(self._running[BACKGROUND]) >= self.background_workers:
+                        continue
+                    task = queue.popleft()
+                    QUEUE_DEPTH.labels(lane).set(len(queue))
+                    if not task.future.set_running_or_notify_cancel():
+                        TASKS.labels(lane, "cancelled").inc()
+                        continue
+                    self._running[lane].append(task)
+                    ACTIVE_WORKERS.labels(lane).set(len(self._running[lane]))
+                    return task
+                self._cond.wait()
+
+    def _work(self) -> None:
+        while True:
+            task = self._next_task()
+            task.started_at = time.monotonic()
+            QUEUE_WAIT.labels(task.lane).observe(task.started_at - task.enqueued_at)
+            outcome = "ok"
+            try:
+                task.future.set_result(task.fn())
+            except BaseException as e:
+                outcome = "error"
+                task.future.set_exception(e)
+            if task.cancelled.is_set():
+                outcome = "cancelled"
+            with self._cond:
+                self._running[task.lane].remove(task)
+                self._completed[task.lane] += 1
+                ACTIVE_WORKERS.labels(task.lane).set(len(self._running[task.lane]))
+                self._cond.notify()  # a background slot may have freed up
+            TASKS.labels(task.lane, outcome).inc()
+
+    # --- Provider call slots --- #
+
+    @contextmanager
+    def provider_slot(self) -> Iterator[None]:
+        """
+        Hold a call slot for the duration of one provider call, waiting for one if all
+        WORK_POOL_WORKERS are taken. Holders must not wait on other slots or pool tasks.
+        """
+        waited_from = time.monotonic()
+        self._slots.acquire()
+        SLOT_WAIT.observe(time.monotonic() - waited_from)
+        with self._cond:
+            self._calls += 1
+            PROVIDER_CALLS.set(self._calls)
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._calls -= 1
+                PROVIDER_CALLS.set(self._calls)
+            self._slots.release()
+
+    # --- Session cleanup --- #
+
+    def cancel_session(self, session_id: str) -> int:
+        """Cancel every queued and running task of a session. Returns how many were cancelled."""
+        with self._cond:
+            tasks = [t for lane in LANES for t in list(self._queues[lane]) + self._running[lane]
+                     if t.session_id == session_id]
+            for lane in LANES:
+                self._queues[lane] = deque(t for t in self._queues[lane] if t.session_id != session_id)
+                QUEUE_DEPTH.labels(lane).set(len(self._queues[lane]))
+        for task in tasks:
+            task.cancel()
+        return len(tasks)
+
+    def _reap_loop(self, interval: float) -> None:
+        while True:
+            time.sleep(interval)
+            with self._cond:
+                sessions = {t.session_id for lane in LANES for t in list(self._queues[lane]) + self._running[lane]
+                            if t.session_id}
+            for session_id in sessions:
+                if not session_alive(session_id):
+                    cancelled = self.cancel_session(session_id)
+                    self._reaped += cancelled
+                    print(f"Work pool: session {session_id[:8]} disconnected; cancelled {cancelled} task(s)")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            now = time.monotonic()
+            lanes = {}
+            for lane in LANES:
+                queue = self._queues[lane]
+                lanes[lane] = {
+                    "queued": len(queue),
+                    "running": len(self._running[lane]),
+                    "completed": self._completed[lane],
+                    "oldest_wait_seconds": round(now - queue[0].enqueued_at, 3) if queue else 0.0,
+                }
+            return {"workers": self.workers, "background_workers": self.background_workers, "lanes": lanes,
+                    "provider_calls": self._calls, "rejected": self._rejected, "reaped": self._reaped}
+
+
+_pool: Optional[WorkPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_work_pool() -> WorkPool:
+    """Get or create the process-wide work pool."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = WorkPool()
+    return _pool
+
+
+def provider_slot():
+    """Context manager holding one of the process-wide provider call slots (see WorkPool.provider_slot)."""
+    return get_work_pool().provider_slot()
+
+
+def get_work_pool_stats() -> Dict[str, Any]:
+    """Queue depth, running tasks and completions per lane."""
+    return get_work_pool().stats()